@@ -0,0 +1,308 @@
+"""
+Batch analysis of many positions. Positions are read lazily from EPD or PGN files (every position of every game
+for PGN), searched by a pool of worker processes at a fixed depth and/or node budget, and written out one JSON
+object per line with the best move, score, principal variation and node counts. Only a bounded number of positions
+are in flight at once, so memory use doesn't depend on the size of the input.
+
+python Analysis.py positions.epd -o results.jsonl --depth 3
+python Analysis.py games.pgn -o results.jsonl --nodes 20000 --workers 4
+python Analysis.py positions.epd -o results.jsonl --resume     carry on from the last position written
+python Analysis.py positions.epd --start 1000 --count 500      positions 1000 to 1499, results to stdout
+"""
+import argparse
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+import ChessEngine
+import SmartMoveFinder
+
+IN_FLIGHT_PER_WORKER = 8 # positions read ahead of the results written, per worker
+PROGRESS_INTERVAL = 5.0 # seconds between throughput reports on stderr
+
+'''
+The positions of an EPD file, one per line: yields (id, fen, operations). The FEN gets its move clocks from the
+hmvc/fmvn operations when they are there. id is the "id" operation or the line number
+'''
+def readEpd(lines):
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split(None, 4)
+        if len(fields) < 4:
+            continue
+        operations = parseEpdOperations(fields[4]) if len(fields) > 4 else {}
+        fen = " ".join(fields[:4]) + " %s %s" % (operations.get("hmvc", "0"), operations.get("fmvn", "1"))
+        yield operations.get("id", str(line_number)), fen, operations
+
+'''
+EPD operations ('bm Nf3 Nc3; id "test 1";') as a dict of opcode to operand string
+'''
+def parseEpdOperations(text):
+    operations = {}
+    for operation in re.findall(r'\s*([A-Za-z][A-Za-z0-9_]*)\s*((?:"[^"]*"|[^;])*);?', text):
+        opcode, operand = operation
+        operations[opcode] = operand.strip().strip('"')
+    return operations
+
+PGN_TOKEN = re.compile(r'\[[^\]]*\]|\{[^}]*\}|;[^\n]*|\$\d+|\(|\)|[^\s()]+')
+PGN_RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+'''
+Every position of every game in a PGN file, before each move and after the last one: yields (id, fen, operations)
+with id "<game number>:<ply>" and the move played from the position (in SAN) as the "pm" operation. Variations
+and comments are skipped. A game with a move that isn't legal is abandoned at that move
+'''
+def readPgn(lines, backend=None):
+    game_number = 0
+    headers = {}
+    movetext = []
+    for line in itertools.chain(lines, ["[Event \"\"]"]): # the sentinel header flushes the last game
+        stripped = line.strip()
+        if stripped.startswith('[') and movetext:
+            game_number += 1
+            yield from readPgnGame(game_number, headers, " ".join(movetext), backend)
+            headers = {}
+            movetext = []
+        if stripped.startswith('[') and stripped.endswith(']'):
+            match = re.match(r'\[(\w+)\s+"(.*)"\]', stripped)
+            if match:
+                headers[match.group(1)] = match.group(2)
+        elif stripped:
+            movetext.append(stripped)
+
+def readPgnGame(game_number, headers, movetext, backend=None):
+    gs = ChessEngine.newGameState(backend, headers.get("FEN", ChessEngine.START_FEN))
+    ply = 0
+    variation_depth = 0
+    for token in PGN_TOKEN.findall(movetext):
+        if token == '(':
+            variation_depth += 1
+        elif token == ')':
+            variation_depth -= 1
+        elif variation_depth > 0 or token[0] in '[{;$' or token in PGN_RESULTS or token[0].isdigit():
+            continue # move numbers, annotations and results
+        else:
+            move = findSanMove(gs, token)
+            if move is None:
+                print("game %d: can't play %s, skipping the rest of it" % (game_number, token), file=sys.stderr)
+                return
+            yield "%d:%d" % (game_number, ply), gs.toFen(), {"pm": token}
+            gs.makeMove(move)
+            ply += 1
+    yield "%d:%d" % (game_number, ply), gs.toFen(), {}
+
+'''
+The legal move in gs written in standard algebraic notation (Nf3, exd5, O-O, e8=Q+), None if there is none
+'''
+def findSanMove(gs, san):
+    san = san.rstrip("+#!?")
+    valid_moves = gs.getValidMoves()
+    if san in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        end_col = 6 if len(san) == 3 else 2
+        for move in valid_moves:
+            if move.is_castle_move and move.end_col == end_col:
+                return move
+        return None
+    promotion = None
+    if '=' in san:
+        san, promotion = san.split('=')
+        promotion = promotion[:1].upper()
+    elif len(san) > 2 and san[-1] in "QRBN" and san[-2] in "18":
+        san, promotion = san[:-1], san[-1] # e8Q
+    piece = san[0] if san[0] in "KQRBN" else 'p'
+    squares = san[1:] if piece != 'p' else san
+    squares = squares.replace('x', '').replace('-', '')
+    if len(squares) < 2 or squares[-2] not in ChessEngine.Move.filesToCols \
+            or squares[-1] not in ChessEngine.Move.ranksToRows:
+        return None
+    end_row, end_col = ChessEngine.Move.ranksToRows[squares[-1]], ChessEngine.Move.filesToCols[squares[-2]]
+    disambiguation = squares[:-2]
+    for move in valid_moves:
+        if move.piece_moved[1] != piece or move.end_row != end_row or move.end_col != end_col:
+            continue
+        if move.is_pawn_promotion and move.promotion_choice != (promotion or 'Q'):
+            continue
+        start = move.getRankFile(move.start_row, move.start_col)
+        if all(char in start for char in disambiguation):
+            return move
+    return None
+
+worker_settings = None # (backend, depth, node_limit) for the positions this process analyses
+worker_searcher = None
+
+def initWorker(backend, depth, node_limit, hash_size_mb):
+    global worker_settings, worker_searcher
+    worker_settings = (backend, depth, node_limit)
+    worker_searcher = SmartMoveFinder.Searcher(depth=depth, hash_size_mb=hash_size_mb, seed=0)
+
+'''
+Search one position, runs in a worker process. Returns the JSON line for it and the nodes searched
+'''
+def analysePosition(task):
+    index, position_id, fen, operations = task
+    backend, depth, node_limit = worker_settings
+    record = {"index": index, "id": position_id, "fen": fen}
+    try:
+        gs = ChessEngine.newGameState(backend, fen)
+    except ValueError as e:
+        record["error"] = str(e)
+        return json.dumps(record), 0
+    valid_moves = gs.getValidMoves()
+    scores = []
+    worker_searcher.iteration_callback = lambda iteration_depth, score: scores.append(score)
+    best_move = worker_searcher.findBestMoveIterativeDeepening(gs, valid_moves, node_limit=node_limit,
+                                                               max_depth=depth)
+    stats = worker_searcher.stats()
+    if best_move is None:
+        record["best_move"] = None
+        record["result"] = "checkmate" if gs.checkmate else "stalemate" if gs.stalemate else None
+    else:
+        record["best_move"] = best_move.getChessNotation()
+        record.update(scoreRecord(scores[-1] if scores else 0, stats["depth"]))
+        pv = []
+        for move_id in worker_searcher.principal_variation:
+            move = ChessEngine.Move.fromMoveID(move_id, gs)
+            pv.append(move.getChessNotation())
+            gs.makeMove(move)
+        for _ in pv:
+            gs.undoMove()
+        record["pv"] = pv
+        if "bm" in operations:
+            expected = [findSanMove(gs, san) for san in operations["bm"].split()]
+            record["solved"] = best_move in expected
+    record["depth"] = stats["depth"]
+    record["nodes"] = stats["nodes"]
+    record["quiescence_nodes"] = stats["quiescence_nodes"]
+    record["time"] = round(stats["time"], 4)
+    return json.dumps(record), stats["nodes"]
+
+'''
+The score from the side to move's point of view, in centipawns or as moves to mate like UCI reports it
+'''
+def scoreRecord(score, depth):
+    mate = SmartMoveFinder.mateMoves(score, depth)
+    if mate is not None:
+        return {"mate": mate}
+    return {"score_cp": score * 100}
+
+'''
+Number the positions and hold the reader back so at most `limit` are waiting in the pool. Pool.imap pulls its
+input from a separate thread as fast as it can, without this a huge file would be read into memory
+'''
+def boundedTasks(positions, start, semaphore):
+    for index, (position_id, fen, operations) in enumerate(positions):
+        if index < start:
+            continue # still parsed, PGN positions depend on the moves before them
+        semaphore.acquire()
+        yield index, position_id, fen, operations
+
+'''
+Open the output for appending after the last complete line, returns the file and how many lines it already has
+'''
+def openForResume(path):
+    if not os.path.exists(path):
+        return open(path, "w"), 0
+    with open(path, "rb+") as f:
+        data = f.read()
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            f.truncate(complete) # a line cut off by the interrupted run
+    return open(path, "a"), data.count(b"\n")
+
+def analyse(positions, output, workers, backend, depth, node_limit, hash_size_mb, start=0, count=None):
+    in_flight = max(workers, 1) * IN_FLIGHT_PER_WORKER
+    semaphore = threading.Semaphore(in_flight)
+    tasks = boundedTasks(positions, start, semaphore)
+    if count is not None:
+        tasks = itertools.islice(tasks, count)
+    initargs = (backend, depth, node_limit, hash_size_mb)
+    pool = None
+    if workers > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(workers, initializer=initWorker, initargs=initargs)
+        results = pool.imap(analysePosition, tasks)
+    else:
+        initWorker(*initargs)
+        results = map(analysePosition, tasks)
+    analysed = 0
+    nodes = 0
+    start_time = time.perf_counter()
+    last_report = start_time
+    try:
+        for line, position_nodes in results:
+            semaphore.release()
+            output.write(line + "\n")
+            analysed += 1
+            nodes += position_nodes
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_INTERVAL:
+                output.flush()
+                reportThroughput(analysed, nodes, now - start_time)
+                last_report = now
+    finally:
+        output.flush()
+        if pool is not None:
+            for _ in range(in_flight):
+                semaphore.release() # don't leave the pool's reader thread waiting when we stop early
+            pool.terminate()
+            pool.join()
+    reportThroughput(analysed, nodes, time.perf_counter() - start_time)
+    return analysed
+
+def reportThroughput(analysed, nodes, elapsed):
+    print("%d positions in %.1fs, %.1f positions/s, %.0f nodes/s"
+          % (analysed, elapsed, analysed / elapsed if elapsed else 0.0, nodes / elapsed if elapsed else 0.0),
+          file=sys.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyse the positions of an EPD or PGN file, writing JSON lines")
+    parser.add_argument("input", help="an .epd or .pgn file, - for EPD on stdin")
+    parser.add_argument("-o", "--output", help="JSONL file to write (default stdout)")
+    parser.add_argument("--format", choices=["epd", "pgn"], help="input format (default from the file extension)")
+    parser.add_argument("--depth", type=int, default=SmartMoveFinder.DEPTH, help="search depth per position")
+    parser.add_argument("--nodes", type=int, help="node budget per position, the search stops at whichever comes first")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--hash", type=int, default=SmartMoveFinder.TT_SIZE_MB, help="transposition table MB per worker")
+    parser.add_argument("--backend", choices=["mailbox", "bitboard"], help="defaults to $CHESS_BACKEND or mailbox")
+    parser.add_argument("--start", type=int, default=0, help="skip the positions before this index")
+    parser.add_argument("--count", type=int, help="analyse at most this many positions")
+    parser.add_argument("--resume", action="store_true",
+                        help="append to the output, starting after the positions it already has")
+    args = parser.parse_args(argv)
+    if args.resume and not args.output:
+        parser.error("--resume needs --output")
+    input_format = args.format or ("pgn" if args.input.lower().endswith(".pgn") else "epd")
+
+    input_file = sys.stdin if args.input == "-" else open(args.input)
+    start = args.start
+    if args.resume:
+        output, done = openForResume(args.output)
+        start += done
+        if done:
+            print("resuming at position %d" % start, file=sys.stderr)
+    else:
+        output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        positions = readPgn(input_file, args.backend) if input_format == "pgn" else readEpd(input_file)
+        count = args.count
+        if count is not None and args.resume:
+            count = max(count - (start - args.start), 0)
+        analyse(positions, output, args.workers, args.backend, args.depth, args.nodes, args.hash, start, count)
+    except KeyboardInterrupt:
+        print("interrupted, run again with --resume to carry on", file=sys.stderr)
+        return 1
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if input_file is not sys.stdin:
+            input_file.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+Micro-benchmarks for the engine's hot paths, each comparing the current code with the approach it replaced.
+
+python Benchmark.py attacks     cost of getValidMoves with squareUnderAttack by ray scans vs full move generation
+python Benchmark.py moves       memory per generated move and garbage collector work during a search
+python Benchmark.py eval        leaf evaluation from the running material total vs a full board scan
+python Benchmark.py ordering    alpha-beta nodes at a fixed depth with the move ordering pipeline vs shuffled moves
+python Benchmark.py quiescence  move chosen and nodes spent with a capture search at the horizon vs a plain cutoff
+python Benchmark.py parallel    fixed depth search time with the root moves split across 1, 2, 4, ... processes
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import ChessEngine
+import SmartMoveFinder
+
+# positions where castling is still available, so getCastleMoves asks squareUnderAttack up to five times a node
+CASTLING_POSITIONS = [
+    ("italian, both can castle", "r1bqk1nr/pppp1ppp/2n5/2b1p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4"),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"),
+    ("rooks and kings", "r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1"),
+]
+
+'''
+Time calls of fn() for about the given number of seconds, returns microseconds per call
+'''
+def timePerCall(fn, seconds=0.5):
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        for _ in range(20):
+            fn()
+        calls += 20
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return elapsed / calls * 1e6
+
+'''
+The old squareUnderAttack: generate every opponent move and look for one that ends on the square
+'''
+def squareUnderAttackByMoveGeneration(gs, r, c):
+    gs.white_to_move = not gs.white_to_move # switch to opponent's turn
+    opp_moves = gs.getAllPossibleMoves()
+    gs.white_to_move = not gs.white_to_move # switch turns back
+    for move in opp_moves:
+        if move.end_row == r and move.end_col == c:
+            return True
+    return False
+
+def benchmarkAttacks():
+    print("getValidMoves cost per node, squareUnderAttack by move generation vs by ray scans")
+    for name, fen in CASTLING_POSITIONS:
+        gs = ChessEngine.GameState.fromFen(fen)
+        direct = timePerCall(gs.getValidMoves)
+        old_gs = ChessEngine.GameState.fromFen(fen)
+        old_gs.squareUnderAttack = lambda r, c: squareUnderAttackByMoveGeneration(old_gs, r, c)
+        by_generation = timePerCall(old_gs.getValidMoves)
+        print("%-26s %8.1f us -> %8.1f us  (%.1fx faster)" % (name, by_generation, direct, by_generation / direct))
+
+def benchmarkMoves():
+    gs = ChessEngine.GameState.fromFen(CASTLING_POSITIONS[1][1])
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    move_lists = [gs.getValidMoves() for _ in range(100)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    num_moves = sum(len(moves) for moves in move_lists)
+    print("%.0f bytes per generated move (%d moves)" % (allocated / num_moves, num_moves))
+    del move_lists
+
+    gs = ChessEngine.GameState.fromFen(CASTLING_POSITIONS[0][1])
+    random.seed(0) # the search shuffles the root moves
+    gc.collect()
+    collections_before = [generation["collections"] for generation in gc.get_stats()]
+    start = time.perf_counter()
+    SmartMoveFinder.findBestMove(gs, gs.getValidMoves(), node_limit=3000)
+    elapsed = time.perf_counter() - start
+    collections = [generation["collections"] - before for generation, before in zip(gc.get_stats(), collections_before)]
+    print("3000 node search: %.2fs, garbage collections by generation %s" % (elapsed, collections))
+
+def benchmarkEval():
+    print("leaf evaluation, full 64 square scan vs incrementally kept material")
+    for name, fen in CASTLING_POSITIONS + [("king and pawn ending", "8/5k2/8/3p4/3P4/8/5K2/8 w - - 0 1")]:
+        gs = ChessEngine.GameState.fromFen(fen)
+        assert SmartMoveFinder.scoreBoard(gs) == SmartMoveFinder.scoreMaterial(gs.board)
+        full_scan = timePerCall(lambda: SmartMoveFinder.scoreMaterial(gs.board))
+        incremental = timePerCall(lambda: SmartMoveFinder.scoreBoard(gs))
+        print("%-26s %8.2f us -> %8.2f us  (%.0fx faster)" % (name, full_scan, incremental, full_scan / incremental))
+
+'''
+The order findBestMove used to search in: random
+'''
+def shuffledMoveOrdering(gs, valid_moves, ply, hash_move=None, pv_move=None):
+    valid_moves = list(valid_moves)
+    random.shuffle(valid_moves)
+    return valid_moves
+
+def countSearchNodes(fen, depth, ordering):
+    gs = ChessEngine.GameState.fromFen(fen)
+    SmartMoveFinder.transposition_table.clear()
+    SmartMoveFinder.move_ordering = ordering
+    SmartMoveFinder.DEPTH = depth
+    random.seed(0)
+    start = time.perf_counter()
+    SmartMoveFinder.findBestMove(gs, gs.getValidMoves())
+    return SmartMoveFinder.counter, time.perf_counter() - start
+
+def benchmarkOrdering(depth=4):
+    print("alpha-beta nodes at depth %d, shuffled moves vs ordered moves" % depth)
+    saved_ordering, saved_depth = SmartMoveFinder.move_ordering, SmartMoveFinder.DEPTH
+    try:
+        for name, fen in CASTLING_POSITIONS:
+            shuffled_nodes, shuffled_time = countSearchNodes(fen, depth, shuffledMoveOrdering)
+            ordered_nodes, ordered_time = countSearchNodes(fen, depth, SmartMoveFinder.orderMoves)
+            print("%-26s %8d nodes %6.2fs -> %8d nodes %6.2fs  (%.1fx fewer nodes)"
+                  % (name, shuffled_nodes, shuffled_time, ordered_nodes, ordered_time, shuffled_nodes / ordered_nodes))
+    finally:
+        SmartMoveFinder.move_ordering, SmartMoveFinder.DEPTH = saved_ordering, saved_depth
+
+# positions where stopping the search in the middle of an exchange picks a losing capture
+HORIZON_POSITIONS = [
+    ("queen takes defended f7", "rnbqkbnr/ppp2ppp/4p3/3p4/3P4/5Q2/PPP1PPPP/RNB1KBNR w KQkq - 0 3"),
+    ("knight takes defended e5", "r1bqk1nr/pppp1ppp/2n5/2b1p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4"),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"),
+]
+
+def benchmarkQuiescence(depth=1):
+    print("alpha-beta at depth %d, plain horizon vs quiescence search (nodes, of which quiescence nodes)" % depth)
+    saved_quiescence, saved_depth = SmartMoveFinder.QUIESCENCE_SEARCH, SmartMoveFinder.DEPTH
+    try:
+        for name, fen in HORIZON_POSITIONS:
+            results = []
+            for quiescence in (False, True):
+                SmartMoveFinder.QUIESCENCE_SEARCH = quiescence
+                SmartMoveFinder.DEPTH = depth
+                SmartMoveFinder.transposition_table.clear()
+                gs = ChessEngine.GameState.fromFen(fen)
+                random.seed(0)
+                start = time.perf_counter()
+                move = SmartMoveFinder.findBestMove(gs, gs.getValidMoves())
+                results.append((str(move), SmartMoveFinder.counter, SmartMoveFinder.quiescence_nodes,
+                                time.perf_counter() - start))
+            print("%-26s %-6s %6d nodes %6.2fs -> %-6s %6d nodes (%d quiescence) %6.2fs"
+                  % (name, results[0][0], results[0][1], results[0][3],
+                     results[1][0], results[1][1], results[1][2], results[1][3]))
+    finally:
+        SmartMoveFinder.QUIESCENCE_SEARCH, SmartMoveFinder.DEPTH = saved_quiescence, saved_depth
+
+def benchmarkParallel(depth=3):
+    cores = os.cpu_count() or 1
+    worker_counts = sorted({1, 2, 4, cores})
+    print("depth %d search, speedup over the serial search by number of worker processes (%d cores)" % (depth, cores))
+    saved_depth = SmartMoveFinder.DEPTH
+    SmartMoveFinder.DEPTH = depth
+    try:
+        for name, fen in CASTLING_POSITIONS:
+            timings = []
+            for workers in worker_counts:
+                gs = ChessEngine.GameState.fromFen(fen)
+                SmartMoveFinder.transposition_table.clear()
+                random.seed(0)
+                if workers > 1:
+                    SmartMoveFinder.getWorkerPool(workers) # don't time starting the processes
+                start = time.perf_counter()
+                move = SmartMoveFinder.findBestMove(gs, gs.getValidMoves(), workers=workers)
+                timings.append((workers, str(move), time.perf_counter() - start))
+            serial_time = timings[0][2]
+            print("%-26s " % name + "  ".join("%d: %s %.2fs (%.2fx)" % (workers, move, elapsed, serial_time / elapsed)
+                                              for workers, move, elapsed in timings))
+    finally:
+        SmartMoveFinder.DEPTH = saved_depth
+        SmartMoveFinder.closeWorkerPool()
+
+BENCHMARKS = {
+    "parallel": benchmarkParallel,
+    "quiescence": benchmarkQuiescence,
+    "ordering": benchmarkOrdering,
+    "eval": benchmarkEval,
+    "attacks": benchmarkAttacks,
+    "moves": benchmarkMoves,
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Engine micro-benchmarks")
+    parser.add_argument("benchmarks", nargs="*", help="any of " + ", ".join(sorted(BENCHMARKS)) + " (default: all)")
+    args = parser.parse_args(argv)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark " + name)
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        BENCHMARKS[name]()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
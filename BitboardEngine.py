@@ -0,0 +1,500 @@
+"""
+Bitboard move generation backend for the chess engine.
+GameState here keeps a 64 bit integer per piece (bit r*8 + c is set when that piece is on board[r][c]) next to the
+normal 8x8 board, and generates legal moves with precomputed attack tables instead of scanning the board square by
+square. It has the same makeMove/undoMove/getValidMoves contract and produces the same ChessEngine.Move objects as
+ChessEngine.GameState, so SmartMoveFinder and ChessMain work with either one (see ChessEngine.newGameState).
+"""
+import ChessEngine
+
+FULL = 0xFFFFFFFFFFFFFFFF
+PIECES = ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK')
+
+'''
+Swap the byte order of a 64 bit board, which mirrors it vertically (row r goes to row 7 - r)
+'''
+def flipVertical(bb):
+    return int.from_bytes(bb.to_bytes(8, 'little'), 'big')
+
+def onBoard(r, c):
+    return 0 <= r < 8 and 0 <= c < 8
+
+'''
+Build the bitboard of the squares reached from (r, c) by stepping once with each of the offsets
+'''
+def stepAttacks(r, c, offsets):
+    bb = 0
+    for dr, dc in offsets:
+        if onBoard(r + dr, c + dc):
+            bb |= 1 << ((r + dr)*8 + c + dc)
+    return bb
+
+'''
+Build the bitboard of every square on the line through (r, c) in direction (dr, dc) and its opposite, excluding (r, c)
+'''
+def lineMask(r, c, dr, dc):
+    bb = 0
+    for sign in (1, -1):
+        end_row, end_col = r + dr*sign, c + dc*sign
+        while onBoard(end_row, end_col):
+            bb |= 1 << (end_row*8 + end_col)
+            end_row += dr*sign
+            end_col += dc*sign
+    return bb
+
+KNIGHT_ATTACKS = [stepAttacks(sq // 8, sq % 8, ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)))
+                  for sq in range(64)]
+KING_ATTACKS = [stepAttacks(sq // 8, sq % 8, ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+                for sq in range(64)]
+# squares a pawn of the given colour standing on the square attacks
+PAWN_ATTACKS = {'w': [stepAttacks(sq // 8, sq % 8, ((-1, -1), (-1, 1))) for sq in range(64)],
+                'b': [stepAttacks(sq // 8, sq % 8, ((1, -1), (1, 1))) for sq in range(64)]}
+FILE_MASKS = [lineMask(sq // 8, sq % 8, 1, 0) for sq in range(64)]
+DIAGONAL_MASKS = [lineMask(sq // 8, sq % 8, 1, 1) for sq in range(64)]
+ANTI_DIAGONAL_MASKS = [lineMask(sq // 8, sq % 8, 1, -1) for sq in range(64)]
+FLIPPED_BITS = [flipVertical(1 << sq) for sq in range(64)]
+
+'''
+RANK_ATTACKS[col][inner] is the 8 bit set of columns a rook on col attacks along its rank, where inner is the 6 bit
+occupancy of columns 1-6 (the end squares are always attacked when reached, so they don't change the answer)
+'''
+def buildRankAttacks():
+    table = []
+    for col in range(8):
+        row = []
+        for inner in range(64):
+            occupied = inner << 1
+            attacks = 0
+            for step in (1, -1):
+                c = col + step
+                while 0 <= c < 8:
+                    attacks |= 1 << c
+                    if occupied & (1 << c):
+                        break
+                    c += step
+            row.append(attacks)
+        table.append(row)
+    return table
+
+RANK_ATTACKS = buildRankAttacks()
+
+'''
+BETWEEN[a][b] is the set of squares strictly between a and b when they share a rank, file or diagonal, else 0
+'''
+def buildBetween():
+    table = [[0] * 64 for _ in range(64)]
+    for a in range(64):
+        for dr, dc in ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)):
+            r, c = a // 8 + dr, a % 8 + dc
+            between = 0
+            while onBoard(r, c):
+                table[a][r*8 + c] = between
+                between |= 1 << (r*8 + c)
+                r += dr
+                c += dc
+    return table
+
+BETWEEN = buildBetween()
+
+'''
+Sliding attacks along a line with at most one square per rank, using hyperbola quintessence:
+subtracting the slider from the blockers on the line flips every bit up to and including the first blocker,
+doing the same on the byte-swapped board handles the other direction
+'''
+def lineAttacks(occupied, sq, mask):
+    forward = occupied & mask
+    reverse = flipVertical(forward)
+    forward = (forward - (1 << sq)) & FULL
+    reverse = (reverse - FLIPPED_BITS[sq]) & FULL
+    return (forward ^ flipVertical(reverse)) & mask
+
+def rankAttacks(occupied, sq):
+    shift = sq & 56 # first bit of the rank
+    return RANK_ATTACKS[sq & 7][(occupied >> (shift + 1)) & 63] << shift
+
+'''
+Only the squares between the slider and the edge of the board can block it, so these masks drop the edge squares
+from each line. The blockers inside the mask fully determine the attacks, which makes them the lookup key
+'''
+def relevantMask(sq, masks):
+    r, c = sq // 8, sq % 8
+    edges = 0
+    for i in range(8):
+        if r != 0: edges |= 1 << i # top rank
+        if r != 7: edges |= 1 << (56 + i) # bottom rank
+        if c != 0: edges |= 1 << (i*8) # a file
+        if c != 7: edges |= 1 << (i*8 + 7) # h file
+    mask = 0
+    for line_mask in masks:
+        mask |= line_mask
+    return mask & ~edges & FULL
+
+ROOK_RELEVANT = [relevantMask(sq, (FILE_MASKS[sq], lineMask(sq // 8, sq % 8, 0, 1))) for sq in range(64)]
+BISHOP_RELEVANT = [relevantMask(sq, (DIAGONAL_MASKS[sq], ANTI_DIAGONAL_MASKS[sq])) for sq in range(64)]
+# attack tables per square keyed by the relevant blockers, the dict doing the job a magic multiplier does in C.
+# They are filled in on first use (at most 4096 rook and 512 bishop keys a square) to keep import time low
+ROOK_TABLE = [{} for _ in range(64)]
+BISHOP_TABLE = [{} for _ in range(64)]
+
+def rookAttacks(occupied, sq):
+    key = occupied & ROOK_RELEVANT[sq]
+    attacks = ROOK_TABLE[sq].get(key)
+    if attacks is None:
+        attacks = ROOK_TABLE[sq][key] = lineAttacks(key, sq, FILE_MASKS[sq]) | rankAttacks(key, sq)
+    return attacks
+
+def bishopAttacks(occupied, sq):
+    key = occupied & BISHOP_RELEVANT[sq]
+    attacks = BISHOP_TABLE[sq].get(key)
+    if attacks is None:
+        attacks = BISHOP_TABLE[sq][key] = lineAttacks(key, sq, DIAGONAL_MASKS[sq]) | \
+                                          lineAttacks(key, sq, ANTI_DIAGONAL_MASKS[sq])
+    return attacks
+
+'''
+Index of the lowest set bit
+'''
+def bitScan(bb):
+    return (bb & -bb).bit_length() - 1
+
+'''
+Yield the index of every set bit
+'''
+def iterBits(bb):
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+class GameState(ChessEngine.GameState):
+    '''
+    Rebuild the piece and colour bitboards from self.board
+    '''
+    def loadBitboards(self):
+        bitboards = dict.fromkeys(PIECES, 0)
+        occupancy = {'w': 0, 'b': 0}
+        square = 1
+        for row in self.board:
+            for piece in row:
+                if piece != "--":
+                    bitboards[piece] |= square
+                    occupancy[piece[0]] |= square
+                square <<= 1
+        self.bitboards = bitboards
+        self.occupancy = occupancy
+
+    def loadFen(self, fen):
+        super().loadFen(fen)
+        self.loadBitboards()
+
+    def makeMove(self, move):
+        super().makeMove(move)
+        self.toggleMove(move)
+
+    def undoMove(self):
+        if len(self.move_log) != 0:
+            self.toggleMove(self.move_log[-1])
+            super().undoMove()
+
+    '''
+    Flip the bits a move changes. Doing it a second time takes the move back, so makeMove and undoMove share it
+    '''
+    def toggleMove(self, move):
+        bitboards = self.bitboards
+        occupancy = self.occupancy
+        color = move.piece_moved[0]
+        start_bit = 1 << (move.start_row*8 + move.start_col)
+        end_bit = 1 << (move.end_row*8 + move.end_col)
+        if move.is_pawn_promotion:
+            bitboards[move.piece_moved] ^= start_bit
+            bitboards[color + move.promotion_choice] ^= end_bit
+        else:
+            bitboards[move.piece_moved] ^= start_bit | end_bit
+        occupancy[color] ^= start_bit | end_bit
+        if move.piece_captured != "--":
+            captured_bit = 1 << (move.start_row*8 + move.end_col) if move.en_passant else end_bit
+            bitboards[move.piece_captured] ^= captured_bit
+            occupancy[move.piece_captured[0]] ^= captured_bit
+        if move.is_castle_move:
+            row = move.end_row*8
+            rook_bits = (1 << (row + 7)) | (1 << (row + 5)) if move.end_col == 6 else (1 << row) | (1 << (row + 3))
+            bitboards[color + 'R'] ^= rook_bits
+            occupancy[color] ^= rook_bits
+
+    '''
+    Bitboard of the pieces of the given colour that attack square sq, given the board occupancy
+    '''
+    def attackersOf(self, sq, color, occupied):
+        bitboards = self.bitboards
+        enemy = 'b' if color == 'w' else 'w'
+        attackers = (KNIGHT_ATTACKS[sq] & bitboards[color + 'N']) | (KING_ATTACKS[sq] & bitboards[color + 'K']) | \
+                    (PAWN_ATTACKS[enemy][sq] & bitboards[color + 'p'])
+        rooks = bitboards[color + 'R'] | bitboards[color + 'Q']
+        if rooks:
+            attackers |= rookAttacks(occupied, sq) & rooks
+        bishops = bitboards[color + 'B'] | bitboards[color + 'Q']
+        if bishops:
+            attackers |= bishopAttacks(occupied, sq) & bishops
+        return attackers
+
+    '''
+    Determine if the enemy can attack the square r, c
+    '''
+    def squareUnderAttack(self, r, c):
+        enemy_color = 'b' if self.white_to_move else 'w'
+        return self.attackersOf(r*8 + c, enemy_color, self.occupancy['w'] | self.occupancy['b']) != 0
+
+    '''
+    Returns the set of our pieces pinned to our king and, for each of them, the squares it may still move to
+    '''
+    def getPins(self, king_sq, ally_color, enemy_color, occupied):
+        bitboards = self.bitboards
+        enemy = self.occupancy[enemy_color]
+        # enemy sliders that would attack the king if none of our pieces were in the way
+        snipers = (rookAttacks(enemy, king_sq) & (bitboards[enemy_color + 'R'] | bitboards[enemy_color + 'Q'])) | \
+                  (bishopAttacks(enemy, king_sq) & (bitboards[enemy_color + 'B'] | bitboards[enemy_color + 'Q']))
+        pinned = 0
+        pin_rays = {}
+        for sniper_sq in iterBits(snipers):
+            blockers = BETWEEN[king_sq][sniper_sq] & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & self.occupancy[ally_color]:
+                pinned |= blockers
+                pin_rays[bitScan(blockers)] = BETWEEN[king_sq][sniper_sq] | (1 << sniper_sq)
+        return pinned, pin_rays
+
+    '''
+    All moves considering checks
+    '''
+    def getValidMoves(self):
+        return self.generateMoves(False)
+
+    '''
+    The masks make full legality nearly free here, so the pseudo-legal moves are just the legal ones (see
+    ChessEngine.GameState.getPseudoLegalMoves) and isLegal has nothing left to check
+    '''
+    def getPseudoLegalMoves(self):
+        return self.generateMoves(False)
+
+    def isLegal(self, move):
+        return True
+
+    '''
+    The legal moves that neither capture nor promote, straight from the bitboards: every target is masked with the
+    empty squares, so no capture is generated a second time. Only asked for when the side to move isn't in check
+    '''
+    def getQuietMoves(self):
+        moves = []
+        board = self.board
+        bitboards = self.bitboards
+        Move = ChessEngine.Move
+        if self.white_to_move:
+            ally_color, enemy_color, forward, start_row, promotion_row = 'w', 'b', -8, 6, 0
+        else:
+            ally_color, enemy_color, forward, start_row, promotion_row = 'b', 'w', 8, 1, 7
+        occupied = self.occupancy['w'] | self.occupancy['b']
+        empty = ~occupied & FULL
+        king_sq = bitScan(bitboards[ally_color + 'K'])
+        king_pos = (king_sq // 8, king_sq % 8)
+        for to_sq in iterBits(KING_ATTACKS[king_sq] & empty):
+            if not self.attackersOf(to_sq, enemy_color, occupied):
+                moves.append(Move(king_pos, (to_sq // 8, to_sq % 8), board))
+        pinned, pin_rays = self.getPins(king_sq, ally_color, enemy_color, occupied)
+        for sq in iterBits(bitboards[ally_color + 'N'] & ~pinned):
+            for to_sq in iterBits(KNIGHT_ATTACKS[sq] & empty):
+                moves.append(Move((sq // 8, sq % 8), (to_sq // 8, to_sq % 8), board))
+        queens = bitboards[ally_color + 'Q']
+        for sq in iterBits(bitboards[ally_color + 'B'] | queens):
+            targets = bishopAttacks(occupied, sq) & empty
+            if pinned & (1 << sq):
+                targets &= pin_rays[sq]
+            for to_sq in iterBits(targets):
+                moves.append(Move((sq // 8, sq % 8), (to_sq // 8, to_sq % 8), board))
+        for sq in iterBits(bitboards[ally_color + 'R'] | queens):
+            targets = rookAttacks(occupied, sq) & empty
+            if pinned & (1 << sq):
+                targets &= pin_rays[sq]
+            for to_sq in iterBits(targets):
+                moves.append(Move((sq // 8, sq % 8), (to_sq // 8, to_sq % 8), board))
+        for sq in iterBits(bitboards[ally_color + 'p']):
+            one_step = sq + forward
+            if not empty & (1 << one_step) or one_step // 8 == promotion_row:
+                continue
+            allowed = pin_rays[sq] if pinned & (1 << sq) else FULL
+            start = (sq // 8, sq % 8)
+            if allowed & (1 << one_step):
+                moves.append(Move(start, (one_step // 8, one_step % 8), board))
+                two_step = one_step + forward
+                if start[0] == start_row and empty & (1 << two_step):
+                    moves.append(Move(start, (two_step // 8, two_step % 8), board))
+        self.getCastleMoves(king_pos[0], king_pos[1], moves)
+        return moves
+
+    '''
+    Whether a move from elsewhere (the transposition table, killer moves) is possible here. The pseudo-legal
+    moves of this backend are the legal ones, so it has to be legal too: its bits are flipped to see whether that
+    leaves our king attacked
+    '''
+    def isPseudoLegal(self, move):
+        ally_color, enemy_color = ('w', 'b') if self.white_to_move else ('b', 'w')
+        piece = move.piece_moved
+        if piece[0] != ally_color:
+            return False
+        if move.is_castle_move:
+            moves = []
+            if not self.squareUnderAttack(move.start_row, move.start_col):
+                self.getCastleMoves(move.start_row, move.start_col, moves)
+            return any(castle.moveID == move.moveID for castle in moves)
+        bitboards = self.bitboards
+        occupied = self.occupancy['w'] | self.occupancy['b']
+        sq = move.start_row*8 + move.start_col
+        to_sq = move.end_row*8 + move.end_col
+        to_bit = 1 << to_sq
+        kind = piece[1]
+        if kind == 'p':
+            forward = -8 if ally_color == 'w' else 8
+            if move.start_col != move.end_col:
+                targets = PAWN_ATTACKS[ally_color][sq] & (self.occupancy[enemy_color] | (to_bit if move.en_passant else 0))
+            elif to_sq == sq + forward:
+                targets = to_bit & ~occupied
+            elif to_sq == sq + 2*forward and move.start_row == (6 if ally_color == 'w' else 1):
+                targets = 0 if occupied & ((1 << (sq + forward)) | to_bit) else to_bit
+            else:
+                targets = 0
+        elif kind == 'N':
+            targets = KNIGHT_ATTACKS[sq]
+        elif kind == 'K':
+            targets = KING_ATTACKS[sq]
+        elif kind == 'B':
+            targets = bishopAttacks(occupied, sq)
+        elif kind == 'R':
+            targets = rookAttacks(occupied, sq)
+        else:
+            targets = bishopAttacks(occupied, sq) | rookAttacks(occupied, sq)
+        if not targets & to_bit & ~self.occupancy[ally_color]:
+            return False
+        self.toggleMove(move)
+        safe = not self.attackersOf(bitScan(bitboards[ally_color + 'K']), enemy_color,
+                                    self.occupancy['w'] | self.occupancy['b'])
+        self.toggleMove(move)
+        return safe
+
+    '''
+    All captures and promotions, or every evasion when in check, for the quiescence search
+    '''
+    def getCaptureMoves(self):
+        return self.generateMoves(True)
+
+    '''
+    Legal move generation. With captures_only the quiet moves are never generated, except that a side in check
+    gets every evasion so the search can still see checkmate
+    '''
+    def generateMoves(self, captures_only):
+        moves = []
+        board = self.board
+        bitboards = self.bitboards
+        Move = ChessEngine.Move
+        if self.white_to_move:
+            ally_color, enemy_color, forward, start_row = 'w', 'b', -8, 6
+        else:
+            ally_color, enemy_color, forward, start_row = 'b', 'w', 8, 1
+        own = self.occupancy[ally_color]
+        enemy = self.occupancy[enemy_color]
+        occupied = own | enemy
+        empty = ~occupied & FULL
+        king_sq = bitScan(bitboards[ally_color + 'K'])
+        king_pos = (king_sq // 8, king_sq % 8)
+        checkers = self.attackersOf(king_sq, enemy_color, occupied)
+        self.in_check = checkers != 0
+        captures_only = captures_only and not checkers
+        king_targets = ~own & (enemy if captures_only else FULL)
+
+        # king moves - the king can't hide behind itself from a slider, so test with it taken off the board
+        without_king = occupied ^ (1 << king_sq)
+        for to_sq in iterBits(KING_ATTACKS[king_sq] & king_targets):
+            if not self.attackersOf(to_sq, enemy_color, without_king):
+                moves.append(Move(king_pos, (to_sq // 8, to_sq % 8), board))
+
+        if not checkers & (checkers - 1): # not double check, so other pieces can move too
+            if checkers:
+                check_sq = bitScan(checkers)
+                check_mask = BETWEEN[king_sq][check_sq] | checkers # block or capture the checking piece
+            else:
+                check_mask = FULL
+            pinned, pin_rays = self.getPins(king_sq, ally_color, enemy_color, occupied)
+            targets_mask = king_targets & check_mask
+
+            for sq in iterBits(bitboards[ally_color + 'N'] & ~pinned): # pinned knights can never move
+                for to_sq in iterBits(KNIGHT_ATTACKS[sq] & targets_mask):
+                    moves.append(Move((sq // 8, sq % 8), (to_sq // 8, to_sq % 8), board))
+            queens = bitboards[ally_color + 'Q']
+            for sq in iterBits(bitboards[ally_color + 'B'] | queens):
+                targets = bishopAttacks(occupied, sq) & targets_mask
+                if pinned & (1 << sq):
+                    targets &= pin_rays[sq]
+                for to_sq in iterBits(targets):
+                    moves.append(Move((sq // 8, sq % 8), (to_sq // 8, to_sq % 8), board))
+            for sq in iterBits(bitboards[ally_color + 'R'] | queens):
+                targets = rookAttacks(occupied, sq) & targets_mask
+                if pinned & (1 << sq):
+                    targets &= pin_rays[sq]
+                for to_sq in iterBits(targets):
+                    moves.append(Move((sq // 8, sq % 8), (to_sq // 8, to_sq % 8), board))
+
+            self.getPawnMoves(moves, ally_color, enemy_color, forward, start_row, king_sq, occupied, empty,
+                              check_mask, pinned, pin_rays, captures_only)
+            if not checkers and not captures_only:
+                self.getCastleMoves(king_pos[0], king_pos[1], moves)
+
+        if len(moves) == 0 and not captures_only: # either checkmate or stalemate
+            if self.in_check:
+                self.checkmate = True
+            else:
+                self.stalemate = True
+        return moves
+
+    '''
+    Add the legal pawn moves, including en-passant captures, to the list of moves. With captures_only the pushes
+    are left out apart from promotions
+    '''
+    def getPawnMoves(self, moves, ally_color, enemy_color, forward, start_row, king_sq, occupied, empty,
+                     check_mask, pinned, pin_rays, captures_only=False):
+        promotion_rank = 0 if ally_color == 'w' else 7
+        board = self.board
+        bitboards = self.bitboards
+        Move = ChessEngine.Move
+        enemy = self.occupancy[enemy_color]
+        enpassant_sq = -1
+        if self.enpassant_possible != ():
+            enpassant_sq = self.enpassant_possible[0]*8 + self.enpassant_possible[1]
+        for sq in iterBits(bitboards[ally_color + 'p']):
+            allowed = check_mask
+            if pinned & (1 << sq):
+                allowed &= pin_rays[sq]
+            start = (sq // 8, sq % 8)
+            one_step = sq + forward
+            if captures_only:
+                if one_step // 8 == promotion_rank and empty & allowed & (1 << one_step):
+                    self.addPawnMove(start, (one_step // 8, one_step % 8), moves)
+            elif empty & (1 << one_step):
+                if allowed & (1 << one_step):
+                    self.addPawnMove(start, (one_step // 8, one_step % 8), moves)
+                two_step = one_step + forward
+                if start[0] == start_row and empty & (1 << two_step) and allowed & (1 << two_step):
+                    moves.append(Move(start, (two_step // 8, two_step % 8), board))
+            attacks = PAWN_ATTACKS[ally_color][sq]
+            for to_sq in iterBits(attacks & enemy & allowed):
+                self.addPawnMove(start, (to_sq // 8, to_sq % 8), moves)
+            if enpassant_sq >= 0 and attacks & (1 << enpassant_sq):
+                captured_sq = enpassant_sq - forward
+                # the capture has to resolve a check by taking the checker (or blocking) and respect pins
+                if not (check_mask & ((1 << enpassant_sq) | (1 << captured_sq))):
+                    continue
+                if pinned & (1 << sq) and not pin_rays[sq] & (1 << enpassant_sq):
+                    continue
+                # both pawns leave the rank at once, which can expose the king to a rook or queen
+                after = (occupied ^ (1 << sq) ^ (1 << captured_sq)) | (1 << enpassant_sq)
+                if (rookAttacks(after, king_sq) & (bitboards[enemy_color + 'R'] | bitboards[enemy_color + 'Q'])) or \
+                   (bishopAttacks(after, king_sq) & (bitboards[enemy_color + 'B'] | bitboards[enemy_color + 'Q'])):
+                    continue
+                moves.append(Move(start, (enpassant_sq // 8, enpassant_sq % 8), board, en_passant=True))
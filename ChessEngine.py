@@ -2,50 +2,353 @@
 This is responsible for stopping all the information about the current state of a chess game. 
 It will also be responsible for determining the valid moves at the current state. It will also keep a move log.
 """
+import os
+
+import ZobristKeys
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+FEN_TO_PIECE = {'P': 'p', 'N': 'N', 'B': 'B', 'R': 'R', 'Q': 'Q', 'K': 'K'} # pawns are lower case on our board
+ORTHOGONAL_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+DIAGONAL_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+# what each square sees (index row*8 + col), built once so attack and pin scans walk tables instead of doing
+# offset arithmetic and bounds checks. A ray lists the squares outward from its square, nearest first
+ORTHOGONAL_RAYS = [tuple(tuple((r + d[0]*i, c + d[1]*i) for i in range(1, 8)
+                               if 0 <= r + d[0]*i < 8 and 0 <= c + d[1]*i < 8) for d in ORTHOGONAL_DIRECTIONS)
+                   for r in range(8) for c in range(8)]
+DIAGONAL_RAYS = [tuple(tuple((r + d[0]*i, c + d[1]*i) for i in range(1, 8)
+                             if 0 <= r + d[0]*i < 8 and 0 <= c + d[1]*i < 8) for d in DIAGONAL_DIRECTIONS)
+                 for r in range(8) for c in range(8)]
+KNIGHT_SQUARES = [tuple((r + d[0], c + d[1]) for d in KNIGHT_OFFSETS if 0 <= r + d[0] < 8 and 0 <= c + d[1] < 8)
+                  for r in range(8) for c in range(8)]
+KING_SQUARES = [tuple((r + d[0], c + d[1]) for d in KING_OFFSETS if 0 <= r + d[0] < 8 and 0 <= c + d[1] < 8)
+                for r in range(8) for c in range(8)]
+# the rays from a king for checkForPinsAndChecks, indexed by the enemy's color and the king's square: one
+# (direction, squares) pair per direction, each square with the enemy piece types that give check from it.
+# Sliders of the ray's kind and queens check from anywhere on it, a king from the first square and a pawn from the
+# first square of the diagonals it captures along
+CHECK_RAYS = {}
+for _enemy_color, _pawn_row_step in (('w', 1), ('b', -1)):
+    CHECK_RAYS[_enemy_color] = [
+        tuple((d, tuple((end_row, end_col, ("RQ" if d[0] == 0 or d[1] == 0 else "BQ") +
+                         ("K" + ("p" if d[0] == _pawn_row_step and d[1] != 0 else "") if i == 0 else ""))
+                        for i, (end_row, end_col) in enumerate(ray)))
+              for d, ray in zip(ORTHOGONAL_DIRECTIONS + DIAGONAL_DIRECTIONS, ORTHOGONAL_RAYS[sq] + DIAGONAL_RAYS[sq]))
+        for sq in range(64)]
+PIECE_SCORE = {"K": 0, "Q": 10, "R": 5, "B": 3, "N": 3, "p": 1} # material value of each piece type
+# material value counted from white's side: white pieces positive, black pieces negative
+SIGNED_PIECE_SCORE = {"--": 0}
+for _piece, _score in PIECE_SCORE.items():
+    SIGNED_PIECE_SCORE['w' + _piece] = _score
+    SIGNED_PIECE_SCORE['b' + _piece] = -_score
+DEFAULT_BACKEND = "mailbox" # "mailbox" (GameState below) or "bitboard" (BitboardEngine.GameState)
+# stages of GameState.getStagedMoves, in the order it gets to them
+STAGE_HASH_MOVE = 0
+STAGE_WINNING_CAPTURES = 1
+STAGE_KILLERS = 2
+STAGE_QUIETS = 3
+STAGE_LOSING_CAPTURES = 4
+STAGE_NAMES = ("hash_move", "winning_captures", "killers", "quiets", "losing_captures")
+
+# Zobrist hashing: every (piece, square) pair, every castling right, every en-passant file and the side to move
+# get a fixed random 64 bit number. The key of a position is the XOR of the numbers of everything true about it,
+# so makeMove can update it by XORing out what changed instead of rehashing the whole board.
+# The numbers are the Polyglot book format's, laid out for our board (row 0 is rank 8), so the key only differs
+# from a position's Polyglot key in the side to move term and sometimes the en-passant term (see polyglotKey)
+_polyglot_random = ZobristKeys.POLYGLOT_RANDOM
+ZOBRIST_PIECES = {color + piece: [_polyglot_random[64 * (2 * kind + (color == 'w')) + 8 * (7 - r) + c]
+                                  for r in range(8) for c in range(8)]
+                  for kind, piece in enumerate(('p', 'N', 'B', 'R', 'Q', 'K')) for color in 'wb'}
+
+# castling rights are packed into the low 4 bits of an int
+WHITE_KINGSIDE = 1
+BLACK_KINGSIDE = 2
+WHITE_QUEENSIDE = 4
+BLACK_QUEENSIDE = 8
+ALL_CASTLING_RIGHTS = 15
+# rights that survive a move from or to each square: moving the king or a rook, or capturing a rook on its
+# starting square, clears the matching bits (index is row*8 + col)
+CASTLING_RIGHTS_KEPT = [ALL_CASTLING_RIGHTS] * 64
+CASTLING_RIGHTS_KEPT[0] = ALL_CASTLING_RIGHTS & ~BLACK_QUEENSIDE # a8
+CASTLING_RIGHTS_KEPT[4] = ALL_CASTLING_RIGHTS & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE) # e8
+CASTLING_RIGHTS_KEPT[7] = ALL_CASTLING_RIGHTS & ~BLACK_KINGSIDE # h8
+CASTLING_RIGHTS_KEPT[56] = ALL_CASTLING_RIGHTS & ~WHITE_QUEENSIDE # a1
+CASTLING_RIGHTS_KEPT[60] = ALL_CASTLING_RIGHTS & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE) # e1
+CASTLING_RIGHTS_KEPT[63] = ALL_CASTLING_RIGHTS & ~WHITE_KINGSIDE # h1
+
+_castling_keys = [_polyglot_random[768], _polyglot_random[770], _polyglot_random[769], _polyglot_random[771]] # one per right
+ZOBRIST_CASTLING = [0] * 16 # indexed by the packed rights
+for _rights in range(16):
+    for _bit in range(4):
+        if _rights & (1 << _bit):
+            ZOBRIST_CASTLING[_rights] ^= _castling_keys[_bit]
+ZOBRIST_ENPASSANT = _polyglot_random[772:780] # indexed by file (column)
+ZOBRIST_BLACK_TO_MOVE = _polyglot_random[780] # Polyglot XORs this in for white to move instead
+
+PIECE_TO_FEN = {color + piece: fen_char if color == 'w' else fen_char.lower()
+                for fen_char, piece in FEN_TO_PIECE.items() for color in 'wb'}
+# the pieces that have to be on their home squares (row*8 + col) for the castling rights they carry
+CASTLING_HOME_PIECES = ((0, 'bR'), (4, 'bK'), (7, 'bR'), (56, 'wR'), (60, 'wK'), (63, 'wR'))
+CASTLING_FEN = [''.join(letter for bit, letter in ((WHITE_KINGSIDE, 'K'), (WHITE_QUEENSIDE, 'Q'),
+                                                   (BLACK_KINGSIDE, 'k'), (BLACK_QUEENSIDE, 'q')) if rights & bit)
+                or '-' for rights in range(16)] # FEN castling field of each packed rights value
+# FEN ranks seen before: (row, rank text) -> (squares, Zobrist key part, material, white king col, black king col)
+# and board rows seen before: tuple of squares -> rank text. Positions in a game or a test suite share most of
+# their ranks, so parsing and writing FENs is mostly dictionary lookups. Both are emptied when they get full
+FEN_RANK_CACHE = {}
+RANK_FEN_CACHE = {}
+FEN_CACHE_SIZE = 1 << 16
+
+'''
+Parse one rank of a FEN's piece placement for row r, add it to FEN_RANK_CACHE and return it. None if it is not
+a valid rank
+'''
+def parseFenRank(r, rank):
+    squares = []
+    key = 0
+    material = 0
+    white_king_col = black_king_col = -1
+    for char in rank:
+        if char in '12345678':
+            squares.extend(["--"] * int(char))
+        elif char.upper() in FEN_TO_PIECE:
+            piece = ('w' if char.isupper() else 'b') + FEN_TO_PIECE[char.upper()]
+            c = len(squares)
+            if c < 8:
+                key ^= ZOBRIST_PIECES[piece][r*8 + c]
+            material += SIGNED_PIECE_SCORE[piece]
+            if piece == 'wK':
+                white_king_col = c
+            elif piece == 'bK':
+                black_king_col = c
+            squares.append(piece)
+        else:
+            return None
+    if len(squares) != 8:
+        return None
+    if len(FEN_RANK_CACHE) >= FEN_CACHE_SIZE:
+        FEN_RANK_CACHE.clear()
+    parsed = (tuple(squares), key, material, white_king_col, black_king_col)
+    FEN_RANK_CACHE[(r, rank)] = parsed
+    return parsed
+
+'''
+The FEN text of one board row (a tuple of squares), added to RANK_FEN_CACHE
+'''
+def rankToFen(row):
+    rank = ''
+    empty = 0
+    for square in row:
+        if square == "--":
+            empty += 1
+        else:
+            if empty:
+                rank += str(empty)
+                empty = 0
+            rank += PIECE_TO_FEN[square]
+    if empty:
+        rank += str(empty)
+    if len(RANK_FEN_CACHE) >= FEN_CACHE_SIZE:
+        RANK_FEN_CACHE.clear()
+    RANK_FEN_CACHE[row] = rank
+    return rank
+
 class GameState():
-    def __init__(self):
+    def __init__(self, fen=START_FEN):
         # board is an 8x8 2d list, each element of the list has 2 characters.
         # The first char represents the color of the piece, 'b' or 'w'.
         # The second char represents the type of the piece, 'K', 'Q', 'R', 'B', 'N' or 'P'.
         # "--" represents an empty space with no piece.
-        self.board = [
-            ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
-            ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
-            ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"],
-        ]
+        # loadFen sets up the board and everything else about the position
         self.moveFunctions = {'p': self.getPawnMoves, 'R': self.getRookMoves, 'N': self.getKnightMoves,
                               'B': self.getBishopMoves, 'Q': self.getQueenMoves, 'K': self.getKingMoves}
-        self.white_to_move = True
+        self.pseudoMoveFunctions = dict(self.moveFunctions, K=self.getKingStepMoves) # see getPseudoLegalMoves
+        self.loadFen(fen)
+    
+    '''
+    The castling rights as a CastleRights object, for code that wants them by name
+    '''
+    @property
+    def current_castling_right(self):
+        return CastleRights(bool(self.castling_rights & WHITE_KINGSIDE), bool(self.castling_rights & BLACK_KINGSIDE),
+                            bool(self.castling_rights & WHITE_QUEENSIDE), bool(self.castling_rights & BLACK_QUEENSIDE))
+    
+    '''
+    Create a GameState for the position described by a FEN string
+    '''
+    @classmethod
+    def fromFen(cls, fen):
+        return cls(fen)
+    
+    '''
+    Replace the current position (and clear the move log) with the one described by a FEN string. The ranks are
+    looked up in FEN_RANK_CACHE, so the board, material and Zobrist key are put together without a pass over
+    every square, which matters when building positions by the million
+    '''
+    def loadFen(self, fen):
+        fields = fen.split()
+        if len(fields) < 2 or fields[1] not in ('w', 'b'):
+            raise ValueError("Invalid FEN: " + fen)
+        ranks = fields[0].split('/')
+        if len(ranks) != 8:
+            raise ValueError("Invalid FEN: " + fen)
+        board = []
+        key = 0
+        material = 0
+        white_king_location = black_king_location = None
+        for r in range(8):
+            rank = FEN_RANK_CACHE.get((r, ranks[r]))
+            if rank is None:
+                rank = parseFenRank(r, ranks[r])
+                if rank is None:
+                    raise ValueError("Invalid FEN: " + fen)
+            squares, rank_key, rank_material, white_king_col, black_king_col = rank
+            board.append(list(squares))
+            key ^= rank_key
+            material += rank_material
+            if white_king_col >= 0:
+                white_king_location = (r, white_king_col)
+            if black_king_col >= 0:
+                black_king_location = (r, black_king_col)
+        if white_king_location is None or black_king_location is None:
+            raise ValueError("Invalid FEN, both kings are needed: " + fen)
+        castling = fields[2] if len(fields) > 2 else '-'
+        castling_rights = (WHITE_KINGSIDE if 'K' in castling else 0) | (BLACK_KINGSIDE if 'k' in castling else 0) | \
+                          (WHITE_QUEENSIDE if 'Q' in castling else 0) | (BLACK_QUEENSIDE if 'q' in castling else 0)
+        # a right whose king or rook is off its home square can't be used, so drop it like a move from there would
+        for square, piece in CASTLING_HOME_PIECES:
+            if board[square // 8][square % 8] != piece:
+                castling_rights &= CASTLING_RIGHTS_KEPT[square]
+        enpassant = fields[3] if len(fields) > 3 else '-'
+        try:
+            if enpassant != '-':
+                enpassant_possible = (Move.ranksToRows[enpassant[1]], Move.filesToCols[enpassant[0]])
+            else:
+                enpassant_possible = ()
+            halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+            fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+        except (KeyError, IndexError, ValueError):
+            raise ValueError("Invalid FEN: " + fen)
+        key ^= ZOBRIST_CASTLING[castling_rights]
+        if enpassant_possible != ():
+            key ^= ZOBRIST_ENPASSANT[enpassant_possible[1]]
+        if fields[1] == 'b':
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        
+        self.board = board
+        self.white_to_move = fields[1] == 'w'
         self.move_log = []
-        self.white_king_location = (7, 4)
-        self.black_king_location = (0, 4)
+        self.white_king_location = white_king_location
+        self.black_king_location = black_king_location
         self.in_check = False
         self.pins = []
         self.checks = []
         self.checkmate = False
         self.stalemate = False
-        self.enpassant_possible = () # Coordinates for the square where an enpassant capture is possible
-        self.enpassant_possible_log = [self.enpassant_possible]
-        self.current_castling_right = CastleRights(True, True, True, True)
-        self.castle_rights_log = [CastleRights(self.current_castling_right.wks, self.current_castling_right.bks, 
-                                               self.current_castling_right.wqs, self.current_castling_right.bqs)]
+        self.legality_info = (None, [], {}) # see legalityInfo
+        self.enpassant_possible = enpassant_possible # Coordinates for the square where an enpassant capture is possible
+        self.castling_rights = castling_rights
+        self.halfmove_clock = halfmove_clock # plies since the last capture or pawn move, for the 50 move rule
+        self.fullmove_number = fullmove_number # starts at 1 and goes up after each black move
+        self.material_score = material # white material minus black material, kept up to date by makeMove/undoMove
+        self.piece_count = 64 - sum(row.count("--") for row in board) # kings included
+        self.zobrist_key = key
+        # makeMove pushes the castling rights, en-passant square, halfmove clock and Zobrist key here (4 entries
+        # per move) and undoMove pops them back off. Everything else about a move is on the Move itself
+        self.state_log = []
+    
+    '''
+    The FEN string of the current position
+    '''
+    def toFen(self):
+        ranks = []
+        for row in self.board:
+            row = tuple(row)
+            rank = RANK_FEN_CACHE.get(row)
+            if rank is None:
+                rank = rankToFen(row)
+            ranks.append(rank)
+        if self.enpassant_possible != ():
+            enpassant = Move.colsToFiles[self.enpassant_possible[1]] + Move.rowsToRanks[self.enpassant_possible[0]]
+        else:
+            enpassant = '-'
+        return "%s %s %s %s %d %d" % ('/'.join(ranks), 'w' if self.white_to_move else 'b',
+                                      CASTLING_FEN[self.castling_rights], enpassant, self.halfmove_clock,
+                                      self.fullmove_number)
+    
+    '''
+    The key of the position in the Polyglot opening book format. Polyglot hashes white to move rather than black,
+    and only counts the en-passant file when a pawn of the side to move stands next to the pawn that can be taken
+    '''
+    def polyglotKey(self):
+        key = self.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE
+        if self.enpassant_possible != ():
+            r, c = self.enpassant_possible
+            pawn_row, pawn = (r + 1, 'wp') if self.white_to_move else (r - 1, 'bp')
+            row = self.board[pawn_row]
+            if not ((c > 0 and row[c - 1] == pawn) or (c < 7 and row[c + 1] == pawn)):
+                key ^= ZOBRIST_ENPASSANT[c]
+        return key
     
+    '''
+    Sum the material on the board from scratch (white minus black). makeMove/undoMove keep self.material_score
+    up to date, so this is only needed when a position is set up
+    '''
+    def computeMaterialScore(self):
+        score = 0
+        for row in self.board:
+            for square in row:
+                score += SIGNED_PIECE_SCORE[square]
+        return score
+    
+    '''
+    Compute the Zobrist key of the current position from scratch. makeMove keeps self.zobrist_key up to date
+    incrementally, this is only needed to seed it (and to check that the incremental updates are right)
+    '''
+    def computeZobristKey(self):
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    key ^= ZOBRIST_PIECES[piece][r*8 + c]
+        key ^= ZOBRIST_CASTLING[self.castling_rights]
+        if self.enpassant_possible != ():
+            key ^= ZOBRIST_ENPASSANT[self.enpassant_possible[1]]
+        if not self.white_to_move:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        return key
     
     
     '''
     Takes a Move as a parameter and executes it (this will not work for castling, pawn promotion, and en-passant)
     '''
     def makeMove(self, move):
+        # save the state a move can't be undone from for undoMove
+        state_log = self.state_log
+        state_log.append(self.castling_rights)
+        state_log.append(self.enpassant_possible)
+        state_log.append(self.halfmove_clock)
+        state_log.append(self.zobrist_key)
+        
+        # the key is updated by XORing out everything the move changes and XORing in the new state
+        key = self.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_CASTLING[self.castling_rights]
+        key ^= ZOBRIST_PIECES[move.piece_moved][move.start_row*8 + move.start_col]
+        if move.en_passant:
+            key ^= ZOBRIST_PIECES[move.piece_captured][move.start_row*8 + move.end_col]
+        elif move.piece_captured != "--":
+            key ^= ZOBRIST_PIECES[move.piece_captured][move.end_row*8 + move.end_col]
+        if self.enpassant_possible != ():
+            key ^= ZOBRIST_ENPASSANT[self.enpassant_possible[1]]
+
         self.board[move.start_row][move.start_col] = "--"
 
         self.board[move.end_row][move.end_col] = move.piece_moved
         self.move_log.append(move) # log the move so we can undo it later
         self.white_to_move = not self.white_to_move # swap players
+        if self.white_to_move:
+            self.fullmove_number += 1 # black has moved
         # update the king's location if moved
         if move.piece_moved == 'wK':
             self.white_king_location = (move.end_row, move.end_col)
@@ -55,8 +358,7 @@ class GameState():
         # Pawn promotion
         if move.is_pawn_promotion:
             # promotedPiece = input("Promote to Q, R, B, or N:") # make into UI later
-            # self.board[move.end_row][move.end_col] = move.piece_moved[0] + promotedPiece
-            self.board[move.end_row][move.end_col] = move.piece_moved[0] + 'Q'
+            self.board[move.end_row][move.end_col] = move.piece_moved[0] + move.promotion_choice
         
         # if enpassant move, must update the board to capture the pawn
         if move.en_passant:
@@ -76,13 +378,34 @@ class GameState():
             else: # queenside castle
                 self.board[move.end_row][move.end_col+1] = self.board[move.end_row][move.end_col-2] # moves the rook
                 self.board[move.end_row][move.end_col-2] = '--' # erase old rook
+            rook = move.piece_moved[0] + 'R'
+            if move.end_col - move.start_col == 2:
+                key ^= ZOBRIST_PIECES[rook][move.end_row*8 + 7] ^ ZOBRIST_PIECES[rook][move.end_row*8 + 5]
+            else:
+                key ^= ZOBRIST_PIECES[rook][move.end_row*8] ^ ZOBRIST_PIECES[rook][move.end_row*8 + 3]
         
-        self.enpassant_possible_log.append(self.enpassant_possible)
+        
+        if move.piece_moved[1] == 'p' or move.piece_captured != "--":
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        
+        # material only changes by what was captured (piece_captured is the pawn for en-passant) and by promotion
+        self.material_score -= SIGNED_PIECE_SCORE[move.piece_captured]
+        if move.is_capture:
+            self.piece_count -= 1
+        if move.is_pawn_promotion:
+            self.material_score += SIGNED_PIECE_SCORE[move.piece_moved[0] + move.promotion_choice] - \
+                                   SIGNED_PIECE_SCORE[move.piece_moved]
         
         # update castling rights - whenever its a rook or a king move
         self.updateCastleRights(move)
-        self.castle_rights_log.append(CastleRights(self.current_castling_right.wks, self.current_castling_right.bks, 
-                                               self.current_castling_right.wqs, self.current_castling_right.bqs))
+
+        key ^= ZOBRIST_PIECES[self.board[move.end_row][move.end_col]][move.end_row*8 + move.end_col] # handles promotions
+        key ^= ZOBRIST_CASTLING[self.castling_rights]
+        if self.enpassant_possible != ():
+            key ^= ZOBRIST_ENPASSANT[self.enpassant_possible[1]]
+        self.zobrist_key = key
 
         
         
@@ -95,6 +418,8 @@ class GameState():
             self.board[move.start_row][move.start_col] = move.piece_moved
             self.board[move.end_row][move.end_col] = move.piece_captured
             self.white_to_move = not self.white_to_move # switch turns back
+            if not self.white_to_move:
+                self.fullmove_number -= 1
             # update the king's position if needed
             if move.piece_moved == 'wK':
                 self.white_king_location = (move.start_row, move.start_col)
@@ -105,12 +430,19 @@ class GameState():
                 self.board[move.end_row][move.end_col] = '--' # removes the pawn that was added in the wrong square
                 self.board[move.start_row][move.end_col] = move.piece_captured # puts the pawn back on the correct square it was captured from
 
-            self.enpassant_possible_log.pop()
-            self.enpassant_possible = self.enpassant_possible_log[-1]
+            # restore the state saved by makeMove, in reverse order
+            state_log = self.state_log
+            self.zobrist_key = state_log.pop()
+            self.halfmove_clock = state_log.pop()
+            self.enpassant_possible = state_log.pop()
+            self.castling_rights = state_log.pop()
             
-            #undo castling rights
-            self.castle_rights_log.pop() # get rid of the new castle rights from the move we are undoing
-            self.current_castling_right = self.castle_rights_log[-1] # set the current castle rights to the last one in the list
+            self.material_score += SIGNED_PIECE_SCORE[move.piece_captured]
+            if move.is_capture:
+                self.piece_count += 1
+            if move.is_pawn_promotion:
+                self.material_score -= SIGNED_PIECE_SCORE[move.piece_moved[0] + move.promotion_choice] - \
+                                       SIGNED_PIECE_SCORE[move.piece_moved]
             # undo castle move
             if move.is_castle_move:
                 if move.end_col - move.start_col == 2: # kingside
@@ -124,49 +456,38 @@ class GameState():
             self.stalemate = False
     
     '''
-    Update the castle rights
+    Pass the turn without moving, for null-move pruning: only the side to move changes, and the en-passant square
+    goes (it was only there for a capture on this turn). Nothing goes into move_log, so undoNullMove has to be
+    called before any move made earlier is undone
+    '''
+    def makeNullMove(self):
+        self.state_log.append(self.enpassant_possible)
+        self.state_log.append(self.zobrist_key)
+        key = self.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE
+        if self.enpassant_possible != ():
+            key ^= ZOBRIST_ENPASSANT[self.enpassant_possible[1]]
+        self.enpassant_possible = ()
+        self.zobrist_key = key
+        self.white_to_move = not self.white_to_move
+
+    def undoNullMove(self):
+        self.white_to_move = not self.white_to_move
+        self.zobrist_key = self.state_log.pop()
+        self.enpassant_possible = self.state_log.pop()
+
+    '''
+    Update the castle rights - a king or rook leaving its starting square, or a rook being captured on it,
+    clears the rights that depend on that square
     '''
     def updateCastleRights(self, move):
-        if move.piece_moved == 'wK':
-            self.current_castling_right.wks = False
-            self.current_castling_right.wqs = False
-        elif move.piece_moved == 'bK':
-            self.current_castling_right.bks = False
-            self.current_castling_right.bqs = False
-        elif move.piece_moved == 'wR':
-            if move.start_row == 7:
-                if move.start_col == 0: # left rook
-                    self.current_castling_right.wqs = False
-                elif move.start_col == 7: # right rook
-                    self.current_castling_right.wks = False
-        elif move.piece_moved == 'bR':
-            if move.start_row == 0:
-                if move.start_col == 0: # left rook
-                    self.current_castling_right.bqs = False
-                elif move.start_col == 7: # right rook
-                    self.current_castling_right.bks = False
-        # if a rook is captured
-        if move.piece_captured == 'wR':
-            if move.end_row == 7:
-                if move.end_col == 0: # left rook
-                    self.current_castling_right.wqs = False
-                elif move.end_col == 7: # right rook
-                    self.current_castling_right.wks = False
-        elif move.piece_captured == 'bR':
-            if move.end_row == 0:
-                if move.end_col == 0: # left rook
-                    self.current_castling_right.bqs = False
-                elif move.end_col == 7: # right rook
-                    self.current_castling_right.bks = False
+        self.castling_rights &= CASTLING_RIGHTS_KEPT[move.start_row*8 + move.start_col] & \
+                                CASTLING_RIGHTS_KEPT[move.end_row*8 + move.end_col]
                     
     
     '''
     All moves considering checks
     '''
     def getValidMoves(self):
-        temp_castle_rights = CastleRights(self.current_castling_right.wks, self.current_castling_right.bks,
-                                          self.current_castling_right.wqs, self.current_castling_right.bqs)
-        
         moves = []
         self.in_check, self.pins, self.checks = self.checkForPinsAndChecks()
         if self.white_to_move:
@@ -196,6 +517,8 @@ class GameState():
                 # get rid of any moves that don't block or move king
                 for i in range(len(moves) - 1, -1, -1): # go through backwards when you are removing from a list as iterating
                     if moves[i].piece_moved[1] != 'K': # move doesn't move king so it must block or capture
+                        if moves[i].en_passant and (moves[i].start_row, moves[i].end_col) == (checkRow, checkCol):
+                            continue # en-passant captures the pawn giving check
                         if not (moves[i].end_row, moves[i].end_col) in validSquares: # move doesn't block or capture piece
                             moves.remove(moves[i])
             else: # double check, king has to move
@@ -212,14 +535,217 @@ class GameState():
             else:
                 self.stalemate = True
         
-        self.current_castling_right = temp_castle_rights
-        
         return moves
     
     '''
-    Determine if the current player is in check
+    Pseudo-legal moves: every move of the side to move that ignores pins and lets the king step onto attacked
+    squares, for a search that tests each move with isLegal only when it gets to it. Moves that getValidMoves
+    would return come out in the same order. Sets in_check but never checkmate or stalemate: those are when none
+    of the moves turns out to be legal
+    '''
+    def getPseudoLegalMoves(self):
+        checks = self.legalityInfo()[1]
+        self.in_check = len(checks) > 0
+        self.pins = [] # pins are left to isLegal
+        moves = self.getAllPossibleMoves(self.pseudoMoveFunctions)
+        if not self.in_check:
+            self.getPseudoCastleMoves(moves)
+        return moves
+
+    '''
+    Add the castling moves the rights allow and nothing stands in the way of, for a side that isn't in check.
+    Whether the king passes through or lands on an attacked square is left to isLegal
+    '''
+    def getPseudoCastleMoves(self, moves):
+        r, c = self.white_king_location if self.white_to_move else self.black_king_location
+        board = self.board
+        if self.castling_rights & (WHITE_KINGSIDE if self.white_to_move else BLACK_KINGSIDE) and \
+                board[r][c+1] == "--" and board[r][c+2] == "--":
+            moves.append(Move((r, c), (r, c+2), board, is_castle_move=True))
+        if self.castling_rights & (WHITE_QUEENSIDE if self.white_to_move else BLACK_QUEENSIDE) and \
+                board[r][c-1] == "--" and board[r][c-2] == "--" and board[r][c-3] == "--":
+            moves.append(Move((r, c), (r, c-2), board, is_castle_move=True))
+
+    '''
+    Pseudo-legal moves that neither capture nor promote, for the quiet stage of getStagedMoves. Only asked for
+    when the side to move isn't in check
+    '''
+    def getQuietMoves(self):
+        board = self.board
+        if self.white_to_move:
+            ally_color, move_amount, start_row = 'w', -1, 6
+        else:
+            ally_color, move_amount, start_row = 'b', 1, 1
+        moves = []
+        for r in range(8):
+            for c in range(8):
+                piece = board[r][c]
+                if piece[0] != ally_color:
+                    continue
+                piece_type = piece[1]
+                if piece_type == 'p':
+                    end_row = r + move_amount
+                    if board[end_row][c] == "--" and end_row != 0 and end_row != 7:
+                        moves.append(Move((r, c), (end_row, c), board))
+                        if r == start_row and board[end_row + move_amount][c] == "--":
+                            moves.append(Move((r, c), (end_row + move_amount, c), board))
+                elif piece_type == 'N' or piece_type == 'K':
+                    for end_row, end_col in (KNIGHT_SQUARES if piece_type == 'N' else KING_SQUARES)[r*8 + c]:
+                        if board[end_row][end_col] == "--":
+                            moves.append(Move((r, c), (end_row, end_col), board))
+                else:
+                    if piece_type == 'R':
+                        rays = ORTHOGONAL_RAYS[r*8 + c]
+                    elif piece_type == 'B':
+                        rays = DIAGONAL_RAYS[r*8 + c]
+                    else:
+                        rays = ORTHOGONAL_RAYS[r*8 + c] + DIAGONAL_RAYS[r*8 + c]
+                    for ray in rays:
+                        for end_row, end_col in ray:
+                            if board[end_row][end_col] != "--":
+                                break
+                            moves.append(Move((r, c), (end_row, end_col), board))
+        self.getPseudoCastleMoves(moves)
+        return moves
+
+    '''
+    Whether getPseudoLegalMoves could return the move, for moves that come from somewhere else (the
+    transposition table, killer moves) and may not even be possible in this position
+    '''
+    def isPseudoLegal(self, move):
+        r, c = move.start_row, move.start_col
+        piece = self.board[r][c]
+        if piece[0] != ('w' if self.white_to_move else 'b'):
+            return False
+        moves = []
+        if move.is_castle_move:
+            if self.legalityInfo()[1]:
+                return False # no castling out of check
+            self.getPseudoCastleMoves(moves)
+        else:
+            pins = self.pins
+            self.pins = []
+            self.pseudoMoveFunctions[piece[1]](r, c, moves)
+            self.pins = pins
+        return any(generated.moveID == move.moveID for generated in moves)
+
+    '''
+    Moves in stages for a search that mostly cuts off early, each stage only generated once the previous one has
+    been used up: the hash move, captures that win material or trade evenly (most valuable victim first), the
+    killer moves, the quiet moves by their history score and last the captures of a cheaper piece. A move is
+    never given twice. hash_move and killers are moveIDs, history is indexed by the low 12 bits of a moveID.
+    stage_counts, when given, has the entry of each stage (STAGE_HASH_MOVE, ...) counted up when it gets
+    generated. In check the evasions all come from the capture stage and are handed out in the same order.
+    The moves are of the kind getPseudoLegalMoves returns, so each one still needs isLegal
+    '''
+    def getStagedMoves(self, hash_move=None, killers=(), history=None, stage_counts=None):
+        if hash_move is not None:
+            move = Move.fromMoveID(hash_move, self)
+            if self.isPseudoLegal(move):
+                if stage_counts is not None:
+                    stage_counts[STAGE_HASH_MOVE] += 1
+                yield move
+            else:
+                hash_move = None
+        if stage_counts is not None:
+            stage_counts[STAGE_WINNING_CAPTURES] += 1
+        captures = self.getCaptureMoves() # every evasion when in check
+        quiets = None
+        if self.in_check:
+            quiets = [move for move in captures if not move.is_capture and not move.is_pawn_promotion]
+            captures = [move for move in captures if move.is_capture or move.is_pawn_promotion]
+        scored_captures = []
+        for move in captures:
+            score = 10 * PIECE_SCORE[move.piece_captured[1]] - PIECE_SCORE[move.piece_moved[1]] \
+                if move.is_capture else 0
+            if move.is_pawn_promotion:
+                score += 10 * PIECE_SCORE[move.promotion_choice]
+            scored_captures.append((score, move))
+        scored_captures.sort(key=lambda scored_move: scored_move[0], reverse=True)
+        losing_captures = []
+        for _, move in scored_captures:
+            if move.moveID == hash_move:
+                continue
+            if move.is_capture and not move.is_pawn_promotion and \
+                    PIECE_SCORE[move.piece_captured[1]] < PIECE_SCORE[move.piece_moved[1]]:
+                losing_captures.append(move)
+                continue
+            yield move
+        if stage_counts is not None:
+            stage_counts[STAGE_KILLERS] += 1
+        tried = [hash_move]
+        for killer in killers:
+            if killer is None or killer in tried:
+                continue
+            move = Move.fromMoveID(killer, self)
+            if not move.is_capture and not move.is_pawn_promotion and self.isPseudoLegal(move):
+                tried.append(killer)
+                yield move
+        if stage_counts is not None:
+            stage_counts[STAGE_QUIETS] += 1
+        if quiets is None:
+            quiets = self.getQuietMoves()
+        if history is not None:
+            quiets.sort(key=lambda move: history[move.moveID & 4095], reverse=True)
+        for move in quiets:
+            if move.moveID not in tried:
+                yield move
+        if stage_counts is not None:
+            stage_counts[STAGE_LOSING_CAPTURES] += 1
+        yield from losing_captures
+
+    '''
+    The checks and pins of the current position for isLegal: (Zobrist key, checks, {pinned square: pin
+    direction}). They are only worked out again when the position has changed, so a node of the search pays for
+    them once however many of its moves it tries, even though its children overwrite self.pins and self.checks
     '''
-    def in_check(self):
+    def legalityInfo(self):
+        if self.legality_info[0] != self.zobrist_key:
+            in_check, pins, checks = self.checkForPinsAndChecks()
+            self.legality_info = (self.zobrist_key, checks, {(pin[0], pin[1]): (pin[2], pin[3]) for pin in pins})
+        return self.legality_info
+
+    '''
+    Whether a move from getPseudoLegalMoves is legal: it doesn't leave (or put) the mover's king in check
+    '''
+    def isLegal(self, move):
+        _, checks, pin_directions = self.legalityInfo()
+        board = self.board
+        enemy_color = 'b' if self.white_to_move else 'w'
+        if move.piece_moved[1] == 'K':
+            r, c = move.start_row, move.start_col
+            if move.is_castle_move: # not in check, or it wouldn't have been generated
+                step = 1 if move.end_col > c else -1
+                return not self.isAttackedBy(r, c + step, enemy_color) and \
+                       not self.isAttackedBy(r, c + 2*step, enemy_color)
+            for check in checks: # the square behind the king on a checking slider's ray, see getKingMoves
+                if (move.end_row, move.end_col) == (r - check[2], c - check[3]) and \
+                        board[check[0]][check[1]][1] in "RBQ":
+                    return False
+            return not self.isAttackedBy(move.end_row, move.end_col, enemy_color)
+        if move.en_passant:
+            return True # getPawnMoves only generates it after trying it with isEnpassantLegal
+        if len(checks) > 1:
+            return False # double check, only the king can move
+        pin_direction = pin_directions.get((move.start_row, move.start_col))
+        if pin_direction is not None and \
+                (move.end_row - move.start_row) * pin_direction[1] != (move.end_col - move.start_col) * pin_direction[0]:
+            return False # leaves the line it is pinned along
+        if checks:
+            check_row, check_col, dr, dc = checks[0]
+            if board[check_row][check_col][1] == 'N':
+                return (move.end_row, move.end_col) == (check_row, check_col)
+            # must land between the king and the checking piece, or on it
+            king_row, king_col = self.white_king_location if self.white_to_move else self.black_king_location
+            steps = max(abs(move.end_row - king_row), abs(move.end_col - king_col))
+            return steps <= max(abs(check_row - king_row), abs(check_col - king_col)) and \
+                   (move.end_row, move.end_col) == (king_row + dr*steps, king_col + dc*steps)
+        return True
+
+    '''
+    Determine if the current player is in check (self.in_check holds the result of the last getValidMoves)
+    '''
+    def isInCheck(self):
         if self.white_to_move:
             return self.squareUnderAttack(self.white_king_location[0], self.white_king_location[1])
         else:
@@ -229,11 +755,44 @@ class GameState():
     Determine if the enemy can attack the square r, c
     '''
     def squareUnderAttack(self, r, c):
-        self.white_to_move = not self.white_to_move # switch to opponent's turn
-        oppMoves = self.getAllPossibleMoves()
-        self.white_to_move = not self.white_to_move # switch turns back
-        for move in oppMoves:
-            if move.end_row == r and move.end_col == c: # square is under attack
+        return self.isAttackedBy(r, c, 'b' if self.white_to_move else 'w')
+    
+    '''
+    Determine if any piece of the given color attacks the square r, c. Rather than generating the attacker's moves
+    this looks outward from the square: along each ray for sliders, and at the few squares a knight, pawn or king
+    would have to stand on
+    '''
+    def isAttackedBy(self, r, c, color):
+        board = self.board
+        for ray in ORTHOGONAL_RAYS[r*8 + c]:
+            for end_row, end_col in ray:
+                piece = board[end_row][end_col]
+                if piece != "--":
+                    if piece[0] == color and (piece[1] == 'R' or piece[1] == 'Q'):
+                        return True
+                    break
+        for ray in DIAGONAL_RAYS[r*8 + c]:
+            for end_row, end_col in ray:
+                piece = board[end_row][end_col]
+                if piece != "--":
+                    if piece[0] == color and (piece[1] == 'B' or piece[1] == 'Q'):
+                        return True
+                    break
+        knight = color + 'N'
+        for end_row, end_col in KNIGHT_SQUARES[r*8 + c]:
+            if board[end_row][end_col] == knight:
+                return True
+        king = color + 'K'
+        for end_row, end_col in KING_SQUARES[r*8 + c]:
+            if board[end_row][end_col] == king:
+                return True
+        # a pawn attacks diagonally forward, so look one row back from its point of view
+        pawn_row = r + 1 if color == 'w' else r - 1
+        if 0 <= pawn_row < 8:
+            pawn = color + 'p'
+            if c - 1 >= 0 and board[pawn_row][c-1] == pawn:
+                return True
+            if c + 1 <= 7 and board[pawn_row][c+1] == pawn:
                 return True
         return False
         
@@ -241,17 +800,96 @@ class GameState():
     '''
     All moves without considering checks
     '''
-    def getAllPossibleMoves(self):
+    def getAllPossibleMoves(self, move_functions=None):
+        if move_functions is None:
+            move_functions = self.moveFunctions
         moves = []
         for r in range(len(self.board)): # number of rows
             for c in range(len(self.board[r])): # number of cols in given row
                 turn = self.board[r][c][0]
                 if (turn == 'w' and self.white_to_move) or (turn == 'b' and not self.white_to_move):
                     piece = self.board[r][c][1]
-                    self.moveFunctions[piece](r, c, moves) # calls the appropriate move function based on piece type
+                    move_functions[piece](r, c, moves) # calls the appropriate move function based on piece type
+        return moves
+    '''
+    Legal captures and promotions only, for the quiescence search. Quiet moves are never generated, apart from
+    when the player is in check: then every legal move is returned (and checkmate is detected) like getValidMoves
+    '''
+    def getCaptureMoves(self):
+        self.in_check, self.pins, self.checks = self.checkForPinsAndChecks()
+        if self.in_check:
+            return self.getValidMoves()
+        board = self.board
+        if self.white_to_move:
+            ally_color, enemy_color, move_amount = 'w', 'b', -1
+        else:
+            ally_color, enemy_color, move_amount = 'b', 'w', 1
+        pin_directions = {(pin[0], pin[1]): (pin[2], pin[3]) for pin in self.pins}
+        moves = []
+        for r in range(8):
+            for c in range(8):
+                piece = board[r][c]
+                if piece[0] != ally_color:
+                    continue
+                piece_type = piece[1]
+                pin_direction = pin_directions.get((r, c))
+                if piece_type == 'p':
+                    end_row = r + move_amount
+                    if board[end_row][c] == "--" and (end_row == 0 or end_row == 7): # promotion push
+                        if pin_direction is None or pin_direction[1] == 0:
+                            self.addPawnMove((r, c), (end_row, c), moves)
+                    for dc in (-1, 1):
+                        end_col = c + dc
+                        if not 0 <= end_col < 8:
+                            continue
+                        if pin_direction is not None and pin_direction != (move_amount, dc) and \
+                                pin_direction != (-move_amount, -dc):
+                            continue
+                        if board[end_row][end_col][0] == enemy_color:
+                            self.addPawnMove((r, c), (end_row, end_col), moves)
+                        elif (end_row, end_col) == self.enpassant_possible and board[r][end_col] == enemy_color + 'p':
+                            enpassant = Move((r, c), (end_row, end_col), board, en_passant=True)
+                            if self.isEnpassantLegal(enpassant):
+                                moves.append(enpassant)
+                elif piece_type == 'N':
+                    if pin_direction is not None:
+                        continue # a pinned knight can never move
+                    for d in KNIGHT_OFFSETS:
+                        end_row = r + d[0]
+                        end_col = c + d[1]
+                        if 0 <= end_row < 8 and 0 <= end_col < 8 and board[end_row][end_col][0] == enemy_color:
+                            moves.append(Move((r, c), (end_row, end_col), board))
+                elif piece_type == 'K':
+                    # not in check, so no slider's ray runs through the king's square and it can stay on the board
+                    for end_row, end_col in KING_SQUARES[r*8 + c]:
+                        if board[end_row][end_col][0] == enemy_color and \
+                                not self.isAttackedBy(end_row, end_col, enemy_color):
+                            moves.append(Move((r, c), (end_row, end_col), board))
+                else:
+                    if piece_type == 'R':
+                        directions = ORTHOGONAL_DIRECTIONS
+                    elif piece_type == 'B':
+                        directions = DIAGONAL_DIRECTIONS
+                    else:
+                        directions = ORTHOGONAL_DIRECTIONS + DIAGONAL_DIRECTIONS
+                    for d in directions:
+                        if pin_direction is not None and pin_direction != d and pin_direction != (-d[0], -d[1]):
+                            continue
+                        end_row = r + d[0]
+                        end_col = c + d[1]
+                        while 0 <= end_row < 8 and 0 <= end_col < 8:
+                            end_piece = board[end_row][end_col]
+                            if end_piece != "--":
+                                if end_piece[0] == enemy_color:
+                                    moves.append(Move((r, c), (end_row, end_col), board))
+                                break
+                            end_row += d[0]
+                            end_col += d[1]
         return moves
+    
     '''
-    Returns if the player is in check, a list of pins, and a list of checks
+    Returns if the player is in check, a list of pins, and a list of checks. Pins and checks are (row, col, direction
+    row, direction col), the direction pointing from the king towards the pinned or checking piece
     '''
     def checkForPinsAndChecks(self):
         pins = [] # squares pinned and the direction its pinned from
@@ -260,65 +898,39 @@ class GameState():
         if self.white_to_move:
             enemy_color = "b"
             ally_color = "w"
-            start_row = self.white_king_location[0]
-            start_col = self.white_king_location[1]
+            start_row, start_col = self.white_king_location
         else:
             enemy_color = "w"
             ally_color = "b"
-            start_row = self.black_king_location[0]
-            start_col = self.black_king_location[1]
-        
+            start_row, start_col = self.black_king_location
+        board = self.board
         # check outward from king for pins and checks, keep track of pins
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range(len(directions)):
-            d = directions[j]
-            possible_pin = () # reset possible pins
-            for i in range(1, 8):
-                end_row = start_row + d[0] * i
-                end_col = start_col + d[1] * i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    endPiece = self.board[end_row][end_col]
-                    if endPiece[0] == ally_color and endPiece[1] != 'K':
-                        if possible_pin == (): # 1st allied piece could be pinned
-                            possible_pin = (end_row, end_col, d[0], d[1])
-                        else: # 2nd allied piece, so no no pin or check possible in this direction
-                            break
-                    elif endPiece[0] == enemy_color:
-                        type = endPiece[1]
-                        # 5 possibilities here in this complex conditional
-                        # 1.) orthogonally away from king and piece is a rook
-                        # 2.) diagonally away from king and piece is a bishop
-                        # 3.) 1 square away diagonally from king and piece is a pawn
-                        # 4.) any direction and piece is a queen
-                        # 5.) any direction 1 square away and piece is a king
-                        if (0 <= j <= 3 and type == 'R') or \
-                            (4 <= j <= 7 and type == 'B') or \
-                            (i == 1 and type == 'p' and ((enemy_color == 'w' and 6 <= j <= 7) or (enemy_color == 'b' and 4 <= j <= 5))) or \
-                            (type == 'Q') or (i == 1 and type == 'K'):
-                            if possible_pin == (): # no piece blocking, so check
-                                in_check = True
-                                checks.append((end_row, end_col, d[0], d[1]))
-                                break
-                            else: # piece blocking so pin
-                                pins.append(possible_pin)
-                                break
-                        else: # enemy piece not applying check
-                            break
-                else:
-                    break # off board
+        for d, ray in CHECK_RAYS[enemy_color][start_row*8 + start_col]:
+            possible_pin = None
+            for end_row, end_col, checkers in ray:
+                end_piece = board[end_row][end_col]
+                if end_piece == "--":
+                    continue
+                if end_piece[0] == ally_color:
+                    if possible_pin is not None: # 2nd allied piece, so no pin or check possible in this direction
+                        break
+                    possible_pin = (end_row, end_col, d[0], d[1]) # 1st allied piece could be pinned
+                    continue
+                if end_piece[1] in checkers:
+                    if possible_pin is None: # no piece blocking, so check
+                        in_check = True
+                        checks.append((end_row, end_col, d[0], d[1]))
+                    else: # piece blocking so pin
+                        pins.append(possible_pin)
+                break # the first enemy piece ends the ray either way
         # check for knight checks
-        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-        for m in knightMoves:
-            end_row = start_row + m[0]
-            end_col = start_col + m[1]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                endPiece = self.board[end_row][end_col]
-                if endPiece[0] == enemy_color and endPiece[1] == 'N': # enemy knight attacking
-                    in_check = True
-                    checks.append((end_row, end_col, m[0], m[1]))
+        knight = enemy_color + 'N'
+        for end_row, end_col in KNIGHT_SQUARES[start_row*8 + start_col]:
+            if board[end_row][end_col] == knight:
+                in_check = True
+                checks.append((end_row, end_col, end_row - start_row, end_col - start_col))
         return in_check, pins, checks
 
-    
     '''
     Get all the pawn moves for the pawn located at row, col and add these moves to the list
     '''
@@ -344,23 +956,27 @@ class GameState():
             enemy_color = 'w'
         
         if self.board[r+move_amount][c] == "--": # 1 square move
-            if not piece_pinned or pin_direction == (move_amount, 0):
-                moves.append(Move((r, c), (r+move_amount, c), self.board))
+            # a pawn pinned along its file can still push, whichever side of it the king is on
+            if not piece_pinned or pin_direction == (move_amount, 0) or pin_direction == (-move_amount, 0):
+                self.addPawnMove((r, c), (r+move_amount, c), moves)
                 if r == start_row and self.board[r+2*move_amount][c] == "--": # 2 square moves
                     moves.append(Move((r,c), (r+2*move_amount, c), self.board))
         if c-1 >= 0: # captures to the left
             if not piece_pinned or pin_direction == (move_amount, -1):
                 if self.board[r + move_amount][c - 1][0] == enemy_color:
-                    moves.append(Move((r, c), (r+move_amount, c-1), self.board))
-                if (r + move_amount, c - 1) == self.enpassant_possible:
-                    enpassant = True
-                    moves.append(Move((r, c), (r+move_amount, c-1), self.board, en_passant=enpassant))
+                    self.addPawnMove((r, c), (r+move_amount, c-1), moves)
+                if (r + move_amount, c - 1) == self.enpassant_possible and self.board[r][c-1] == enemy_color + 'p':
+                    enpassant = Move((r, c), (r+move_amount, c-1), self.board, en_passant=True)
+                    if self.isEnpassantLegal(enpassant):
+                        moves.append(enpassant)
         if c+1 <= 7: # captures to the right
             if not piece_pinned or pin_direction == (move_amount, +1):
                 if self.board[r + move_amount][c + 1][0] == enemy_color:
-                    moves.append(Move((r, c), (r+move_amount, c+1), self.board))
-                if (r + move_amount, c + 1) == self.enpassant_possible:
-                    moves.append(Move((r, c), (r+move_amount, c+1), self.board, en_passant=True))
+                    self.addPawnMove((r, c), (r+move_amount, c+1), moves)
+                if (r + move_amount, c + 1) == self.enpassant_possible and self.board[r][c+1] == enemy_color + 'p':
+                    enpassant = Move((r, c), (r+move_amount, c+1), self.board, en_passant=True)
+                    if self.isEnpassantLegal(enpassant):
+                        moves.append(enpassant)
             
         # if self.whiteToMove: # white pawn moves
         #     if self.board[r-1][c] == "--": # 1 square pawn advance
@@ -395,6 +1011,28 @@ class GameState():
         #                 moves.append(Move((r, c), (r+1, c+1), self.board))
         # # add pawn promotions later
     
+    '''
+    Add a pawn move to the list, as one move per promotion piece if the pawn reaches the last rank
+    '''
+    def addPawnMove(self, start, end, moves):
+        move = Move(start, end, self.board)
+        moves.append(move)
+        if move.is_pawn_promotion:
+            for piece in ('R', 'B', 'N'):
+                moves.append(Move(start, end, self.board, promotion_choice=piece))
+    
+    '''
+    En-passant takes two pawns off the same rank (and one off a diagonal) at once, which the pin detection
+    doesn't see, so try the capture and make sure it doesn't leave our king in check
+    '''
+    def isEnpassantLegal(self, move):
+        ally_color = move.piece_moved[0]
+        king_row, king_col = self.white_king_location if ally_color == 'w' else self.black_king_location
+        self.makeMove(move)
+        in_check = self.isAttackedBy(king_row, king_col, 'b' if ally_color == 'w' else 'w')
+        self.undoMove()
+        return not in_check
+    
     '''
     Get all the rook moves for the rook located at row, col and add these moves to the list
     '''
@@ -497,32 +1135,31 @@ class GameState():
         self.getBishopMoves(r, c, moves) 
     
     '''
-    Get all the king moves for the king located at row, col and add these moves to the list
+    Get all the king moves for the king located at row, col and add these moves to the list. A destination is legal
+    when the enemy doesn't attack it, looked up from the square itself with the king left where it is
     '''
     def getKingMoves(self, r, c, moves):
-        row_moves = (-1, -1, -1, 0, 0, 1, 1, 1)
-        col_moves = (-1, 0, 1, -1, 1, -1, 0, 1)
-        ally_color = "w" if self.white_to_move else "b"
-        for i in range(8):
-            end_row = r + row_moves[i]
-            end_col = c + col_moves[i]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                endPiece = self.board[end_row][end_col]
-                if endPiece[0] != ally_color: # not an ally piece (empty or enemy piece)
-                    # place king on end square and check for checks
-                    if ally_color == "w":
-                        self.white_king_location = (end_row, end_col)
-                    else:
-                        self.black_king_location = (end_row, end_col)
-                    in_check, pins, checks = self.checkForPinsAndChecks()
-                    if not in_check:
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-                    # place king back on original location 
-                    if ally_color == "w":
-                        self.white_king_location = (r, c)
-                    else:
-                        self.black_king_location = (r, c)
-                        
+        board = self.board
+        if self.white_to_move:
+            ally_color, enemy_color = 'w', 'b'
+        else:
+            ally_color, enemy_color = 'b', 'w'
+        # the king blocks the ray of a slider checking it, so isAttackedBy misses the square just behind the king
+        behind = [(r - check[2], c - check[3]) for check in self.checks if board[check[0]][check[1]][1] in "RBQ"]
+        for end_row, end_col in KING_SQUARES[r*8 + c]:
+            if board[end_row][end_col][0] != ally_color and (end_row, end_col) not in behind and \
+                    not self.isAttackedBy(end_row, end_col, enemy_color):
+                moves.append(Move((r, c), (end_row, end_col), board))
+
+    '''
+    The king's steps onto every square not taken by its own pieces, attacked or not, for getPseudoLegalMoves
+    '''
+    def getKingStepMoves(self, r, c, moves):
+        board = self.board
+        ally_color = 'w' if self.white_to_move else 'b'
+        for end_row, end_col in KING_SQUARES[r*8 + c]:
+            if board[end_row][end_col][0] != ally_color:
+                moves.append(Move((r, c), (end_row, end_col), board))
 
     '''
     Generate all valid castle moves for the king at (r, c) and add them to the list of moves
@@ -530,9 +1167,9 @@ class GameState():
     def getCastleMoves(self, r, c, moves):
         if self.squareUnderAttack(r, c):
             return # can't castle while we are in check
-        if (self.white_to_move and self.current_castling_right.wks) or (not self.white_to_move and self.current_castling_right.bks):
+        if self.castling_rights & (WHITE_KINGSIDE if self.white_to_move else BLACK_KINGSIDE):
             self.getKingsideCastleMoves(r, c, moves)
-        if (self.white_to_move and self.current_castling_right.wqs) or (not self.white_to_move and self.current_castling_right.bqs):
+        if self.castling_rights & (WHITE_QUEENSIDE if self.white_to_move else BLACK_QUEENSIDE):
             self.getQueensideCastleMoves(r, c, moves)
         
     
@@ -547,16 +1184,24 @@ class GameState():
                 moves.append(Move((r, c), (r, c-2), self.board, is_castle_move = True))
 
 class CastleRights():
+    __slots__ = ('wks', 'bks', 'wqs', 'bqs')
+
     def __init__(self, wks, bks, wqs, bqs):
         self.wks = wks
         self.bks = bks
         self.wqs = wqs
         self.bqs = bqs
     
-
-
         
+'''
+A move is identified by its moveID, a packed integer: bits 0-5 are the start square (row*8 + col), bits 6-11 the
+end square and bits 12-13 the under-promotion piece. The search keeps moves as moveIDs in its tables (transposition
+table, principal variation, ...) and only turns one back into a Move with fromMoveID when it needs to play it.
+Move itself uses __slots__ so the hundreds created for every node don't each carry a __dict__
+'''
 class Move():
+    __slots__ = ('start_row', 'start_col', 'end_row', 'end_col', 'piece_moved', 'piece_captured', 'is_pawn_promotion',
+                 'promotion_choice', 'en_passant', 'is_castle_move', 'is_capture', 'moveID')
     # maps keys to values
     #key: value
     ranksToRows  = {"1": 7, "2": 6, "3": 5, "4": 4,
@@ -565,8 +1210,11 @@ class Move():
     filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3, 
                    "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
+    # moveID bits of the promotion piece, under-promotions don't compare equal to the queen promotion
+    promotionIDs = {"Q": 0, "R": 1 << 12, "B": 2 << 12, "N": 3 << 12}
+    promotionPieces = {v: k for k, v in promotionIDs.items()}
     
-    def __init__(self, startSq, endSq, board, en_passant=False, is_castle_move=False):
+    def __init__(self, startSq, endSq, board, en_passant=False, is_castle_move=False, promotion_choice='Q'):
         self.start_row = startSq[0]
         self.start_col = startSq[1]
         self.end_row = endSq[0]
@@ -575,6 +1223,7 @@ class Move():
         self.piece_captured = board[self.end_row][self.end_col]
         # Pawn promotion
         self.is_pawn_promotion = (self.piece_moved == 'wp' and self.end_row == 0) or (self.piece_moved == 'bp' and self.end_row == 7)
+        self.promotion_choice = promotion_choice
         # Enpassant
         # self.en_passant = (self.piece_moved[1] == 'p' and (self.end_row, self.end_col) == en_passantPossible)
         self.en_passant = en_passant
@@ -584,7 +1233,25 @@ class Move():
         self.is_castle_move = is_castle_move
         
         self.is_capture = self.piece_captured != '--'
-        self.moveID = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col
+        self.moveID = (self.start_row*8 + self.start_col) | (self.end_row*8 + self.end_col) << 6
+        if self.is_pawn_promotion:
+            self.moveID |= self.promotionIDs[promotion_choice]
+    
+    '''
+    Rebuild the Move for a packed moveID in the given position. The moveID doesn't say whether the move is
+    en-passant or castling, so that is worked out from the board
+    '''
+    @classmethod
+    def fromMoveID(cls, move_id, gs):
+        start_sq = move_id & 63
+        end_sq = (move_id >> 6) & 63
+        start = (start_sq >> 3, start_sq & 7)
+        end = (end_sq >> 3, end_sq & 7)
+        piece = gs.board[start[0]][start[1]]
+        en_passant = piece[1] == 'p' and end == gs.enpassant_possible and start[1] != end[1]
+        is_castle_move = piece[1] == 'K' and abs(end[1] - start[1]) == 2
+        return cls(start, end, gs.board, en_passant=en_passant, is_castle_move=is_castle_move,
+                   promotion_choice=cls.promotionPieces[move_id & (3 << 12)])
     
     '''
     Overriding the equals method
@@ -594,9 +1261,15 @@ class Move():
             return self.moveID == other.moveID
         return False
     
+    def __hash__(self):
+        return self.moveID
+    
     def getChessNotation(self):
         # if needed, add to this to make it like real chess notation
-        return self.getRankFile(self.start_row, self.start_col) + self.getRankFile(self.end_row, self.end_col)
+        notation = self.getRankFile(self.start_row, self.start_col) + self.getRankFile(self.end_row, self.end_col)
+        if self.is_pawn_promotion:
+            notation += self.promotion_choice.lower()
+        return notation
         
     def getRankFile(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
@@ -611,11 +1284,13 @@ class Move():
         # pawn moves
         if self.piece_moved[1] == 'p':
             if self.is_capture:
-                return self.colsToFiles[self.start_col] + "x" + end_square
+                move_string = self.colsToFiles[self.start_col] + "x" + end_square
             else:
-                return end_square
+                move_string = end_square
+            if self.is_pawn_promotion:
+                move_string += "=" + self.promotion_choice
+            return move_string
             
-            # add pawn promotions
         # add two of same type fo piece moving to a square, Nbd2 if both knights can move to d2
         
         # also adding + for check move, and # for checkmate move
@@ -624,4 +1299,22 @@ class Move():
         move_string = self.piece_moved[1]
         if self.is_capture:
             move_string += 'x'
-        return move_string + end_square
\ No newline at end of file
+        return move_string + end_square
+
+
+'''
+Create a GameState with the chosen move generation backend. Both have the same makeMove/undoMove/getValidMoves
+contract, so callers don't care which one they get. The backend defaults to the CHESS_BACKEND environment variable
+'''
+def newGameState(backend=None, fen=None):
+    if backend is None:
+        backend = os.environ.get("CHESS_BACKEND", DEFAULT_BACKEND)
+    if fen is None:
+        fen = START_FEN
+    if backend == "bitboard":
+        import BitboardEngine
+        return BitboardEngine.GameState(fen)
+    elif backend == "mailbox":
+        return GameState(fen)
+    else:
+        raise ValueError("Unknown backend: " + backend)
@@ -2,14 +2,16 @@
 This is our main driver file. It will be responsible for handling user input and displaying the current GameState object.
 """
 
+import os
 import pygame as p
-import ChessEngine, SmartMoveFinder
+import ChessEngine, SmartMoveFinder, OpeningBook
 BOARD_WIDTH = BOARD_HEIGHT = 512 # 400 is another option
 MOVE_LOG_PANEL_WIDTH = 250
 MOVE_LOG_PANEL_HEIGHT = BOARD_HEIGHT
 DIMENSION = 8 # dimeensions of a chess board are 8x8
 SQ_SIZE = BOARD_HEIGHT // DIMENSION
 MAX_FPS = 15 # for animations later on
+BOOK_FILE = "book.bin" # Polyglot opening book the AI plays from while it can, if the file exists
 IMAGES = {}
 
 '''
@@ -30,7 +32,7 @@ def main():
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
     move_log_font = p.font.SysFont("Arial", 14, False, False)
-    gs = ChessEngine.GameState()
+    gs = ChessEngine.newGameState()
     valid_moves = gs.getValidMoves()
     move_made = False # flag variable for when a move is made
     animate = False # flag variable for when we should animate a move
@@ -42,11 +44,21 @@ def main():
     game_over = False
     player_one = True # If a Human is playing white, then this will be True. if an AI is playing, then this will be false
     player_two = False # Same as above but for black
+    ai_search = None # the AI's search running in the background, if it is thinking
+    ponder_search = None # the AI thinking on the human's time about the reply it expects
+    expected_reply = None # moveID of that reply, until pondering starts
+    book = OpeningBook.OpeningBook(BOOK_FILE) if os.path.exists(BOOK_FILE) else None
     while running:
         human_turn = (gs.white_to_move and player_one) or (not gs.white_to_move and player_two)
         for e in p.event.get():
             if e.type == p.QUIT:
                 running = False
+                if ai_search is not None:
+                    ai_search.cancel()
+                    ai_search = None
+                if ponder_search is not None:
+                    ponder_search.cancel()
+                    ponder_search = None
             # mouse handler
             elif e.type == p.MOUSEBUTTONDOWN:
                 if not game_over and human_turn:
@@ -74,13 +86,19 @@ def main():
             
             # key handlers
             elif e.type == p.KEYDOWN:
+                if (e.key == p.K_z or e.key == p.K_r) and ai_search is not None: # stop the AI thinking
+                    ai_search.cancel()
+                    ai_search = None
+                if (e.key == p.K_z or e.key == p.K_r) and ponder_search is not None:
+                    ponder_search.cancel()
+                    ponder_search = None
                 if e.key == p.K_z: # undo when 'z' is pressed
                     gs.undoMove()
                     move_made = True
                     animate = False
                     game_over = False
                 if e.key == p.K_r: # reset the board when 'r' is pressed
-                    gs = ChessEngine.GameState()
+                    gs = ChessEngine.newGameState()
                     valid_moves = gs.getValidMoves()
                     sq_selected = ()
                     player_clicks = []
@@ -88,15 +106,36 @@ def main():
                     animate = False
                     game_over = False
         
-        # AI move finder
-        if not game_over and not human_turn:
-            AI_move = SmartMoveFinder.findBestMove(gs, valid_moves)
-            if AI_move is None:
-                AI_move = SmartMoveFinder.findRandomMove(valid_moves)
-            gs.makeMove(AI_move)
-            move_made = True
-            animate = True
-            print(AI_move.getChessNotation())
+        # AI move finder, searches in the background so the window keeps drawing while it thinks
+        if not game_over and not human_turn and not move_made:
+            if ai_search is None and ponder_search is not None:
+                if ponder_search.isHit(gs): # the human played the move the AI has been thinking about
+                    ai_search = ponder_search.ponderHit(valid_moves)
+                else:
+                    ponder_search.ponderMiss()
+                stats = ponder_search.progress()
+                print("ponder %s, hit rate %.0f%%, %.1fs saved in total" % ("hit" if ai_search else "miss",
+                      100 * stats["ponder_hit_rate"], stats["ponder_time_saved"]))
+                ponder_search = None
+            book_move = book.pickMove(gs, valid_moves) if book is not None and ai_search is None else None
+            if book_move is not None: # no need to search a known opening position
+                gs.makeMove(book_move)
+                move_made = True
+                animate = True
+                print(book_move.getChessNotation() + " (book)")
+            elif ai_search is None:
+                ai_search = SmartMoveFinder.BackgroundSearch(SmartMoveFinder.getDefaultSearcher(), gs, valid_moves)
+            elif ai_search.done():
+                AI_move = ai_search.result()
+                if SmartMoveFinder.PONDER and AI_move is not None:
+                    expected_reply = ai_search.expectedReply()
+                ai_search = None
+                if AI_move is None:
+                    AI_move = SmartMoveFinder.findRandomMove(valid_moves)
+                gs.makeMove(AI_move)
+                move_made = True
+                animate = True
+                print(AI_move.getChessNotation())
         
         if move_made:
             if animate:
@@ -104,8 +143,19 @@ def main():
             valid_moves = gs.getValidMoves()
             move_made = False
             animate = False
+            human_turn = (gs.white_to_move and player_one) or (not gs.white_to_move and player_two)
+            if expected_reply is not None and human_turn and any(move.moveID == expected_reply for move in valid_moves):
+                ponder_search = SmartMoveFinder.PonderSearch(SmartMoveFinder.getDefaultSearcher(), gs, expected_reply)
+            expected_reply = None
+            if ponder_search is not None and not valid_moves: # the game is over
+                ponder_search.cancel()
+                ponder_search = None
                 
         drawGameState(screen, gs, valid_moves, sq_selected, move_log_font)
+        if ai_search is not None:
+            drawSearchProgress(screen, ai_search.progress(), move_log_font)
+        elif ponder_search is not None:
+            drawSearchProgress(screen, ponder_search.progress(), move_log_font, "Pondering")
         
         if gs.checkmate or gs.stalemate:
             game_over = True
@@ -115,6 +165,8 @@ def main():
         
         clock.tick(MAX_FPS) 
         p.display.flip()
+    if book is not None:
+        book.close()
 
 '''
 Responsible for all the graphics within a current game state
@@ -192,6 +244,16 @@ def drawMoveLog(screen, gs, font):
         screen.blit(textObject, textLocation)
         textY += textObject.get_height() + line_spacing
 
+'''
+Show how far the AI has got with its search at the bottom of the move log panel
+'''
+def drawSearchProgress(screen, progress, font, label="Thinking"):
+    text = "%s... depth %d  %d nodes  %d nodes/s" % (label, progress["searching_depth"], progress["nodes"],
+                                                     progress["nodes_per_second"])
+    textObject = font.render(text, True, p.Color('yellow'))
+    padding = 5
+    screen.blit(textObject, (BOARD_WIDTH + padding, MOVE_LOG_PANEL_HEIGHT - textObject.get_height() - padding))
+
 '''
 Animating a move
 '''
@@ -0,0 +1,115 @@
+"""
+Load test client for GameServer.py: a number of simulated players, each on its own connection, play random legal
+moves against the engine in several games at once, then the server's queue and latency statistics are printed.
+
+python GameServer.py --port 8765 &
+python GameClient.py --port 8765 --clients 4 --games 3 --move-time 0.1
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import sys
+import time
+
+'''
+One connection to the server. Requests can be outstanding concurrently, answers are matched up by request_id
+'''
+class Connection():
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.request_ids = itertools.count(1)
+        self.pending = {}
+        self.read_task = asyncio.ensure_future(self.readAnswers())
+
+    @classmethod
+    async def open(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def readAnswers(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            response = json.loads(line)
+            future = self.pending.pop(response.get("request_id"), None)
+            if future is not None:
+                future.set_result(response)
+        for future in self.pending.values():
+            future.set_exception(ConnectionError("the server closed the connection"))
+
+    async def request(self, **request):
+        request["request_id"] = next(self.request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request["request_id"]] = future
+        self.writer.write((json.dumps(request) + "\n").encode())
+        await self.writer.drain()
+        return await future
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.read_task.cancel()
+
+'''
+Play one game of random moves against the engine, returns the result and the seconds each engine reply took
+'''
+async def playGame(connection, rng, args):
+    state = await connection.request(cmd="new", engine="b", move_time=args.move_time, nodes=args.nodes)
+    game_id = state["game_id"]
+    reply_times = []
+    for _ in range(args.max_moves):
+        if state.get("result") is not None or not state["moves"]:
+            break
+        start = time.perf_counter()
+        state = await connection.request(cmd="move", game_id=game_id, move=rng.choice(state["moves"]))
+        reply_times.append(time.perf_counter() - start)
+        if "error" in state:
+            print("game %d: %s" % (game_id, state["error"]), file=sys.stderr)
+            break
+    await connection.request(cmd="close", game_id=game_id)
+    return state.get("result"), reply_times
+
+async def runClient(client_number, args):
+    connection = await Connection.open(args.host, args.port)
+    rng = random.Random(client_number)
+    try:
+        results = await asyncio.gather(*(playGame(connection, rng, args) for _ in range(args.games)))
+    finally:
+        await connection.close()
+    return results
+
+async def run(args):
+    start = time.perf_counter()
+    client_results = await asyncio.gather(*(runClient(client_number, args) for client_number in range(args.clients)))
+    elapsed = time.perf_counter() - start
+    reply_times = sorted(reply for results in client_results for _, replies in results for reply in replies)
+    games = sum(len(results) for results in client_results)
+    print("%d games, %d engine moves in %.1fs, %.1f engine moves/s" % (games, len(reply_times), elapsed,
+                                                                       len(reply_times) / elapsed))
+    if reply_times:
+        print("reply time as seen by the client: p50 %.0f ms, p90 %.0f ms, max %.0f ms"
+              % (reply_times[len(reply_times) // 2] * 1000, reply_times[len(reply_times) * 9 // 10] * 1000,
+                 reply_times[-1] * 1000))
+    connection = await Connection.open(args.host, args.port)
+    print("server: " + json.dumps(await connection.request(cmd="stats")))
+    await connection.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play many concurrent random games against GameServer.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--clients", type=int, default=4, help="connections")
+    parser.add_argument("--games", type=int, default=2, help="games at once per connection")
+    parser.add_argument("--max-moves", type=int, default=20, help="moves per game before closing it")
+    parser.add_argument("--move-time", type=float, default=0.1, help="engine seconds per move")
+    parser.add_argument("--nodes", type=int, help="engine node limit per move")
+    args = parser.parse_args(argv)
+    asyncio.run(run(args))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
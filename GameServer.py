@@ -0,0 +1,290 @@
+"""
+Headless game server: many games in one asyncio process, the engine's searches run on a bounded process pool.
+Clients connect over TCP and send one JSON object per line, each answered by one JSON line (with the request's
+"request_id" copied back, so a client can have several requests outstanding on one connection).
+
+{"cmd": "new", "engine": "b", "move_time": 0.2}      start a game, engine plays black, 0.2s a move
+{"cmd": "new", "engine": "w", "clock": 60, "increment": 1, "fen": "<fen>"}   engine on a 60s+1s clock
+{"cmd": "move", "game_id": 1, "move": "e2e4"}        play a move, the answer carries the engine's reply
+{"cmd": "go", "game_id": 1}                          make the engine move for the side to move
+{"cmd": "state", "game_id": 1}                       position, legal moves, result and engine clock
+{"cmd": "close", "game_id": 1}
+{"cmd": "stats"}                                     games, queue depth and latency percentiles
+
+Searches are queued per client connection and the queues are served round robin, so one client with many games
+can't starve the others. Each game has at most one search queued or running.
+
+python GameServer.py --port 8765 --workers 4
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import sys
+import time
+
+import ChessEngine
+import Match
+import SmartMoveFinder
+
+DEFAULT_MOVE_TIME = 0.5 # seconds per engine move when a game sets neither move_time nor clock
+MOVES_TO_GO = 30 # engine moves a game clock is spread over
+LATENCY_SAMPLES = 1000 # most recent searches the percentiles are taken over
+
+'''
+One game on the server. The engine plays engine_color ('w', 'b' or None for neither), either with a fixed time
+per move or from a clock that its searches use up
+'''
+class Game():
+    def __init__(self, game_id, client_id, gs, engine_color, move_time, clock, increment, node_limit):
+        self.game_id = game_id
+        self.client_id = client_id
+        self.gs = gs
+        self.engine_color = engine_color
+        self.move_time = move_time
+        self.clock = clock # engine seconds left, None without a clock
+        self.increment = increment
+        self.node_limit = node_limit
+        self.positions = {gs.zobrist_key: 1} # for repetitions
+        self.result = None
+        self.searching = False
+
+    def engineToMove(self):
+        return self.result is None and self.engine_color == ('w' if self.gs.white_to_move else 'b')
+
+    '''
+    Seconds for the next engine move, None when it only has a node limit
+    '''
+    def timeForMove(self):
+        if self.clock is None:
+            return self.move_time
+        return max(self.clock / MOVES_TO_GO + self.increment, 0.01)
+
+    def makeMove(self, move):
+        self.gs.makeMove(move)
+        self.positions[self.gs.zobrist_key] = self.positions.get(self.gs.zobrist_key, 0) + 1
+        if not self.gs.getValidMoves():
+            if self.gs.checkmate:
+                self.result = "0-1" if self.gs.white_to_move else "1-0"
+            else:
+                self.result = "1/2-1/2"
+        elif Match.drawReason(self.gs, self.positions) is not None:
+            self.result = "1/2-1/2"
+
+    def state(self):
+        return {"game_id": self.game_id, "fen": self.gs.toFen(), "result": self.result,
+                "moves": [move.getChessNotation() for move in self.gs.getValidMoves()] if self.result is None else [],
+                "clock": self.clock}
+
+worker_searcher = None # the Searcher of each pool process
+
+'''
+Search a position in a pool process. Returns the best move in UCI notation, the nodes searched and the time taken
+'''
+def searchPosition(task):
+    global worker_searcher
+    fen, backend, time_limit, node_limit = task
+    if worker_searcher is None:
+        worker_searcher = SmartMoveFinder.Searcher()
+    gs = ChessEngine.newGameState(backend, fen)
+    valid_moves = gs.getValidMoves()
+    move = worker_searcher.findBestMove(gs, valid_moves, time_limit=time_limit, node_limit=node_limit)
+    if move is None and valid_moves:
+        move = valid_moves[0]
+    stats = worker_searcher.stats()
+    return move.getChessNotation() if move is not None else None, stats["nodes"], stats["time"]
+
+def percentiles(samples):
+    if not samples:
+        return {"p50": None, "p90": None, "p99": None}
+    ordered = sorted(samples)
+    return {"p%d" % p: round(ordered[min(len(ordered) - 1, len(ordered) * p // 100)] * 1000, 1) for p in (50, 90, 99)}
+
+class GameServer():
+    def __init__(self, workers, backend=None):
+        self.workers = workers
+        self.backend = backend
+        self.executor = None
+        self.games = {}
+        self.next_game_id = 1
+        self.next_client_id = 1
+        self.queues = collections.OrderedDict() # client id -> deque of (game, future, time queued), served round robin
+        self.queued = 0
+        self.in_flight = 0
+        self.searches = 0
+        self.nodes = 0
+        self.search_seconds = 0.0
+        self.queue_waits = collections.deque(maxlen=LATENCY_SAMPLES) # seconds from queued to started
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES) # seconds from queued to answered
+
+    async def serve(self, host, port):
+        from concurrent.futures import ProcessPoolExecutor
+        self.executor = ProcessPoolExecutor(self.workers)
+        server = await asyncio.start_server(self.handleClient, host, port)
+        print("listening on %s:%d with %d search processes" % (host, port, self.workers), file=sys.stderr)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(cancel_futures=True)
+
+    async def handleClient(self, reader, writer):
+        client_id = self.next_client_id
+        self.next_client_id += 1
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.ensure_future(self.answer(client_id, line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            for task in tasks:
+                task.cancel()
+            for game_id in [game_id for game_id, game in self.games.items() if game.client_id == client_id]:
+                del self.games[game_id] # games end with their connection
+            writer.close()
+
+    async def answer(self, client_id, line, writer):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            request = None
+        if not isinstance(request, dict):
+            request = {}
+            response = {"error": "a request is a JSON object on one line"}
+        else:
+            try:
+                response = await self.handleRequest(client_id, request)
+            except (ValueError, KeyError, TypeError) as e:
+                response = {"error": "%s: %s" % (type(e).__name__, e)}
+        if "request_id" in request:
+            response["request_id"] = request["request_id"]
+        writer.write((json.dumps(response) + "\n").encode())
+        await writer.drain()
+
+    async def handleRequest(self, client_id, request):
+        command = request["cmd"]
+        if command == "stats":
+            return self.stats()
+        if command == "new":
+            gs = ChessEngine.newGameState(self.backend, request.get("fen"))
+            move_time = request.get("move_time")
+            clock = request.get("clock")
+            if move_time is None and clock is None and request.get("nodes") is None:
+                move_time = DEFAULT_MOVE_TIME
+            game = Game(self.next_game_id, client_id, gs, request.get("engine"), move_time, clock,
+                        request.get("increment", 0), request.get("nodes"))
+            self.games[game.game_id] = game
+            self.next_game_id += 1
+            response = {}
+            if game.engineToMove():
+                response["engine_move"] = await self.engineMove(game)
+            response.update(game.state())
+            return response
+        game = self.games.get(request.get("game_id"))
+        if game is None:
+            return {"error": "no game %s" % request.get("game_id")}
+        if command == "state":
+            return game.state()
+        if command == "close":
+            del self.games[game.game_id]
+            return {"game_id": game.game_id, "closed": True}
+        if game.searching:
+            return {"error": "the engine is thinking", "game_id": game.game_id}
+        if game.result is not None:
+            return dict(game.state(), error="the game is over")
+        response = {}
+        if command == "move":
+            move = next((move for move in game.gs.getValidMoves() if move.getChessNotation() == request["move"]), None)
+            if move is None:
+                return dict(game.state(), error="illegal move " + request["move"])
+            game.makeMove(move)
+            if game.engineToMove():
+                response["engine_move"] = await self.engineMove(game)
+        elif command == "go":
+            response["engine_move"] = await self.engineMove(game)
+        else:
+            return {"error": "unknown command " + command}
+        response.update(game.state())
+        return response
+
+    '''
+    Queue a search for the game's side to move, wait for it and play the move found
+    '''
+    async def engineMove(self, game):
+        future = asyncio.get_running_loop().create_future()
+        game.searching = True
+        self.queues.setdefault(game.client_id, collections.deque()).append((game, future, time.perf_counter()))
+        self.queued += 1
+        self.dispatch()
+        try:
+            notation = await future
+        finally:
+            game.searching = False
+        if notation is not None and game.game_id in self.games:
+            game.makeMove(next(move for move in game.gs.getValidMoves() if move.getChessNotation() == notation))
+        return notation
+
+    '''
+    Start queued searches while there are free processes, taking one from each client's queue in turn
+    '''
+    def dispatch(self):
+        while self.in_flight < self.workers and self.queues:
+            client_id, queue = self.queues.popitem(last=False)
+            game, future, queued_at = queue.popleft()
+            if queue:
+                self.queues[client_id] = queue # back of the line
+            self.queued -= 1
+            if future.cancelled():
+                continue
+            self.in_flight += 1
+            asyncio.ensure_future(self.runSearch(game, future, queued_at))
+
+    async def runSearch(self, game, future, queued_at):
+        started = time.perf_counter()
+        self.queue_waits.append(started - queued_at)
+        task = (game.gs.toFen(), self.backend, game.timeForMove(), game.node_limit)
+        try:
+            notation, nodes, seconds = await asyncio.get_running_loop().run_in_executor(self.executor,
+                                                                                        searchPosition, task)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        finally:
+            self.in_flight -= 1
+            self.dispatch()
+        if game.clock is not None:
+            game.clock = max(game.clock - (time.perf_counter() - started) + game.increment, 0.0)
+        self.searches += 1
+        self.nodes += nodes
+        self.search_seconds += seconds
+        self.latencies.append(time.perf_counter() - queued_at)
+        if not future.done():
+            future.set_result(notation)
+
+    def stats(self):
+        return {"games": len(self.games), "queue_depth": self.queued, "in_flight": self.in_flight,
+                "workers": self.workers, "searches": self.searches,
+                "nodes_per_second": round(self.nodes / self.search_seconds) if self.search_seconds else 0,
+                "queue_wait_ms": percentiles(self.queue_waits), "latency_ms": percentiles(self.latencies)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Host many engine games over a local JSON-lines socket")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="search processes")
+    parser.add_argument("--backend", choices=["mailbox", "bitboard"], help="defaults to $CHESS_BACKEND or mailbox")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(GameServer(args.workers, args.backend).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""
+Self-play match between two search configurations, to check that a change doesn't cost playing strength. Every
+opening is played twice with the colours swapped, the games run in parallel worker processes and are adjudicated
+as draws on threefold repetition, the 50 move rule, insufficient material or a ply limit. Reports the result from
+the first engine's point of view with an Elo estimate and its 95% error bars, and each engine's nodes per second.
+
+python Match.py --engine1 depth=3 --engine2 depth=2
+python Match.py --engine1 depth=2 --engine2 depth=2,quiescence=0 --games 40 --workers 4
+python Match.py --engine1 node_limit=5000 --engine2 node_limit=5000,delta_margin=0 --openings openings.epd
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import ChessEngine
+import SmartMoveFinder
+
+MAX_PLIES = 300 # adjudicate longer games as draws
+# a few plies into common openings, so the games don't all repeat the same line
+OPENINGS = [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", # start position
+    "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3", # open game
+    "rnbqkbnr/pp1ppppp/8/2p5/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2", # sicilian
+    "rnbqkbnr/pppp1ppp/4p3/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2", # french
+    "rnbqkbnr/pp1ppppp/2p5/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2", # caro-kann
+    "rnbqkbnr/ppp1pppp/8/3p4/2PP4/8/PP2PPPP/RNBQKBNR b KQkq - 0 2", # queen's gambit
+    "rnbqkb1r/pppppp1p/5np1/8/2PP4/8/PP2PPPP/RNBQKBNR w KQkq - 0 3", # king's indian
+    "rnbqkbnr/pppppppp/8/8/2P5/8/PP1PPPPP/RNBQKBNR b KQkq - 0 1", # english
+]
+# Searcher attributes a configuration may set
+SETTINGS = ("depth", "time_limit", "node_limit", "max_depth", "quiescence", "quiescence_node_limit", "delta_margin",
+            "tablebase", "lazy_legality", "staged_moves", "null_move", "late_move_reductions",
+            "futility_pruning")
+
+'''
+Parse "depth=3,quiescence=0,time_limit=0.5" into a dict of Searcher settings
+'''
+def parseConfig(text):
+    config = {}
+    for item in filter(None, text.split(',')):
+        name, _, value = item.partition('=')
+        name = name.strip()
+        if name not in SETTINGS:
+            raise ValueError("unknown setting %s, expected one of %s" % (name, ", ".join(SETTINGS)))
+        value = value.strip()
+        if value.lower() in ("none", ""):
+            config[name] = None
+        elif value.lower() in ("true", "false"):
+            config[name] = value.lower() == "true"
+        else:
+            config[name] = float(value) if '.' in value else int(value)
+    return config
+
+def makeSearcher(config, seed):
+    searcher = SmartMoveFinder.Searcher(seed=seed)
+    for name, value in config.items():
+        if name == "tablebase":
+            if not value:
+                searcher.tablebase = None
+        elif name == "quiescence":
+            searcher.quiescence = bool(value)
+        else:
+            setattr(searcher, name, value)
+    return searcher
+
+'''
+Why the game is a draw, or None if it goes on. positions counts how often each Zobrist key has occurred
+'''
+def drawReason(gs, positions):
+    if positions[gs.zobrist_key] >= 3:
+        return "repetition"
+    if gs.halfmove_clock >= 100:
+        return "50 moves"
+    if gs.piece_count <= 3 and not any(square[1] in "QRp" for row in gs.board for square in row if square != "--"):
+        return "insufficient material"
+    if len(gs.move_log) >= MAX_PLIES:
+        return "ply limit"
+    return None
+
+'''
+Play one game, runs in a worker process. Returns (game number, result for white: 1, 0.5 or 0, reason, plies,
+per engine [nodes, seconds searched] with white's first)
+'''
+def playGame(task):
+    game_number, fen, white_config, black_config, backend = task
+    gs = ChessEngine.newGameState(backend, fen)
+    searchers = (makeSearcher(white_config, game_number), makeSearcher(black_config, game_number))
+    effort = [[0, 0.0], [0, 0.0]]
+    positions = {gs.zobrist_key: 1}
+    while True:
+        valid_moves = gs.getValidMoves()
+        if not valid_moves:
+            if gs.checkmate:
+                return game_number, 0 if gs.white_to_move else 1, "checkmate", len(gs.move_log), effort
+            return game_number, 0.5, "stalemate", len(gs.move_log), effort
+        reason = drawReason(gs, positions)
+        if reason is not None:
+            return game_number, 0.5, reason, len(gs.move_log), effort
+        side = 0 if gs.white_to_move else 1
+        searcher = searchers[side]
+        move = searcher.findBestMove(gs, valid_moves)
+        if move is None:
+            move = valid_moves[0]
+        stats = searcher.stats()
+        effort[side][0] += stats["nodes"]
+        effort[side][1] += stats["time"]
+        gs.makeMove(move)
+        positions[gs.zobrist_key] = positions.get(gs.zobrist_key, 0) + 1
+
+'''
+Elo difference for a score fraction, and the 95% interval around it from the spread of the game results
+'''
+def eloEstimate(results):
+    games = len(results)
+    score = sum(results) / games
+    variance = sum((result - score) ** 2 for result in results) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    return scoreToElo(score), scoreToElo(score - margin), scoreToElo(score + margin)
+
+def scoreToElo(score):
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return -400 * math.log10(1 / score - 1)
+
+def runMatch(config1, config2, games, openings, workers, backend=None):
+    tasks = []
+    for game_number in range(games):
+        fen = openings[(game_number // 2) % len(openings)]
+        if game_number % 2 == 0: # engine 1 takes white, then black from the same opening
+            tasks.append((game_number, fen, config1, config2, backend))
+        else:
+            tasks.append((game_number, fen, config2, config1, backend))
+    pool = None
+    if workers > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(workers)
+        games_played = pool.imap_unordered(playGame, tasks)
+    else:
+        games_played = map(playGame, tasks)
+    results = [] # engine 1's score in each game
+    effort = [[0, 0.0], [0, 0.0]] # engine 1 and 2: nodes, seconds
+    wins = draws = losses = 0
+    start = time.perf_counter()
+    try:
+        for game_number, white_result, reason, plies, game_effort in games_played:
+            engine1_white = game_number % 2 == 0
+            result = white_result if engine1_white else 1 - white_result
+            results.append(result)
+            wins += result == 1
+            draws += result == 0.5
+            losses += result == 0
+            for side, engine in ((0, 0), (1, 1)) if engine1_white else ((0, 1), (1, 0)):
+                effort[engine][0] += game_effort[side][0]
+                effort[engine][1] += game_effort[side][1]
+            print("game %3d  engine 1 %s  %-7s %-22s %3d plies   +%d =%d -%d"
+                  % (game_number + 1, "white" if engine1_white else "black",
+                     {1: "won", 0.5: "drew", 0: "lost"}[result], reason, plies, wins, draws, losses))
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    elapsed = time.perf_counter() - start
+    elo, elo_low, elo_high = eloEstimate(results)
+    print("engine 1 vs engine 2: +%d =%d -%d, score %.1f%%, Elo %+.0f (95%% %+.0f to %+.0f), %d games in %.0fs"
+          % (wins, draws, losses, 100 * sum(results) / len(results), elo, elo_low, elo_high, len(results), elapsed))
+    for engine, (nodes, seconds) in enumerate(effort, 1):
+        print("engine %d: %d nodes, %.1fs searching, %.0f nodes/s"
+              % (engine, nodes, seconds, nodes / seconds if seconds else 0.0))
+    return wins, draws, losses
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play two search configurations against each other")
+    parser.add_argument("--engine1", default="", help="settings of the first engine, e.g. depth=3,quiescence=0 "
+                                                      "(any of %s)" % ", ".join(SETTINGS))
+    parser.add_argument("--engine2", default="", help="settings of the second engine")
+    parser.add_argument("--games", type=int, default=2 * len(OPENINGS), help="number of games (default: 2 per opening)")
+    parser.add_argument("--openings", help="EPD or FEN file of start positions (default: a built in set)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="games played at once")
+    parser.add_argument("--backend", choices=["mailbox", "bitboard"], help="defaults to $CHESS_BACKEND or mailbox")
+    args = parser.parse_args(argv)
+    try:
+        config1 = parseConfig(args.engine1)
+        config2 = parseConfig(args.engine2)
+    except ValueError as e:
+        parser.error(str(e))
+    openings = OPENINGS
+    if args.openings:
+        import Analysis
+        with open(args.openings) as f:
+            openings = [fen for _, fen, _ in Analysis.readEpd(f)]
+        if not openings:
+            parser.error("no positions in " + args.openings)
+    try:
+        runMatch(config1, config2, args.games, openings, args.workers, args.backend)
+    except KeyboardInterrupt:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
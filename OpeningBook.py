@@ -0,0 +1,161 @@
+"""
+Opening book in the Polyglot .bin format. The file is memory-mapped and binary searched by the position's key, so
+only the few pages a lookup touches are ever read and a lookup costs a few microseconds however big the book is.
+
+python OpeningBook.py book.bin                     the book moves of the start position
+python OpeningBook.py book.bin --fen "<fen>"       the book moves of a position
+"""
+import argparse
+import mmap
+import random
+import struct
+import sys
+import time
+
+import ChessEngine
+
+ENTRY = struct.Struct(">QHHI") # key, move, weight, learn: 16 bytes per entry, sorted by key
+KEY = struct.Struct(">Q")
+POLYGLOT_PROMOTIONS = {1: 'N', 2: 'B', 3: 'R', 4: 'Q'}
+# Polyglot writes castling as the king taking its own rook
+POLYGLOT_CASTLING = {(7, 4, 7, 7): (7, 6), (7, 4, 7, 0): (7, 2), (0, 4, 0, 7): (0, 6), (0, 4, 0, 0): (0, 2)}
+
+'''
+A Polyglot book opened read-only. pickMove chooses among the book moves of a position at random, in proportion
+to their weights, with the book's own random number generator, seeded with seed
+'''
+class OpeningBook():
+    def __init__(self, path, seed=None):
+        self.path = path
+        self.file = open(path, "rb")
+        self.size = 0
+        self.data = None
+        self.random = random.Random(seed)
+        self.hits = 0 # lookups that found the position
+        self.misses = 0
+        file_size = self.file.seek(0, 2)
+        if file_size >= ENTRY.size: # an empty file can't be mapped, and has nothing in it anyway
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.size = file_size // ENTRY.size
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+        self.file.close()
+
+    '''
+    The (move, weight) pairs stored for a Polyglot key, with the moves still in Polyglot's 16 bit encoding
+    '''
+    def findEntries(self, key):
+        data = self.data
+        low, high = 0, self.size
+        while low < high: # the first entry with this key or a larger one
+            middle = (low + high) // 2
+            if KEY.unpack_from(data, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        while low < self.size:
+            entry_key, move, weight, _ = ENTRY.unpack_from(data, low * ENTRY.size)
+            if entry_key != key:
+                break
+            entries.append((move, weight))
+            low += 1
+        return entries
+
+    '''
+    The legal book moves of the position and their weights. Book entries that aren't legal here (a key collision
+    or a broken book) are left out
+    '''
+    def getMoves(self, gs, valid_moves=None):
+        entries = self.findEntries(gs.polyglotKey())
+        if not entries:
+            self.misses += 1
+            return []
+        self.hits += 1
+        if valid_moves is None:
+            valid_moves = gs.getValidMoves()
+        moves_by_id = {move.moveID: move for move in valid_moves}
+        book_moves = []
+        for polyglot_move, weight in entries:
+            move = moves_by_id.get(decodeMove(polyglot_move, gs))
+            if move is not None:
+                book_moves.append((move, weight))
+        return book_moves
+
+    '''
+    A book move for the position picked at random by weight, None when the position is out of book
+    '''
+    def pickMove(self, gs, valid_moves=None):
+        book_moves = self.getMoves(gs, valid_moves)
+        total = sum(weight for _, weight in book_moves)
+        if total == 0:
+            return None # out of book, or only moves the book says never to play
+        choice = self.random.randrange(total)
+        for move, weight in book_moves:
+            choice -= weight
+            if choice < 0:
+                return move
+
+    def stats(self):
+        return {"entries": self.size, "hits": self.hits, "misses": self.misses}
+
+'''
+The moveID of a move in Polyglot's encoding (to file, to rank, from file, from rank, promotion piece: 3 bits each)
+in the position gs
+'''
+def decodeMove(polyglot_move, gs):
+    end_col = polyglot_move & 7
+    end_row = 7 - ((polyglot_move >> 3) & 7)
+    start_col = (polyglot_move >> 6) & 7
+    start_row = 7 - ((polyglot_move >> 9) & 7)
+    if gs.board[start_row][start_col][1] == 'K':
+        end_row, end_col = POLYGLOT_CASTLING.get((start_row, start_col, end_row, end_col), (end_row, end_col))
+    move_id = (start_row*8 + start_col) | (end_row*8 + end_col) << 6
+    promotion = POLYGLOT_PROMOTIONS.get((polyglot_move >> 12) & 7)
+    if promotion is not None:
+        move_id |= ChessEngine.Move.promotionIDs[promotion]
+    return move_id
+
+'''
+A Move in Polyglot's encoding, the inverse of decodeMove
+'''
+def encodeMove(move):
+    end_col = move.end_col
+    if move.is_castle_move:
+        end_col = 7 if move.end_col == 6 else 0
+    polyglot_move = end_col | (7 - move.end_row) << 3 | move.start_col << 6 | (7 - move.start_row) << 9
+    if move.is_pawn_promotion:
+        polyglot_move |= {'N': 1, 'B': 2, 'R': 3, 'Q': 4}[move.promotion_choice] << 12
+    return polyglot_move
+
+'''
+Write a book from (key, polyglot move, weight) entries, sorted the way lookups expect
+'''
+def writeBook(path, entries):
+    with open(path, "wb") as f:
+        for key, polyglot_move, weight in sorted(entries):
+            f.write(ENTRY.pack(key, polyglot_move, weight, 0))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List the book moves of a position in a Polyglot book")
+    parser.add_argument("book", help="Polyglot .bin file")
+    parser.add_argument("--fen", default=ChessEngine.START_FEN, help="position to look up (default: start position)")
+    args = parser.parse_args(argv)
+    book = OpeningBook(args.book)
+    gs = ChessEngine.GameState.fromFen(args.fen)
+    start = time.perf_counter()
+    book_moves = book.getMoves(gs)
+    elapsed = time.perf_counter() - start
+    total = sum(weight for _, weight in book_moves)
+    for move, weight in sorted(book_moves, key=lambda book_move: -book_move[1]):
+        print("%-6s %6d  %5.1f%%" % (move.getChessNotation(), weight, 100 * weight / total if total else 0.0))
+    print("%d entries in the book, key %016x, %d book moves, lookup %.1f us"
+          % (book.size, gs.polyglotKey(), len(book_moves), elapsed * 1e6))
+    book.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+Perft (performance test) for the move generator. Counts the leaf nodes of the legal move tree to a given depth and
+compares them with published reference counts, so any change to move generation can be checked for correctness
+and timed in nodes per second.
+
+python Perft.py                          run the reference suite to depth 3
+python Perft.py --depth 4                run the reference suite to depth 4 (where counts are known)
+python Perft.py --fen "<fen>" --depth 3 --divide    count one position and show the count below each move
+python Perft.py --backend bitboard       use the bitboard move generator
+python Perft.py --generator staged       count through the staged moves the search uses instead of getValidMoves
+"""
+import argparse
+import sys
+import time
+
+import ChessEngine
+
+# well known positions chosen to exercise castling, en-passant, promotions, pins and checks
+# (from the Chess Programming Wiki perft results page) and their node counts at depth 1, 2, 3, ...
+PERFT_SUITE = [
+    ("start position", ChessEngine.START_FEN,
+     [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("rook endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624]),
+    ("promotions", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333]),
+    ("promotions mirrored", "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+     [6, 264, 9467, 422333]),
+    ("discovered checks", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487]),
+    ("middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+]
+
+# the ways perft can get the moves of a position, see generateMoves
+GENERATORS = ["legal", "pseudo", "staged"]
+
+'''
+The legal moves of the position from the given generator: getValidMoves, getPseudoLegalMoves tested with isLegal,
+or getStagedMoves tested with isLegal. The last two are tested as they are handed out, in between the moves
+perft makes, like the search does. The staged moves are given a move played at the same depth somewhere else
+in the tree as hash move and another as killer (killers[depth]), so moves that don't fit the position get
+offered and a move is handed out twice when the stages don't skip the ones already given
+'''
+def generateMoves(gs, generator, depth, killers):
+    if generator == "pseudo":
+        return (move for move in gs.getPseudoLegalMoves() if gs.isLegal(move))
+    if generator == "staged":
+        hash_move, killer = killers[depth]
+        return (move for move in gs.getStagedMoves(hash_move, (killer,)) if gs.isLegal(move))
+    return gs.getValidMoves()
+
+'''
+Count the leaf nodes of the legal move tree depth plies below the current position
+'''
+def perft(gs, depth, generator="legal", killers=None):
+    if killers is None:
+        killers = [[None, None] for _ in range(depth + 1)]
+    moves = generateMoves(gs, generator, depth, killers)
+    if depth == 1:
+        return sum(1 for _ in moves)
+    nodes = 0
+    for move in moves:
+        killers[depth] = [move.moveID, killers[depth][0]]
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1, generator, killers)
+        gs.undoMove()
+    return nodes
+
+'''
+Perft split by root move, the usual way to find which move a wrong count comes from
+'''
+def divide(gs, depth, generator="legal"):
+    counts = []
+    killers = [[None, None] for _ in range(depth + 1)]
+    for move in generateMoves(gs, generator, depth, killers):
+        gs.makeMove(move)
+        counts.append((move.getChessNotation(), perft(gs, depth - 1, generator, killers) if depth > 1 else 1))
+        gs.undoMove()
+    return counts
+
+def runPosition(fen, depth, backend=None, show_divide=False, generator="legal"):
+    gs = ChessEngine.newGameState(backend, fen)
+    start = time.perf_counter()
+    if show_divide:
+        counts = divide(gs, depth, generator)
+        for notation, nodes in sorted(counts):
+            print(notation + ": " + str(nodes))
+        nodes = sum(nodes for _, nodes in counts)
+    else:
+        nodes = perft(gs, depth, generator)
+    elapsed = time.perf_counter() - start
+    return nodes, elapsed
+
+'''
+Run every suite position up to depth (or as deep as its reference counts go). Returns True if all counts match
+'''
+def runSuite(depth, backend=None, generator="legal"):
+    all_passed = True
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, expected_counts in PERFT_SUITE:
+        position_depth = min(depth, len(expected_counts))
+        nodes, elapsed = runPosition(fen, position_depth, backend, generator=generator)
+        expected = expected_counts[position_depth - 1]
+        passed = nodes == expected
+        all_passed = all_passed and passed
+        total_nodes += nodes
+        total_time += elapsed
+        print("%-20s depth %d  nodes %9d  expected %9d  %s  %6.2fs  %8.0f nodes/s"
+              % (name, position_depth, nodes, expected, "ok  " if passed else "FAIL", elapsed, nodes / elapsed))
+    print("total nodes %d in %.2fs, %.0f nodes/s" % (total_nodes, total_time, total_nodes / total_time))
+    return all_passed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count move generator leaf nodes and check them against reference counts")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fen", help="position to count instead of running the reference suite")
+    parser.add_argument("--divide", action="store_true", help="print the node count below each root move")
+    parser.add_argument("--backend", choices=["mailbox", "bitboard"], help="defaults to $CHESS_BACKEND or mailbox")
+    parser.add_argument("--generator", choices=GENERATORS, default="legal",
+                        help="getValidMoves, pseudo-legal moves tested with isLegal, or the staged moves")
+    args = parser.parse_args(argv)
+    if args.fen is None and not args.divide:
+        return 0 if runSuite(args.depth, args.backend, args.generator) else 1
+    nodes, elapsed = runPosition(args.fen or ChessEngine.START_FEN, args.depth, args.backend, args.divide,
+                                 args.generator)
+    print("nodes %d in %.2fs, %.0f nodes/s" % (nodes, elapsed, nodes / elapsed))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
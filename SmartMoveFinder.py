@@ -1,9 +1,151 @@
+import copy
 import random
+import threading
+import time
 
-piece_score = {"K": 0, "Q": 10, "R": 5, "B": 3, "N": 3, "p": 1}
+import ChessEngine
+import Tablebase
+
+piece_score = ChessEngine.PIECE_SCORE
 CHECKMATE = 1000
 STALEMATE = 0
 DEPTH = 2
+TT_SIZE_MB = 16 # memory budget for the transposition table
+TIME_LIMIT = None # seconds per move; when set (or NODE_LIMIT is) findBestMove uses iterative deepening
+NODE_LIMIT = None # nodes per move
+MAX_DEPTH = 64 # deepest iteration a budgeted search will start
+WORKERS = 1 # processes for a fixed depth search, more than 1 splits the root moves across a process pool
+PONDER = True # let the AI think on the opponent's time about the reply it expects
+KILLERS_PER_PLY = 2
+QUIESCENCE_SEARCH = True # keep searching captures past the horizon instead of scoring mid-exchange
+QUIESCENCE_NODE_LIMIT = 200000 # quiescence nodes per search (per iteration when deepening), then it stands pat
+DELTA_MARGIN = 2 # a capture that can't raise the score to alpha even with this much to spare is skipped
+LAZY_LEGALITY = True # below the root search pseudo-legal moves and only test the ones actually tried for legality
+STAGED_MOVES = True # with LAZY_LEGALITY, generate the moves in stages (GameState.getStagedMoves) instead of all at once
+NULL_MOVE_PRUNING = True # try passing first, if even that fails high the node is cut off
+NULL_MOVE_REDUCTION = 2 # plies the search after a pass is made shallower by, on top of the ply passed
+LATE_MOVE_REDUCTIONS = True # search quiet moves that come late in the ordering a ply shallower first
+LMR_MIN_DEPTH = 3 # remaining depth a node needs for its moves to be reduced
+LMR_FULL_MOVES = 3 # legal moves at a node searched to full depth before quiet ones are reduced
+FUTILITY_PRUNING = True # skip quiet moves near the leaves when the material is too far below alpha
+FUTILITY_MARGINS = (0, 1, 3) # by remaining depth: how far below alpha a quiet move still gets searched
+# Searcher settings findBestMoveParallel sends along to its pool workers with each root move
+WORKER_SETTINGS = ("quiescence", "quiescence_node_limit", "delta_margin", "lazy_legality", "staged_moves",
+                   "null_move", "late_move_reductions", "futility_pruning")
+TABLEBASE = True # look up positions with 3 pieces or fewer in the endgame tables, when they have been generated
+TABLEBASE_SCORE = CHECKMATE // 2 # score of a tablebase win, less the plies to mate so quicker mates score higher
+
+# move ordering scores, captures ranked by MVV-LVA (most valuable victim, least valuable attacker)
+HASH_MOVE_SCORE = 1000000
+PV_MOVE_SCORE = 900000
+CAPTURE_SCORE = 100000
+KILLER_SCORE = 90000 # first killer, the second one gets one less
+
+# transposition table bound types
+EXACT = 0
+LOWER_BOUND = 1 # the search failed high, the real score is at least the stored one
+UPPER_BOUND = 2 # the search failed low, the real score is at most the stored one
+
+'''
+Fixed size hash table of already searched positions, indexed by the low bits of GameState.zobrist_key.
+Each slot keeps the full key (to tell positions that share a slot apart), the depth it was searched to, the
+bound type, the score and the moveID of the best move. Entries are kept in parallel preallocated lists so the
+table never grows past its memory budget.
+Replacement policy: a slot is overwritten when it is empty, holds the same position, was written during an
+earlier search, or the new result was searched at least as deep as the stored one (depth-preferred).
+'''
+class TranspositionTable():
+    ENTRY_BYTES = 120 # rough cost of one slot across the lists, including the key int object
+
+    def __init__(self, size_mb=TT_SIZE_MB):
+        num_entries = 1
+        while num_entries * 2 * self.ENTRY_BYTES <= size_mb * 1024 * 1024:
+            num_entries *= 2
+        self.size = num_entries
+        self.mask = num_entries - 1
+        self.keys = [None] * num_entries
+        self.depths = [0] * num_entries
+        self.flags = [EXACT] * num_entries
+        self.scores = [0] * num_entries
+        self.best_moves = [None] * num_entries # moveID of the best move
+        self.generations = [0] * num_entries
+        self.generation = 0
+        self.resetCounters()
+
+    def resetCounters(self):
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0 # misses where the slot was taken by a different position
+        self.stores = 0
+        self.overwrites = 0 # stores that evicted a different position
+
+    '''
+    Called at the start of every search so entries from older searches get replaced first
+    '''
+    def newSearch(self):
+        self.generation += 1
+
+    def clear(self):
+        for i in range(self.size):
+            self.keys[i] = None
+        self.generation = 0
+        self.resetCounters()
+
+    '''
+    Returns (depth, flag, score, best move ID) for the position, or None if it isn't in the table
+    '''
+    def probe(self, key):
+        index = key & self.mask
+        stored_key = self.keys[index]
+        if stored_key == key:
+            self.hits += 1
+            return self.depths[index], self.flags[index], self.scores[index], self.best_moves[index]
+        self.misses += 1
+        if stored_key is not None:
+            self.collisions += 1
+        return None
+
+    def store(self, key, depth, flag, score, best_move):
+        index = key & self.mask
+        stored_key = self.keys[index]
+        if stored_key is not None and stored_key != key and self.generations[index] == self.generation \
+                and depth < self.depths[index]:
+            return # keep the deeper result from this search
+        if stored_key is not None and stored_key != key:
+            self.overwrites += 1
+        if best_move is None and stored_key == key:
+            best_move = self.best_moves[index] # keep the old best move rather than losing it
+        self.stores += 1
+        self.keys[index] = key
+        self.depths[index] = depth
+        self.flags[index] = flag
+        self.scores[index] = score
+        self.best_moves[index] = best_move
+        self.generations[index] = self.generation
+
+    '''
+    Hit/miss/collision counters and how full the table is, for sizing it per deployment
+    '''
+    def stats(self):
+        used = self.size - self.keys.count(None)
+        probes = self.hits + self.misses
+        return {"size_mb": self.size * self.ENTRY_BYTES / (1024 * 1024), "entries": self.size, "used": used,
+                "hits": self.hits, "misses": self.misses, "collisions": self.collisions,
+                "hit_rate": self.hits / probes if probes else 0.0,
+                "stores": self.stores, "overwrites": self.overwrites}
+
+'''
+Move the move with the given moveID (the best move from the transposition table) to the front of the list
+'''
+def orderHashMoveFirst(valid_moves, hash_move):
+    if hash_move is None:
+        return valid_moves
+    for i in range(len(valid_moves)):
+        if valid_moves[i].moveID == hash_move:
+            if i != 0:
+                valid_moves = [valid_moves[i]] + valid_moves[:i] + valid_moves[i+1:]
+            break
+    return valid_moves
 
 '''
 Picks and returns a random moves
@@ -47,91 +189,925 @@ def findBestMoveMinMaxNoRecursion(gs, valid_moves):
     return best_player_move
 
 '''
-Helper method to make the first recursive call
+Leave the moves in the order they were generated
 '''
-def findBestMove(gs, valid_moves):
-    global next_move, counter
-    next_move = None
-    random.shuffle(valid_moves)
-    counter = 0
-    # findMoveMinMax(gs, valid_moves, DEPTH, gs.white_to_move)
-    findMoveNegaMax(gs, valid_moves, DEPTH, 1 if gs.white_to_move else -1)
-    # findMoveNegaMaxAlphaBeta(gs, valid_moves, DEPTH, -CHECKMATE, CHECKMATE, 1 if gs.white_to_move else -1)
-    print(counter)
-    return next_move
+def noMoveOrdering(gs, valid_moves, ply, hash_move=None, pv_move=None):
+    return valid_moves
 
-def findMoveMinMax(gs, valid_moves, depth, white_to_move):
-    global next_move
-    if depth == 0:
-        return scoreMaterial(gs.board)
-    
-    if white_to_move:
+'''
+MVV-LVA key for sorting captures: most valuable victim first, then least valuable attacker
+'''
+def captureOrder(move):
+    score = 10 * piece_score[move.piece_captured[1]] - piece_score[move.piece_moved[1]] if move.is_capture else 0
+    if move.is_pawn_promotion:
+        score += 10 * piece_score[move.promotion_choice]
+    return score
+
+'''
+One search engine: its settings, the state of the search in progress, the statistics of the last search and its
+own transposition table, killer moves and history table. Searchers share nothing, so several can search
+different games at the same time from threads. Settings are plain attributes, change them between searches:
+depth, time_limit, node_limit, max_depth, workers, quiescence, quiescence_node_limit, delta_margin, lazy_legality,
+staged_moves, null_move, late_move_reductions, futility_pruning, move_ordering (None for orderMoves, or a
+function taking the same arguments as noMoveOrdering) and iteration_callback (for progress reports from
+iterative deepening). The root moves are shuffled with the searcher's own random number generator, seeded with
+seed
+'''
+class Searcher():
+    def __init__(self, depth=DEPTH, time_limit=TIME_LIMIT, node_limit=NODE_LIMIT, workers=WORKERS,
+                 hash_size_mb=TT_SIZE_MB, transposition_table=None, seed=None):
+        self.depth = depth
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.max_depth = MAX_DEPTH
+        self.workers = workers
+        self.quiescence = QUIESCENCE_SEARCH
+        self.quiescence_node_limit = QUIESCENCE_NODE_LIMIT
+        self.delta_margin = DELTA_MARGIN
+        self.lazy_legality = LAZY_LEGALITY
+        self.staged_moves = STAGED_MOVES
+        self.null_move = NULL_MOVE_PRUNING
+        self.late_move_reductions = LATE_MOVE_REDUCTIONS
+        self.futility_pruning = FUTILITY_PRUNING
+        self.tablebase = Tablebase.getTablebase() if TABLEBASE else None
+        self.move_ordering = None
+        self.iteration_callback = None # called with (depth, score) after each iteration of iterative deepening
+        self.random = random.Random(seed)
+        self.transposition_table = transposition_table if transposition_table is not None \
+            else TranspositionTable(hash_size_mb)
+        self.killer_moves = [[None] * KILLERS_PER_PLY for _ in range(MAX_DEPTH + 1)] # per ply, quiet moves that caused a cutoff
+        self.history_table = [[0] * 4096, [0] * 4096] # per side, indexed by the from/to bits of the moveID
+        self.next_move = None
+        self.counter = 0 # nodes searched, quiescence nodes included
+        self.quiescence_nodes = 0 # nodes visited by quiescenceSearch
+        self.quiescence_budget_end = QUIESCENCE_NODE_LIMIT # value of quiescence_nodes where quiescence stands pat
+        self.root_depth = depth # depth the current search started at, so the recursion knows when it is at the root
+        self.principal_variation = [] # moveIDs of the best line found by the last completed iteration
+        self.completed_depth = 0
+        self.deadline = None
+        self.max_nodes = None
+        self.stop_search = False
+        self.searching = False
+        self.start_time = 0.0
+        self.elapsed = 0.0
+        self.ponder_hits = 0 # opponent moves that were the reply a PonderSearch was searching
+        self.ponder_misses = 0
+        self.ponder_time_saved = 0.0 # seconds of ponder search the engine didn't have to spend on its own time
+        self.tablebase_hits = 0 # positions scored by the tablebase instead of searched
+        self.stage_counts = [0] * len(ChessEngine.STAGE_NAMES) # move stages generated, see GameState.getStagedMoves
+        self.null_move_cutoffs = 0 # nodes cut off by a null move search
+        self.reduced_moves = 0 # moves searched a ply shallower by late move reductions
+        self.reduced_researches = 0 # reduced moves that beat alpha and were searched again to full depth
+        self.futile_moves = 0 # quiet moves skipped by futility pruning
+
+    '''
+    Numbers from the last search, or from the one in progress when called from another thread
+    '''
+    def stats(self):
+        elapsed = time.perf_counter() - self.start_time if self.searching else self.elapsed
+        ponders = self.ponder_hits + self.ponder_misses
+        return {"nodes": self.counter, "quiescence_nodes": self.quiescence_nodes, "depth": self.completed_depth,
+                "searching_depth": self.root_depth if self.searching else self.completed_depth,
+                "time": elapsed, "nodes_per_second": self.counter / elapsed if elapsed else 0.0,
+                "ponder_hits": self.ponder_hits, "ponder_misses": self.ponder_misses,
+                "ponder_hit_rate": self.ponder_hits / ponders if ponders else 0.0,
+                "ponder_time_saved": self.ponder_time_saved, "tablebase_hits": self.tablebase_hits,
+                "move_stages": dict(zip(ChessEngine.STAGE_NAMES, self.stage_counts)),
+                "null_move_cutoffs": self.null_move_cutoffs, "reduced_moves": self.reduced_moves,
+                "reduced_researches": self.reduced_researches, "futile_moves": self.futile_moves,
+                "transposition_table": self.transposition_table.stats()}
+
+    '''
+    Ask the search running in another thread to give up as soon as possible. Its result should be thrown away.
+    A stop that comes in before the search starts still stops it
+    '''
+    def stop(self):
+        self.stop_search = True
+
+    '''
+    Forget the killers and age the history table between searches
+    '''
+    def resetMoveOrdering(self):
+        for killers in self.killer_moves:
+            for i in range(KILLERS_PER_PLY):
+                killers[i] = None
+        for table in self.history_table:
+            for i in range(4096):
+                table[i] >>= 1
+
+    '''
+    Sort the moves so the ones most likely to cause a cutoff are searched first: the transposition table move,
+    then the previous iteration's principal variation move, captures by MVV-LVA, killer moves and finally quiet
+    moves by their history score
+    '''
+    def orderMoves(self, gs, valid_moves, ply, hash_move=None, pv_move=None):
+        killers = self.killer_moves[ply] if ply < len(self.killer_moves) else ()
+        history = self.history_table[0 if gs.white_to_move else 1]
+        scored_moves = []
+        for move in valid_moves:
+            move_id = move.moveID
+            if move_id == hash_move:
+                score = HASH_MOVE_SCORE
+            elif move_id == pv_move:
+                score = PV_MOVE_SCORE
+            elif move.is_capture or move.is_pawn_promotion:
+                score = CAPTURE_SCORE + 10 * piece_score[move.piece_captured[1]] - piece_score[move.piece_moved[1]] \
+                        if move.is_capture else CAPTURE_SCORE
+                if move.is_pawn_promotion:
+                    score += 10 * piece_score[move.promotion_choice]
+            elif move_id in killers:
+                score = KILLER_SCORE - killers.index(move_id)
+            else:
+                score = history[move_id & 4095]
+            scored_moves.append((score, move))
+        scored_moves.sort(key=lambda scored_move: scored_move[0], reverse=True)
+        return [move for _, move in scored_moves]
+
+    '''
+    A quiet move caused a beta cutoff: remember it as a killer for this ply and reward it in the history table
+    '''
+    def updateQuietMoveStats(self, gs, move, ply, depth):
+        if ply < len(self.killer_moves):
+            killers = self.killer_moves[ply]
+            if killers[0] != move.moveID:
+                killers.insert(0, move.moveID)
+                killers.pop()
+        self.history_table[0 if gs.white_to_move else 1][move.moveID & 4095] += depth * depth
+
+    '''
+    Zero the statistics and set the limits for a new search
+    '''
+    def startSearch(self, time_limit=None, node_limit=None):
+        self.next_move = None
+        self.counter = 0
+        self.quiescence_nodes = 0
+        self.tablebase_hits = 0
+        self.stage_counts[:] = [0] * len(self.stage_counts)
+        self.null_move_cutoffs = 0
+        self.reduced_moves = 0
+        self.reduced_researches = 0
+        self.futile_moves = 0
+        self.completed_depth = 0
+        self.principal_variation = []
+        self.deadline = None if time_limit is None else time.time() + time_limit
+        self.max_nodes = node_limit
+        self.transposition_table.newSearch()
+        self.resetMoveOrdering()
+        self.start_time = time.perf_counter()
+        self.searching = True
+
+    def finishSearch(self):
+        self.elapsed = time.perf_counter() - self.start_time
+        self.searching = False
+        self.deadline = None
+        self.max_nodes = None
+        self.stop_search = False
+
+    '''
+    Helper method to make the first recursive call
+    '''
+    def findBestMove(self, gs, valid_moves, time_limit=None, node_limit=None, workers=None):
+        if time_limit is None:
+            time_limit = self.time_limit
+        if node_limit is None:
+            node_limit = self.node_limit
+        if workers is None:
+            workers = self.workers
+        if time_limit is not None or node_limit is not None:
+            return self.findBestMoveIterativeDeepening(gs, valid_moves, time_limit, node_limit)
+        if workers > 1:
+            return self.findBestMoveParallel(gs, valid_moves, workers)
+        tablebase_move = self.findTablebaseMove(gs, valid_moves)
+        if tablebase_move is not None:
+            return tablebase_move
+        self.random.shuffle(valid_moves)
+        self.startSearch()
+        self.root_depth = self.depth
+        self.resetQuiescenceBudget()
+        # self.findMoveMinMax(gs, valid_moves, self.depth, gs.white_to_move)
+        # self.findMoveNegaMax(gs, valid_moves, self.depth, 1 if gs.white_to_move else -1)
+        self.findMoveNegaMaxAlphaBeta(gs, valid_moves, self.depth, -CHECKMATE, CHECKMATE,
+                                      1 if gs.white_to_move else -1)
+        if not self.stop_search:
+            self.completed_depth = self.depth
+            self.principal_variation = self.getPrincipalVariation(gs, self.depth)
+        self.finishSearch()
+        return self.next_move
+
+    '''
+    Search depth 1, 2, 3, ... with alpha-beta until the time or node budget runs out and return the best move
+    of the last iteration that finished. Each iteration tries the previous iteration's principal variation first,
+    so the deeper searches mostly re-walk positions the transposition table already knows about.
+    '''
+    def findBestMoveIterativeDeepening(self, gs, valid_moves, time_limit=None, node_limit=None, max_depth=None):
+        if max_depth is None:
+            max_depth = self.max_depth
+        tablebase_move = self.findTablebaseMove(gs, valid_moves)
+        if tablebase_move is not None:
+            return tablebase_move
+        self.startSearch(time_limit, node_limit)
+        self.random.shuffle(valid_moves)
+        turn_multiplier = 1 if gs.white_to_move else -1
+        best_move = None
+        for depth in range(1, max_depth + 1):
+            self.next_move = None
+            self.root_depth = depth
+            self.resetQuiescenceBudget()
+            score = self.findMoveNegaMaxAlphaBeta(gs, valid_moves, depth, -CHECKMATE, CHECKMATE, turn_multiplier)
+            if self.stop_search:
+                break # the unfinished iteration's result can't be trusted
+            best_move = self.next_move
+            self.completed_depth = depth
+            self.principal_variation = self.getPrincipalVariation(gs, depth)
+            if self.iteration_callback is not None:
+                self.iteration_callback(depth, score)
+            if abs(score) >= CHECKMATE or not valid_moves:
+                break # found a forced mate, searching deeper won't change the move
+            if self.deadline is not None and time.time() >= self.deadline:
+                break
+        self.next_move = best_move
+        self.finishSearch()
+        return best_move
+
+    '''
+    Root-parallel fixed depth search. A serial search one ply shallower picks the move to try first, and a worker
+    searches it with a full window. Its score is then the shared alpha bound for all the other root moves, which
+    are handed out across the pool and only need to prove they are no better. Of the moves that beat the bound the
+    best one wins, ties going to the earlier move in MVV-LVA order. The bound is fixed before the other moves start
+    rather than raised as they finish, so the move returned doesn't depend on which worker finished first
+    '''
+    def findBestMoveParallel(self, gs, valid_moves, workers, depth=None):
+        if depth is None:
+            depth = self.depth
+        tablebase_move = self.findTablebaseMove(gs, valid_moves)
+        if tablebase_move is not None:
+            return tablebase_move
+        root_moves = sorted(valid_moves, key=lambda move: (-captureOrder(move), move.moveID))
+        self.startSearch()
+        if depth > 1 and len(root_moves) > 1:
+            self.root_depth = depth - 1
+            self.resetQuiescenceBudget()
+            self.findMoveNegaMaxAlphaBeta(gs, list(root_moves), depth - 1, -CHECKMATE, CHECKMATE,
+                                          1 if gs.white_to_move else -1)
+            if self.next_move is not None:
+                root_moves.remove(self.next_move)
+                root_moves.insert(0, self.next_move)
+        self.next_move = None
+        if not root_moves:
+            self.finishSearch()
+            return None
+        pool = getWorkerPool(workers)
+        settings = {name: getattr(self, name) for name in WORKER_SETTINGS}
+        settings["tablebase"] = self.tablebase is not None # each worker loads its own
+        first_result = pool.apply(searchRootMove, ((gs, root_moves[0].moveID, depth, -CHECKMATE, settings),))
+        alpha = first_result[0]
+        tasks = [(gs, move.moveID, depth, alpha, settings) for move in root_moves[1:]]
+        results = [first_result] + pool.map(searchRootMove, tasks, chunksize=1)
+        best_score = -CHECKMATE - 1
+        for move, (score, nodes, quiescence_nodes) in zip(root_moves, results):
+            self.counter += nodes
+            self.quiescence_nodes += quiescence_nodes
+            if score > best_score:
+                best_score = score
+                self.next_move = move
+        self.completed_depth = depth
+        self.finishSearch()
+        return self.next_move
+
+    '''
+    Score one root move for findBestMoveParallel, from a clean table so the result only depends on the position
+    '''
+    def searchRootMove(self, gs, move, depth, alpha):
+        self.transposition_table.clear()
+        self.startSearch()
+        self.root_depth = depth
+        self.resetQuiescenceBudget()
+        turn_multiplier = 1 if gs.white_to_move else -1
+        gs.makeMove(move)
+        score = -self.findMoveNegaMaxAlphaBeta(gs, gs.getValidMoves(), depth - 1, -CHECKMATE, -alpha,
+                                               -turn_multiplier, 1)
+        gs.undoMove()
+        self.counter += 1
+        self.finishSearch()
+        return score
+
+    '''
+    With 3 pieces or fewer every move's result is in the tablebase, so there is nothing to search: take the
+    quickest win, else a draw, else the slowest loss. None when the position isn't covered
+    '''
+    def findTablebaseMove(self, gs, valid_moves):
+        if self.tablebase is None or gs.piece_count > 3 or not valid_moves:
+            return None
+        best_move = None
+        best_score = -CHECKMATE
+        for move in valid_moves:
+            gs.makeMove(move)
+            result = self.tablebase.probe(gs)
+            gs.undoMove()
+            if result is None:
+                return None
+            score = -tablebaseScore(result, 1)
+            if best_move is None or score > best_score:
+                best_move = move
+                best_score = score
+        self.startSearch()
+        self.counter = len(valid_moves)
+        self.tablebase_hits = len(valid_moves)
+        self.next_move = best_move
+        self.completed_depth = 1
+        self.principal_variation = [best_move.moveID]
+        if self.iteration_callback is not None:
+            self.iteration_callback(1, best_score)
+        self.finishSearch()
+        return best_move
+
+    '''
+    Stop the search when it is over its time or node budget. Depth 1 always finishes so there is always a move
+    '''
+    def checkSearchLimits(self):
+        if self.root_depth <= 1:
+            return
+        if self.max_nodes is not None and self.counter >= self.max_nodes:
+            self.stop_search = True
+        elif self.deadline is not None and time.time() >= self.deadline:
+            self.stop_search = True
+
+    '''
+    Follow the best moves stored in the transposition table from the current position
+    '''
+    def getPrincipalVariation(self, gs, depth):
+        pv = []
+        for _ in range(depth):
+            entry = self.transposition_table.probe(gs.zobrist_key)
+            if entry is None or entry[3] is None:
+                break
+            move = ChessEngine.Move.fromMoveID(entry[3], gs)
+            if move.piece_moved[0] != ('w' if gs.white_to_move else 'b'):
+                break # stale entry, not a move in this position
+            pv.append(move.moveID)
+            gs.makeMove(move)
+        for _ in range(len(pv)):
+            gs.undoMove()
+        gs.getValidMoves() # restore the checkmate/stalemate flags of the root position
+        return pv
+
+    def findMoveMinMax(self, gs, valid_moves, depth, white_to_move):
+        if depth == 0:
+            return scoreMaterial(gs.board)
+        
+        if white_to_move:
+            max_score = -CHECKMATE
+            for move in valid_moves:
+                gs.makeMove(move)
+                next_moves = gs.getValidMoves()
+                score = self.findMoveMinMax(gs, next_moves, depth - 1, False)
+                if score > max_score:
+                    max_score = score
+                    if depth == self.depth:
+                        self.next_move = move
+                gs.undoMove()
+            return max_score
+        
+        else:
+            min_score = CHECKMATE
+            for move in valid_moves:
+                gs.makeMove(move)
+                next_moves = gs.getValidMoves()
+                score = self.findMoveMinMax(gs, next_moves, depth - 1, True)
+                if score < min_score:
+                    min_score = score
+                    if depth == self.depth:
+                        self.next_move = move
+                gs.undoMove()
+            return min_score
+
+    def findMoveNegaMax(self, gs, valid_moves, depth, turn_multiplier):
+        self.counter += 1
+        if depth == 0:
+            return turn_multiplier * scoreBoard(gs)
+        
+        entry = self.transposition_table.probe(gs.zobrist_key)
+        hash_move = None
+        if entry is not None:
+            entry_depth, flag, entry_score, hash_move = entry
+            if depth != self.root_depth and entry_depth >= depth and flag == EXACT: # position already searched deep enough
+                return entry_score
+            valid_moves = orderHashMoveFirst(valid_moves, hash_move)
+        
         max_score = -CHECKMATE
+        best_move = None
         for move in valid_moves:
             gs.makeMove(move)
             next_moves = gs.getValidMoves()
-            score = findMoveMinMax(gs, next_moves, depth - 1, False)
+            score = -self.findMoveNegaMax(gs, next_moves, depth-1, -turn_multiplier)
             if score > max_score:
                 max_score = score
-                if depth == DEPTH:
-                    next_move = move
+                best_move = move
+                if depth == self.root_depth:
+                    self.next_move = move
             gs.undoMove()
+        self.transposition_table.store(gs.zobrist_key, depth, EXACT, max_score, best_move.moveID if best_move else None)
         return max_score
-    
-    else:
-        min_score = CHECKMATE
+
+    '''
+    Alpha-beta search of the position to depth plies, the score is for the side to move. ply is the distance
+    from the root, which reductions keep from being root_depth - depth. Below the root it is selective, each part
+    switched by its setting: null-move pruning (allow_null is False right after a pass, so there are never two
+    in a row), late move reductions and futility pruning
+    '''
+    def findMoveNegaMaxAlphaBeta(self, gs, valid_moves, depth, alpha, beta, turn_multiplier, ply=0,
+                                 allow_null=True):
+        self.counter += 1
+        if gs.piece_count <= 3 and self.tablebase is not None and depth != self.root_depth:
+            result = self.tablebase.probe(gs)
+            if result is not None:
+                self.tablebase_hits += 1
+                return tablebaseScore(result, ply)
+        if depth == 0:
+            if valid_moves is None and not self.quiescence:
+                gs.getValidMoves() # sets the checkmate and stalemate flags scoreBoard looks at
+            if self.quiescence and not gs.checkmate and not gs.stalemate:
+                return self.quiescenceSearch(gs, alpha, beta, turn_multiplier)
+            return turn_multiplier * scoreBoard(gs)
+        if valid_moves is not None and not valid_moves:
+            return turn_multiplier * scoreBoard(gs) # checkmate or stalemate
+        self.checkSearchLimits()
+        if self.stop_search:
+            return 0 # the caller throws this iteration away
+        alpha_original = alpha
+        principal_variation = self.principal_variation
+        pv_move = principal_variation[ply] if ply < len(principal_variation) else None # previous iteration's line
+        hash_move = None
+        transposition_table = self.transposition_table
+        entry = transposition_table.probe(gs.zobrist_key)
+        if entry is not None:
+            entry_depth, flag, entry_score, hash_move = entry
+            entry_score = scoreFromTable(entry_score, ply)
+            if depth != self.root_depth and entry_depth >= depth:
+                if flag == EXACT:
+                    return entry_score
+                elif flag == LOWER_BOUND:
+                    alpha = max(alpha, entry_score)
+                elif flag == UPPER_BOUND:
+                    beta = min(beta, entry_score)
+                if alpha >= beta:
+                    return entry_score
+        static_score = turn_multiplier * gs.material_score
+        selective = depth != self.root_depth and (self.null_move or self.late_move_reductions or self.futility_pruning)
+        in_check = selective and gs.isInCheck()
+        # null-move pruning: let the opponent move twice in a row. If a shallower search says we are still at or
+        # above beta, a real move would almost surely be too, so don't look for one. Not in check, where passing
+        # is illegal, not near a mate score, and not with only king and pawns, where passing can be the best
+        # move there is (zugzwang) and the test would lie
+        if allow_null and self.null_move and selective and not in_check and depth > NULL_MOVE_REDUCTION and \
+                static_score >= beta and abs(beta) < TABLEBASE_SCORE // 2 and hasPieces(gs):
+            gs.makeNullMove()
+            next_moves = None if self.lazy_legality else gs.getValidMoves()
+            score = -self.findMoveNegaMaxAlphaBeta(gs, next_moves, depth - 1 - NULL_MOVE_REDUCTION, -beta,
+                                                   -beta + 1, -turn_multiplier, ply + 1, allow_null=False)
+            gs.undoNullMove()
+            if self.stop_search:
+                return 0
+            if score >= beta:
+                self.null_move_cutoffs += 1
+                return beta
+        # futility pruning: this close to the leaves a quiet move can't win back much material, so when even
+        # the margin doesn't get the score up to alpha only captures, promotions and checks are searched
+        futility_margin = None
+        if self.futility_pruning and selective and not in_check and depth < len(FUTILITY_MARGINS) and \
+                static_score + FUTILITY_MARGINS[depth] <= alpha and abs(alpha) < TABLEBASE_SCORE // 2:
+            futility_margin = FUTILITY_MARGINS[depth]
+        killers = tuple(self.killer_moves[ply]) if ply < len(self.killer_moves) else ()
+        # valid_moves is None when the parent left the moves to us: then they are pseudo-legal and each one is
+        # checked when it comes up, so moves after a cutoff never pay for it. Staged, the moves after a cutoff
+        # aren't even generated
+        lazy = valid_moves is None
+        if lazy and self.staged_moves and self.move_ordering is None:
+            valid_moves = gs.getStagedMoves(hash_move if hash_move is not None else pv_move, killers,
+                                            self.history_table[0 if gs.white_to_move else 1], self.stage_counts)
+        else:
+            if lazy:
+                valid_moves = gs.getPseudoLegalMoves()
+            move_ordering = self.move_ordering or self.orderMoves
+            valid_moves = move_ordering(gs, valid_moves, ply, hash_move, pv_move)
+        max_score = -CHECKMATE
+        best_move = None
+        legal_moves = 0
         for move in valid_moves:
+            if lazy and not gs.isLegal(move):
+                continue
+            legal_moves += 1
+            quiet = not move.is_capture and not move.is_pawn_promotion
+            # late move reductions: a quiet move this far down the ordering rarely turns out best, so it gets a
+            # shallower null window search first and only a full one if that beats alpha
+            reduce = self.late_move_reductions and selective and quiet and not in_check and \
+                depth >= LMR_MIN_DEPTH and legal_moves > LMR_FULL_MOVES and move.moveID != hash_move and \
+                move.moveID != pv_move and move.moveID not in killers
             gs.makeMove(move)
-            next_moves = gs.getValidMoves()
-            score = findMoveMinMax(gs, next_moves, depth - 1, True)
-            if score < min_score:
-                min_score = score
-                if depth == DEPTH:
-                    next_move = move
+            if (futility_margin is not None and quiet or reduce) and gs.isInCheck():
+                reduce = False # checking moves are always searched in full
+            elif futility_margin is not None and quiet:
+                gs.undoMove()
+                self.futile_moves += 1
+                max_score = max(max_score, static_score + futility_margin) # as much as the move could be worth
+                continue
+            next_moves = None if self.lazy_legality else gs.getValidMoves()
+            if reduce:
+                self.reduced_moves += 1
+                score = -self.findMoveNegaMaxAlphaBeta(gs, next_moves, depth - 2, -alpha - 1, -alpha, -turn_multiplier,
+                                                       ply + 1)
+                if score > alpha and not self.stop_search:
+                    self.reduced_researches += 1
+                    score = -self.findMoveNegaMaxAlphaBeta(gs, next_moves, depth-1, -beta, -alpha, -turn_multiplier,
+                                                           ply + 1)
+            else:
+                score = -self.findMoveNegaMaxAlphaBeta(gs, next_moves, depth-1, -beta, -alpha, -turn_multiplier,
+                                                       ply + 1)
+            if score > max_score:
+                max_score = score
+                best_move = move
+                if depth == self.root_depth:
+                    self.next_move = move
             gs.undoMove()
-        return min_score
+            if self.stop_search:
+                return 0
+            if max_score > alpha: # pruning happens
+                alpha = max_score
+            if alpha >= beta:
+                if not move.is_capture:
+                    self.updateQuietMoveStats(gs, move, ply, depth)
+                break
+        if legal_moves == 0:
+            return -CHECKMATE if gs.isInCheck() else STALEMATE # checkmate or stalemate, known only now
+        if max_score <= alpha_original:
+            flag = UPPER_BOUND
+        elif max_score >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        transposition_table.store(gs.zobrist_key, depth, flag, scoreToTable(max_score, ply),
+                                  best_move.moveID if best_move else None)
+        return max_score
 
+    '''
+    Give quiescenceSearch a fresh node budget for the search (or iteration) that is about to start
+    '''
+    def resetQuiescenceBudget(self):
+        self.quiescence_budget_end = self.quiescence_nodes + self.quiescence_node_limit
 
-def findMoveNegaMax(gs, valid_moves, depth, turn_multiplier):
-    global next_move, counter
-    counter += 1
-    if depth == 0:
-        return turn_multiplier * scoreBoard(gs)
-    
-    max_score = -CHECKMATE
-    for move in valid_moves:
-        gs.makeMove(move)
-        next_moves = gs.getValidMoves()
-        score = -findMoveNegaMax(gs, next_moves, depth-1, -turn_multiplier)
-        if score > max_score:
-            max_score = score
-            if depth == DEPTH:
-                next_move = move
-        gs.undoMove()
-    return max_score
+    '''
+    Search only captures and promotions (and every evasion when in check) below the horizon until the position is
+    quiet, so a leaf is never scored halfway through an exchange. The side to move may always "stand pat" and take
+    the static score instead of capturing, which bounds the score from below. Captures that can't lift the score to
+    alpha even if the captured piece comes for free are skipped (delta pruning). Once the search has used its
+    quiescence node budget every further leaf just stands pat
+    '''
+    def quiescenceSearch(self, gs, alpha, beta, turn_multiplier):
+        self.quiescence_nodes += 1
+        if self.quiescence_nodes >= self.quiescence_budget_end:
+            return turn_multiplier * gs.material_score # out of budget
+        self.checkSearchLimits()
+        if self.stop_search:
+            return 0
+        moves = gs.getCaptureMoves()
+        if gs.in_check:
+            if not moves:
+                return turn_multiplier * scoreBoard(gs) # checkmate
+            stand_pat = -CHECKMATE # no standing pat in check, every evasion is searched
+        else:
+            stand_pat = turn_multiplier * gs.material_score
+            if stand_pat >= beta:
+                return stand_pat
+            if stand_pat > alpha:
+                alpha = stand_pat
+        max_score = stand_pat
+        moves.sort(key=captureOrder, reverse=True)
+        for move in moves:
+            if stand_pat > -CHECKMATE and not move.is_pawn_promotion and \
+                    stand_pat + piece_score[move.piece_captured[1]] + self.delta_margin <= alpha:
+                continue
+            self.counter += 1
+            gs.makeMove(move)
+            score = -self.quiescenceSearch(gs, -beta, -alpha, -turn_multiplier)
+            gs.undoMove()
+            if self.stop_search:
+                return 0
+            if score > max_score:
+                max_score = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return max_score
+
+'''
+Runs searcher.findBestMove on a copy of the game in a daemon thread, so the caller can keep its event loop going
+and poll done(). The move found is returned from the caller's own valid_moves list
+'''
+class BackgroundSearch():
+    def __init__(self, searcher, gs, valid_moves, time_limit=None, node_limit=None):
+        self.searcher = searcher
+        self.valid_moves = valid_moves
+        self.gs = copy.deepcopy(gs) # the caller keeps using its game while the search makes and unmakes moves
+        self.best_move_id = None
+        self.cancelled = False
+        self.finished = False
+        self.start(searcher.findBestMove, time_limit, node_limit)
+
+    def start(self, search, *search_args):
+        self.thread = threading.Thread(target=self.run, args=(search, self.gs.getValidMoves()) + search_args,
+                                       daemon=True)
+        self.thread.start()
+
+    def run(self, search, valid_moves, *search_args):
+        try:
+            move = search(self.gs, valid_moves, *search_args)
+            if move is not None:
+                self.best_move_id = move.moveID
+        finally:
+            self.finished = True
+
+    def done(self):
+        return self.finished
+
+    '''
+    The move found, None if the search was cancelled (or there is no legal move)
+    '''
+    def result(self):
+        if self.cancelled:
+            return None
+        for move in self.valid_moves:
+            if move.moveID == self.best_move_id:
+                return move
+        return None
+
+    '''
+    moveID of the reply the search expects to the move it found (the second move of its principal variation),
+    None if it doesn't know one. Only valid until the searcher starts another search
+    '''
+    def expectedReply(self):
+        pv = self.searcher.principal_variation
+        if not self.cancelled and len(pv) > 1 and pv[0] == self.best_move_id:
+            return pv[1]
+        return None
+
+    '''
+    Depth, nodes, nodes per second, ... of the search so far, see Searcher.stats
+    '''
+    def progress(self):
+        return self.searcher.stats()
+
+    '''
+    Stop the search and wait for its thread to finish, so the searcher is free for the next search
+    '''
+    def cancel(self):
+        self.searcher.stop()
+        self.thread.join()
+        self.searcher.stop_search = False # the stop may have come after the search had already finished
+        self.cancelled = True
+
+'''
+Pondering: search the position after the opponent's expected reply while the opponent is still thinking. When
+the opponent plays that move, ponderHit turns this into the search for the engine's next move, with the time and
+node budget counted from when pondering began, so a ponder search that has already finished answers at once and
+an unfinished one carries on with everything it has put in the transposition table. When the opponent plays
+something else, ponderMiss throws it away. Fixed depth searches ponder to that depth, budgeted ones keep
+deepening until the opponent moves
+'''
+class PonderSearch(BackgroundSearch):
+    def __init__(self, searcher, gs, expected_reply, time_limit=None, node_limit=None):
+        self.searcher = searcher
+        self.valid_moves = [] # the caller's moves are only known once the opponent has moved
+        self.gs = copy.deepcopy(gs)
+        self.gs.makeMove(ChessEngine.Move.fromMoveID(expected_reply, self.gs))
+        self.zobrist_key = self.gs.zobrist_key
+        self.best_move_id = None
+        self.cancelled = False
+        self.finished = False
+        self.time_limit = searcher.time_limit if time_limit is None else time_limit
+        self.node_limit = searcher.node_limit if node_limit is None else node_limit
+        max_depth = searcher.max_depth if self.time_limit is not None or self.node_limit is not None else searcher.depth
+        self.start_time = time.perf_counter()
+        self.start(searcher.findBestMoveIterativeDeepening, None, None, max_depth)
+
+    '''
+    Whether gs, after the opponent's move, is the position being pondered
+    '''
+    def isHit(self, gs):
+        return gs.zobrist_key == self.zobrist_key
+
+    def ponderHit(self, valid_moves):
+        self.valid_moves = valid_moves
+        while not self.searcher.searching and not self.finished: # the thread may not have started searching yet
+            time.sleep(0.001)
+        if self.finished:
+            time_saved = self.searcher.elapsed
+        else:
+            time_saved = time.perf_counter() - self.start_time
+            if self.time_limit is not None:
+                self.searcher.deadline = time.time() + self.time_limit - time_saved
+            if self.node_limit is not None:
+                self.searcher.max_nodes = self.node_limit
+        self.searcher.ponder_hits += 1
+        self.searcher.ponder_time_saved += time_saved
+        return self
+
+    def ponderMiss(self):
+        self.cancel()
+        self.searcher.ponder_misses += 1
+
+worker_pool = None
+worker_pool_size = 0
+worker_searcher = None # each pool process searches its tasks with its own Searcher
+
+'''
+The pool findBestMoveParallel searches with, created on first use and kept for later moves
+'''
+def getWorkerPool(workers):
+    global worker_pool, worker_pool_size
+    if worker_pool is None or worker_pool_size != workers:
+        closeWorkerPool()
+        import multiprocessing # only here, it is the slowest import and most processes never search in parallel
+        worker_pool = multiprocessing.Pool(workers)
+        worker_pool_size = workers
+    return worker_pool
+
+def closeWorkerPool():
+    global worker_pool, worker_pool_size
+    if worker_pool is not None:
+        worker_pool.terminate()
+        worker_pool.join()
+        worker_pool = None
+        worker_pool_size = 0
+
+'''
+Search one root move in a pool process and return its score and node counts. A score above alpha is exact, at
+or below alpha only says the move is no better than alpha
+'''
+def searchRootMove(task):
+    global worker_searcher
+    gs, move_id, depth, alpha, settings = task
+    if worker_searcher is None:
+        worker_searcher = Searcher()
+    for name, value in settings.items():
+        if name == "tablebase":
+            worker_searcher.tablebase = Tablebase.getTablebase() if value else None
+        else:
+            setattr(worker_searcher, name, value)
+    score = worker_searcher.searchRootMove(gs, ChessEngine.Move.fromMoveID(move_id, gs), depth, alpha)
+    return score, worker_searcher.counter, worker_searcher.quiescence_nodes
+
+# The module level functions below search with one shared Searcher configured from the module settings above,
+# and copy its results back into these globals, for code written before there was a Searcher
+transposition_table = TranspositionTable()
+default_searcher = Searcher(transposition_table=transposition_table)
+default_searcher.random = random # so random.seed() still makes findBestMove repeatable
+killer_moves = default_searcher.killer_moves
+history_table = default_searcher.history_table
+next_move = None
+counter = 0
+quiescence_nodes = 0
+principal_variation = []
+
+'''
+Replace the transposition table with one using the given memory budget in megabytes
+'''
+def setHashSize(size_mb):
+    global transposition_table
+    transposition_table = TranspositionTable(size_mb)
+
+def orderMoves(gs, valid_moves, ply, hash_move=None, pv_move=None):
+    return default_searcher.orderMoves(gs, valid_moves, ply, hash_move, pv_move)
+
+# the ordering stage findMoveNegaMaxAlphaBeta uses, swap in noMoveOrdering (or your own) to compare
+move_ordering = orderMoves
+
+def resetMoveOrdering():
+    default_searcher.resetMoveOrdering()
+
+def updateQuietMoveStats(gs, move, ply, depth):
+    default_searcher.updateQuietMoveStats(gs, move, ply, depth)
+
+'''
+The shared Searcher with the current module settings
+'''
+def getDefaultSearcher():
+    searcher = default_searcher
+    searcher.depth = DEPTH
+    searcher.time_limit = TIME_LIMIT
+    searcher.node_limit = NODE_LIMIT
+    searcher.max_depth = MAX_DEPTH
+    searcher.workers = WORKERS
+    searcher.quiescence = QUIESCENCE_SEARCH
+    searcher.quiescence_node_limit = QUIESCENCE_NODE_LIMIT
+    searcher.delta_margin = DELTA_MARGIN
+    searcher.lazy_legality = LAZY_LEGALITY
+    searcher.staged_moves = STAGED_MOVES
+    if (searcher.tablebase is not None) != TABLEBASE:
+        searcher.tablebase = Tablebase.getTablebase() if TABLEBASE else None
+    searcher.null_move = NULL_MOVE_PRUNING
+    searcher.late_move_reductions = LATE_MOVE_REDUCTIONS
+    searcher.futility_pruning = FUTILITY_PRUNING
+    searcher.move_ordering = None if move_ordering is orderMoves else move_ordering
+    searcher.transposition_table = transposition_table
+    return searcher
+
+def publishSearchResults(searcher):
+    global next_move, counter, quiescence_nodes, principal_variation
+    next_move = searcher.next_move
+    counter = searcher.counter
+    quiescence_nodes = searcher.quiescence_nodes
+    principal_variation = searcher.principal_variation
+
+def findBestMove(gs, valid_moves, time_limit=None, node_limit=None, workers=None):
+    searcher = getDefaultSearcher()
+    move = searcher.findBestMove(gs, valid_moves, time_limit, node_limit, workers)
+    publishSearchResults(searcher)
+    return move
 
+def findBestMoveIterativeDeepening(gs, valid_moves, time_limit=None, node_limit=None, max_depth=MAX_DEPTH):
+    searcher = getDefaultSearcher()
+    move = searcher.findBestMoveIterativeDeepening(gs, valid_moves, time_limit, node_limit, max_depth)
+    publishSearchResults(searcher)
+    return move
+
+def findBestMoveParallel(gs, valid_moves, workers, depth=None):
+    searcher = getDefaultSearcher()
+    move = searcher.findBestMoveParallel(gs, valid_moves, workers, depth)
+    publishSearchResults(searcher)
+    return move
+
+def findMoveMinMax(gs, valid_moves, depth, white_to_move):
+    searcher = getDefaultSearcher()
+    score = searcher.findMoveMinMax(gs, valid_moves, depth, white_to_move)
+    publishSearchResults(searcher)
+    return score
+
+def findMoveNegaMax(gs, valid_moves, depth, turn_multiplier):
+    searcher = getDefaultSearcher()
+    searcher.root_depth = depth
+    score = searcher.findMoveNegaMax(gs, valid_moves, depth, turn_multiplier)
+    publishSearchResults(searcher)
+    return score
 
 def findMoveNegaMaxAlphaBeta(gs, valid_moves, depth, alpha, beta, turn_multiplier):
-    global next_move, counter
-    if depth == 0:
-        return turn_multiplier * scoreBoard(gs)
-    counter += 1
-    # move ordering - implement later
-    max_score = -CHECKMATE
-    for move in valid_moves:
-        gs.makeMove(move)
-        next_moves = gs.getValidMoves()
-        score = -findMoveNegaMaxAlphaBeta(gs, next_moves, depth-1, -beta, -alpha, -turn_multiplier)
-        if score > max_score:
-            max_score = score
-            if depth == DEPTH:
-                next_move = move
-        gs.undoMove()
-        if max_score > alpha: # pruning happens
-            alpha = max_score
-        if alpha >= beta:
-            break
-    return max_score
+    searcher = getDefaultSearcher()
+    searcher.root_depth = depth
+    score = searcher.findMoveNegaMaxAlphaBeta(gs, valid_moves, depth, alpha, beta, turn_multiplier)
+    publishSearchResults(searcher)
+    return score
+
+def quiescenceSearch(gs, alpha, beta, turn_multiplier):
+    searcher = getDefaultSearcher()
+    score = searcher.quiescenceSearch(gs, alpha, beta, turn_multiplier)
+    publishSearchResults(searcher)
+    return score
+
+'''
+Moves to mate for a score from the side to move's point of view, negative when it is getting mated, None when
+the score isn't a mate. A search sees a mate on the last ply of depth. A tablebase win scores TABLEBASE_SCORE
+less the plies to mate from the root
+'''
+def mateMoves(score, depth):
+    if abs(score) >= CHECKMATE:
+        plies = depth
+    elif abs(score) >= TABLEBASE_SCORE // 2:
+        plies = TABLEBASE_SCORE - abs(score)
+    else:
+        return None
+    return (plies + 1) // 2 if score > 0 else -(plies // 2)
+
+'''
+Whether the side to move has a piece besides its king and pawns. Without one, passing is often the best move
+there is (zugzwang), which null-move pruning would get wrong
+'''
+def hasPieces(gs):
+    color = 'w' if gs.white_to_move else 'b'
+    return any(square[0] == color and square[1] in "NBRQ" for row in gs.board for square in row)
+
+'''
+The score for the side to move of a tablebase (result, plies to mate) probed ply plies from the root, so a
+quicker mate scores higher wherever in the tree it is found
+'''
+def tablebaseScore(result, ply=0):
+    if result[0] == 0:
+        return STALEMATE
+    return result[0] * (TABLEBASE_SCORE - result[1] - ply)
+
+'''
+Tablebase scores count plies from the root, but a transposition table entry can be hit at any ply, so the
+table keeps them counted from its own position. scoreToTable converts a score for storing at ply and
+scoreFromTable converts it back
+'''
+def scoreToTable(score, ply):
+    if TABLEBASE_SCORE // 2 <= score < CHECKMATE:
+        return score + ply
+    if -CHECKMATE < score <= -TABLEBASE_SCORE // 2:
+        return score - ply
+    return score
+
+def scoreFromTable(score, ply):
+    return scoreToTable(score, -ply)
 
 '''
 A positive score is good for white, a negative score is good for black
@@ -145,15 +1121,7 @@ def scoreBoard(gs):
     elif gs.stalemate:
         return STALEMATE
     
-    score = 0
-    for row in gs.board:
-        for square in row:
-            if square[0] == 'w':
-                score += piece_score[square[1]]
-            elif square[0] == 'b':
-                score -= piece_score[square[1]]
-    
-    return score
+    return gs.material_score # kept up to date by makeMove/undoMove
 
 
 '''
@@ -0,0 +1,332 @@
+"""
+Endgame tablebases for king and one piece against a lone king (KQK, KRK, KPK), built by retrograde analysis.
+Every position is stored with its distance to mate, so the search can play these endings perfectly instead of
+scoring them by material and shuffling. KBK, KNK and KK are draws and need no table.
+
+python Tablebase.py generate              build the tables into tablebases/ (a few seconds each)
+python Tablebase.py probe --fen "<fen>"   the tablebase result of a position and of each of its moves
+python Tablebase.py stats                 table memory and probe latency
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import zlib
+
+import ChessEngine
+
+TABLEBASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablebases")
+TABLE_NAMES = {'Q': "KQvK", 'R': "KRvK", 'p': "KPvK"} # by the strong side's extra piece
+TABLE_EXTENSION = ".tb"
+TABLE_SIZE = 2 << 18 # side to move, strong king, weak king, piece: 1 + 6 + 6 + 6 bits
+WEAK_TO_MOVE = 1 << 18 # index bit set when the lone king is to move
+ESCAPED = 255 # counter value of a position where the lone king takes the piece or is stalemated
+
+# Square s is row*8 + col like the board, row 0 being the 8th rank. Tables are built with the strong side as white
+KING_MOVES = [[r2*8 + c2 for r2, c2 in ((s // 8 + dr, s % 8 + dc) for dr, dc in ChessEngine.KING_OFFSETS)
+               if 0 <= r2 < 8 and 0 <= c2 < 8] for s in range(64)]
+ADJACENT = [sum(1 << t for t in KING_MOVES[s]) for s in range(64)]
+KNIGHT_MOVES = [[r2*8 + c2 for r2, c2 in ((s // 8 + dr, s % 8 + dc) for dr, dc in ChessEngine.KNIGHT_OFFSETS)
+                 if 0 <= r2 < 8 and 0 <= c2 < 8] for s in range(64)]
+PAWN_ATTACKS = [sum(1 << ((s // 8 - 1)*8 + s % 8 + dc) for dc in (-1, 1) if s >= 8 and 0 <= s % 8 + dc < 8)
+                for s in range(64)] # squares a white pawn on s attacks
+SLIDER_DIRECTIONS = {'Q': ChessEngine.ORTHOGONAL_DIRECTIONS + ChessEngine.DIAGONAL_DIRECTIONS,
+                     'R': ChessEngine.ORTHOGONAL_DIRECTIONS}
+
+def buildRays(directions):
+    rays = []
+    for s in range(64):
+        square_rays = []
+        for dr, dc in directions:
+            ray = []
+            r, c = s // 8 + dr, s % 8 + dc
+            while 0 <= r < 8 and 0 <= c < 8:
+                ray.append(r*8 + c)
+                r, c = r + dr, c + dc
+            square_rays.append(ray)
+        rays.append(square_rays)
+    return rays
+
+RAYS = {piece: buildRays(directions) for piece, directions in SLIDER_DIRECTIONS.items()}
+
+'''
+For each (from, to) pair of squares (index from*64 + to) the mask of the squares in between when a piece of this
+kind moves along a line from one to the other, -1 when it can't
+'''
+def buildBetween(piece):
+    between = [-1] * 4096
+    for s in range(64):
+        for ray in RAYS[piece][s]:
+            mask = 0
+            for t in ray:
+                between[s*64 + t] = mask
+                mask |= 1 << t
+    return between
+
+BETWEEN = {piece: buildBetween(piece) for piece in RAYS}
+
+'''
+Does the strong side's piece on square s attack target, with pieces on the squares in blockers
+'''
+def attacks(piece, s, target, blockers):
+    if piece == 'p':
+        return PAWN_ATTACKS[s] >> target & 1
+    between = BETWEEN[piece][s*64 + target]
+    return between >= 0 and not between & blockers
+
+'''
+The squares the piece could have come from to reach s, in a position with the kings on wk and bk
+'''
+def unmoveSquares(piece, s, wk, bk):
+    if piece == 'p':
+        squares = []
+        if s // 8 < 6 and s + 8 != wk and s + 8 != bk:
+            squares.append(s + 8)
+            if s // 8 == 4 and s + 16 != wk and s + 16 != bk:
+                squares.append(s + 16) # the two square advance from the 2nd rank
+        return squares
+    squares = []
+    for ray in RAYS[piece][s]:
+        for t in ray:
+            if t == wk or t == bk:
+                break
+            squares.append(t)
+    return squares
+
+'''
+Build the table for one piece. Each entry is 0 for a draw (or an impossible position), otherwise the number of
+plies to mate plus one: a win when the strong side is to move, a loss when the lone king is. Mates are found
+first, then the search walks backwards from them one ply at a time: a strong side position one move before a
+lost position is won, and a lone king position is lost once every one of its moves leads to a won position.
+The pawn table starts from the queen and rook tables for its promotions, so those have to be passed in
+'''
+def generateTable(piece, promotion_tables=None):
+    values = bytearray(TABLE_SIZE)
+    counters = bytearray(TABLE_SIZE >> 1) # legal moves of the lone king not yet known to lose
+    frontier = []
+    seeds = {} # ply -> strong side positions won by promoting
+    for wk in range(64):
+        for bk in range(64):
+            if bk == wk or ADJACENT[wk] >> bk & 1:
+                continue
+            king_bits = wk << 12 | bk << 6
+            for s in range(64):
+                if s == wk or s == bk or (piece == 'p' and (s < 8 or s >= 56)):
+                    continue
+                index = king_bits | s
+                moves = 0
+                for t in KING_MOVES[bk]:
+                    if t == wk or ADJACENT[wk] >> t & 1:
+                        continue
+                    if t == s:
+                        moves = ESCAPED # the piece is undefended, taking it draws
+                        break
+                    if not attacks(piece, s, t, 1 << wk):
+                        moves += 1
+                if moves == 0:
+                    if attacks(piece, s, bk, 1 << wk):
+                        values[WEAK_TO_MOVE | index] = 1 # checkmate
+                        frontier.append(index)
+                    else:
+                        moves = ESCAPED # stalemate
+                counters[index] = moves
+                if piece == 'p' and s < 16 and s - 8 != wk and s - 8 != bk \
+                        and not attacks(piece, s, bk, 1 << wk):
+                    for table in promotion_tables:
+                        value = table[WEAK_TO_MOVE | king_bits | (s - 8)]
+                        if value:
+                            seeds.setdefault(value, []).append(index) # lost in value - 1 plies after promoting
+    ply = 0
+    last_seed = max(seeds) if seeds else 0
+    while frontier or ply < last_seed:
+        next_frontier = []
+        if ply % 2 == 0: # lone king to move and lost in ply plies
+            for index in frontier:
+                wk, bk, s = index >> 12, index >> 6 & 63, index & 63
+                for f in KING_MOVES[wk]:
+                    if f == bk or f == s or ADJACENT[f] >> bk & 1 or attacks(piece, s, bk, 1 << f):
+                        continue
+                    previous = f << 12 | bk << 6 | s
+                    if not values[previous]:
+                        values[previous] = ply + 2
+                        next_frontier.append(previous)
+                for f in unmoveSquares(piece, s, wk, bk):
+                    if attacks(piece, f, bk, 1 << wk):
+                        continue
+                    previous = index ^ s ^ f
+                    if not values[previous]:
+                        values[previous] = ply + 2
+                        next_frontier.append(previous)
+        else: # strong side to move and winning in ply plies
+            for index in frontier:
+                wk, bk, s = index >> 12, index >> 6 & 63, index & 63
+                for f in KING_MOVES[bk]:
+                    if f == wk or f == s or ADJACENT[wk] >> f & 1:
+                        continue
+                    previous = wk << 12 | f << 6 | s
+                    moves = counters[previous]
+                    if moves == ESCAPED or moves == 0:
+                        continue
+                    counters[previous] = moves - 1
+                    if moves == 1:
+                        values[WEAK_TO_MOVE | previous] = ply + 2
+                        next_frontier.append(previous)
+        ply += 1
+        for index in seeds.get(ply, ()): # promotions that mate in ply plies
+            if not values[index]:
+                values[index] = ply + 1
+                next_frontier.append(index)
+        frontier = next_frontier
+    return values
+
+def tablePath(directory, piece):
+    return os.path.join(directory, TABLE_NAMES[piece] + TABLE_EXTENSION)
+
+'''
+Generate all the tables into directory, stored zlib compressed
+'''
+def generateTables(directory=TABLEBASE_DIR):
+    os.makedirs(directory, exist_ok=True)
+    tables = {}
+    for piece in ('Q', 'R', 'p'): # the pawn table needs the queen and rook ones
+        start = time.perf_counter()
+        tables[piece] = generateTable(piece, (tables.get('Q'), tables.get('R')) if piece == 'p' else None)
+        data = zlib.compress(bytes(tables[piece]), 9)
+        with open(tablePath(directory, piece), "wb") as f:
+            f.write(data)
+        print("%s: %.1fs, %d bytes on disk, longest mate %d plies"
+              % (TABLE_NAMES[piece], time.perf_counter() - start, len(data), max(tables[piece]) - 1))
+    return tables
+
+'''
+The tables found in a directory. probe looks positions up in them
+'''
+class Tablebase():
+    def __init__(self, directory=TABLEBASE_DIR):
+        self.directory = directory
+        self.tables = {}
+        for piece in TABLE_NAMES:
+            path = tablePath(directory, piece)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    self.tables[piece] = zlib.decompress(f.read())
+        self.probes = 0
+        self.hits = 0
+
+    '''
+    (result, plies) for the side to move, result being 1 for a win, 0 for a draw and -1 for a loss and plies the
+    number of plies to mate when it isn't a draw. None when the position has more than 3 pieces, castling rights
+    or no table
+    '''
+    def probe(self, gs):
+        self.probes += 1
+        if gs.piece_count > 3 or gs.castling_rights:
+            return None
+        if gs.piece_count == 2:
+            self.hits += 1
+            return 0, 0
+        for r, row in enumerate(gs.board):
+            for c, square in enumerate(row):
+                if square != "--" and square[1] != 'K':
+                    piece_row, piece_col, color, piece = r, c, square[0], square[1]
+        if piece in ('B', 'N'):
+            self.hits += 1
+            return 0, 0 # a lone minor piece can't mate
+        table = self.tables.get(piece)
+        if table is None:
+            return None
+        wk = gs.white_king_location[0]*8 + gs.white_king_location[1]
+        bk = gs.black_king_location[0]*8 + gs.black_king_location[1]
+        s = piece_row*8 + piece_col
+        strong_to_move = gs.white_to_move == (color == 'w')
+        if color == 'b': # flip the board so the strong side is white
+            wk, bk, s = bk ^ 56, wk ^ 56, s ^ 56
+        value = table[(0 if strong_to_move else WEAK_TO_MOVE) | wk << 12 | bk << 6 | s]
+        self.hits += 1
+        if value == 0:
+            return 0, 0
+        return (1 if strong_to_move else -1), value - 1
+
+    def stats(self):
+        return {"tables": sorted(TABLE_NAMES[piece] for piece in self.tables),
+                "memory_bytes": sum(len(table) for table in self.tables.values()),
+                "probes": self.probes, "hits": self.hits}
+
+loaded_tablebase = None
+
+'''
+The tablebase in TABLEBASE_DIR, loaded on first use and shared. None when no tables have been generated
+'''
+def getTablebase():
+    global loaded_tablebase
+    if loaded_tablebase is None and os.path.isdir(TABLEBASE_DIR):
+        loaded_tablebase = Tablebase(TABLEBASE_DIR)
+    if loaded_tablebase is not None and not loaded_tablebase.tables:
+        return None
+    return loaded_tablebase
+
+def describe(result):
+    if result is None:
+        return "not in the tablebase"
+    if result[0] == 0:
+        return "draw"
+    return "%s in %d plies" % ("win" if result[0] > 0 else "loss", result[1])
+
+'''
+Random positions with the kings and one piece for timing probes
+'''
+def randomPositions(count, seed=0):
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        squares = rng.sample(range(64), 3)
+        piece = rng.choice(('wQ', 'wR', 'wp', 'bQ', 'bR', 'bp'))
+        if piece[1] == 'p' and (squares[2] < 8 or squares[2] >= 56):
+            continue
+        ranks = []
+        for r in range(8):
+            rank = ['1'] * 8
+            for square, name in zip(squares, ('wK', 'bK', piece)):
+                if square // 8 == r:
+                    rank[square % 8] = ChessEngine.PIECE_TO_FEN[name]
+            ranks.append(''.join(rank))
+        gs = ChessEngine.GameState.fromFen('/'.join(ranks) + (" w" if rng.random() < 0.5 else " b") + " - - 0 1")
+        if ADJACENT[squares[0]] >> squares[1] & 1:
+            continue
+        positions.append(gs)
+    return positions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate and probe the KQK, KRK and KPK tablebases")
+    parser.add_argument("command", choices=["generate", "probe", "stats"])
+    parser.add_argument("--fen", default="8/8/8/4k3/8/8/8/4K2Q w - - 0 1", help="position for probe")
+    parser.add_argument("--directory", default=TABLEBASE_DIR, help="where the tables are kept")
+    args = parser.parse_args(argv)
+    if args.command == "generate":
+        generateTables(args.directory)
+        return 0
+    tablebase = Tablebase(args.directory)
+    if not tablebase.tables:
+        print("no tables in %s, run python Tablebase.py generate first" % args.directory)
+        return 1
+    if args.command == "probe":
+        gs = ChessEngine.GameState.fromFen(args.fen)
+        print(args.fen + ": " + describe(tablebase.probe(gs)))
+        for move in gs.getValidMoves():
+            gs.makeMove(move)
+            print("  %-6s %s for the opponent" % (move.getChessNotation(), describe(tablebase.probe(gs))))
+            gs.undoMove()
+    else:
+        positions = randomPositions(10000)
+        start = time.perf_counter()
+        for gs in positions:
+            tablebase.probe(gs)
+        elapsed = time.perf_counter() - start
+        stats = tablebase.stats()
+        print("tables %s, %.0f KB in memory, %.2f us per probe"
+              % (" ".join(stats["tables"]), stats["memory_bytes"] / 1024, elapsed / len(positions) * 1e6))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+"""
+UCI (Universal Chess Interface) front end, so the engine can run headless under a chess GUI or a tournament
+manager such as cutechess-cli. Commands are read from stdin and answers written to stdout. Only the engine
+modules are imported here, pygame is only needed by ChessMain.
+
+python UciEngine.py                      speak UCI on stdin/stdout
+python UciEngine.py --backend bitboard   use the bitboard move generator
+"""
+import argparse
+import sys
+import threading
+import time
+
+import ChessEngine
+import SmartMoveFinder
+
+ENGINE_NAME = "Chess Engine"
+ENGINE_AUTHOR = "the Chess Engine authors"
+MOVE_OVERHEAD = 0.05 # seconds kept back from every move for the GUI and process overhead
+DEFAULT_MOVES_TO_GO = 30 # moves the remaining clock time is spread over when the GUI doesn't say
+
+'''
+One engine instance speaking UCI. The search runs in its own thread so that stop, ponderhit and isready are
+answered while it thinks
+'''
+class UciEngine():
+    def __init__(self, backend=None, output=sys.stdout):
+        self.backend = backend
+        self.output = output
+        self.output_lock = threading.Lock() # the search thread writes info lines while the main thread answers
+        self.searcher = SmartMoveFinder.Searcher(transposition_table=SmartMoveFinder.transposition_table)
+        self.searcher.iteration_callback = self.sendInfo
+        self.gs = ChessEngine.newGameState(backend)
+        self.search_thread = None
+        self.search_gs = None
+        self.pondering = False # go ponder or go infinite: bestmove waits for stop or ponderhit
+        self.ponder_limits = (None, None) # time and node limits that apply from ponderhit on
+        self.release = threading.Event() # set when a pondering/infinite search may report its move
+
+    def send(self, line):
+        with self.output_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    '''
+    Handle one line from the GUI, returns False when it is time to quit
+    '''
+    def handleCommand(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command = tokens[0]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Hash type spin default %d min 1 max 4096" % SmartMoveFinder.TT_SIZE_MB)
+            self.send("option name Ponder type check default false")
+            self.send("option name Backend type combo default %s var mailbox var bitboard"
+                      % (self.backend or ChessEngine.DEFAULT_BACKEND))
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.stopSearch()
+            self.setOption(tokens)
+        elif command == "ucinewgame":
+            self.stopSearch()
+            self.searcher.transposition_table.clear()
+            self.gs = ChessEngine.newGameState(self.backend)
+        elif command == "position":
+            self.stopSearch()
+            self.setPosition(tokens)
+        elif command == "go":
+            self.stopSearch()
+            self.go(tokens)
+        elif command == "stop":
+            self.stopSearch()
+        elif command == "ponderhit":
+            self.ponderHit()
+        elif command == "quit":
+            self.stopSearch()
+            return False
+        else:
+            self.send("info string unknown command " + command)
+        return True
+
+    '''
+    setoption name <name> value <value>
+    '''
+    def setOption(self, tokens):
+        if "name" not in tokens:
+            return
+        name_start = tokens.index("name") + 1
+        value_start = tokens.index("value") if "value" in tokens else len(tokens)
+        name = " ".join(tokens[name_start:value_start]).lower()
+        value = " ".join(tokens[value_start + 1:])
+        if name == "hash":
+            self.searcher.transposition_table = SmartMoveFinder.TranspositionTable(max(1, int(value)))
+        elif name == "backend" and value in ("mailbox", "bitboard"):
+            self.backend = value
+            self.gs = ChessEngine.newGameState(self.backend)
+        elif name != "ponder": # the GUI only tells us whether it will send go ponder, nothing to set up
+            self.send("info string unknown option " + name)
+
+    '''
+    position [startpos | fen <fen>] [moves <move1> ... <movei>]
+    '''
+    def setPosition(self, tokens):
+        moves_start = tokens.index("moves") if "moves" in tokens else len(tokens)
+        if len(tokens) > 1 and tokens[1] == "fen":
+            fen = " ".join(tokens[2:moves_start])
+        else:
+            fen = ChessEngine.START_FEN
+        try:
+            gs = ChessEngine.newGameState(self.backend, fen)
+        except ValueError as e:
+            self.send("info string bad fen: " + str(e))
+            return
+        for notation in tokens[moves_start + 1:]:
+            move = findMove(gs, notation)
+            if move is None:
+                self.send("info string illegal move " + notation)
+                break
+            gs.makeMove(move)
+        self.gs = gs
+
+    '''
+    go [wtime <ms>] [btime <ms>] [winc <ms>] [binc <ms>] [movestogo <n>] [movetime <ms>] [depth <n>] [nodes <n>]
+       [infinite] [ponder]
+    '''
+    def go(self, tokens):
+        params = {}
+        i = 1
+        while i < len(tokens):
+            if tokens[i] in ("infinite", "ponder"):
+                params[tokens[i]] = True
+                i += 1
+            else:
+                if i + 1 < len(tokens):
+                    try:
+                        params[tokens[i]] = int(tokens[i + 1])
+                    except ValueError:
+                        pass
+                i += 2
+        time_limit = self.allocateTime(params)
+        node_limit = params.get("nodes")
+        if "depth" in params:
+            max_depth = params["depth"]
+        elif time_limit is None and node_limit is None and "infinite" not in params and "ponder" not in params:
+            max_depth = self.searcher.depth # plain go, search to the engine's own depth
+        else:
+            max_depth = SmartMoveFinder.MAX_DEPTH
+        if "infinite" in params:
+            time_limit = node_limit = None
+        self.pondering = "infinite" in params or "ponder" in params
+        if "ponder" in params:
+            self.ponder_limits = (time_limit, node_limit)
+            time_limit = node_limit = None
+        self.release.clear()
+        self.search_gs = self.gs
+        self.search_thread = threading.Thread(target=self.search, args=(self.gs, time_limit, node_limit, max_depth),
+                                              daemon=True)
+        self.search_thread.start()
+
+    '''
+    Seconds to spend on this move from the go parameters, None when there is no clock
+    '''
+    def allocateTime(self, params):
+        if "movetime" in params:
+            return max(params["movetime"] / 1000 - MOVE_OVERHEAD, 0.01)
+        remaining = params.get("wtime" if self.gs.white_to_move else "btime")
+        if remaining is None:
+            return None
+        increment = params.get("winc" if self.gs.white_to_move else "binc", 0)
+        moves_to_go = max(params.get("movestogo", DEFAULT_MOVES_TO_GO), 1)
+        budget = min(remaining / moves_to_go + increment * 3 / 4, remaining / 2)
+        return max(budget / 1000 - MOVE_OVERHEAD, 0.01)
+
+    '''
+    Runs on the search thread. A bestmove always goes out, even when the search fails, or the GUI would wait on it
+    forever
+    '''
+    def search(self, gs, time_limit, node_limit, max_depth):
+        best_move = ponder_move = None
+        try:
+            valid_moves = gs.getValidMoves()
+            best_move = self.searcher.findBestMoveIterativeDeepening(gs, valid_moves, time_limit, node_limit,
+                                                                     max_depth)
+            if best_move is None and valid_moves:
+                best_move = valid_moves[0] # stopped before depth 1 finished
+            pv = self.searcher.principal_variation
+            if best_move is not None and len(pv) > 1 and pv[0] == best_move.moveID:
+                gs.makeMove(best_move)
+                ponder_move = findMove(gs, pv[1])
+                gs.undoMove()
+        except Exception as error:
+            self.send("info string search failed: %s: %s" % (type(error).__name__, error))
+        finally:
+            if self.pondering:
+                self.release.wait() # the GUI has to say stop or ponderhit before it gets a move
+            if best_move is None:
+                self.send("bestmove 0000")
+            elif ponder_move is None:
+                self.send("bestmove " + best_move.getChessNotation())
+            else:
+                self.send("bestmove " + best_move.getChessNotation() + " ponder " + ponder_move.getChessNotation())
+
+    '''
+    The opponent played the move we were pondering on: carry on as a normal search with the go limits counted
+    from now
+    '''
+    def ponderHit(self):
+        if self.search_thread is None or not self.pondering:
+            return
+        time_limit, node_limit = self.ponder_limits
+        while not self.searcher.searching and self.search_thread.is_alive(): # it may not have started yet
+            time.sleep(0.001)
+        if time_limit is not None:
+            self.searcher.deadline = time.time() + time_limit
+        if node_limit is not None:
+            self.searcher.max_nodes = self.searcher.counter + node_limit
+        self.pondering = False
+        self.release.set()
+
+    '''
+    Stop the search, if there is one, and wait for it to send its bestmove
+    '''
+    def stopSearch(self):
+        if self.search_thread is None:
+            return
+        self.searcher.stop()
+        self.release.set()
+        self.search_thread.join()
+        self.searcher.stop_search = False # the stop may have come after the search had already finished
+        self.search_thread = None
+
+    '''
+    Iterative deepening finished a depth, runs on the search thread
+    '''
+    def sendInfo(self, depth, score):
+        stats = self.searcher.stats()
+        mate = SmartMoveFinder.mateMoves(score, depth)
+        if mate is not None:
+            score_text = "mate %d" % mate
+        else:
+            score_text = "cp %d" % (score * 100)
+        pv = []
+        gs = self.search_gs
+        for move_id in self.searcher.principal_variation:
+            move = ChessEngine.Move.fromMoveID(move_id, gs)
+            pv.append(move.getChessNotation())
+            gs.makeMove(move)
+        for _ in range(len(pv)):
+            gs.undoMove()
+        self.send("info depth %d score %s nodes %d nps %d time %d pv %s"
+                  % (depth, score_text, stats["nodes"], stats["nodes_per_second"], stats["time"] * 1000, " ".join(pv)))
+
+'''
+The legal move in gs with the given UCI notation (e2e4, e7e8q) or moveID, None if there is none
+'''
+def findMove(gs, move):
+    for valid_move in gs.getValidMoves():
+        if valid_move.getChessNotation() == move or valid_move.moveID == move:
+            return valid_move
+    return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the engine over the UCI protocol on stdin/stdout")
+    parser.add_argument("--backend", choices=["mailbox", "bitboard"], help="defaults to $CHESS_BACKEND or mailbox")
+    args = parser.parse_args(argv)
+    engine = UciEngine(args.backend)
+    while True:
+        line = sys.stdin.readline()
+        if not line or not engine.handleCommand(line):
+            break
+    engine.stopSearch()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())